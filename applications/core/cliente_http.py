@@ -0,0 +1,217 @@
+"""
+Cliente HTTP compartilhado para serviços externos (Nominatim, IBGE...).
+
+Cada serviço configurado em settings.CLIENTES_HTTP ganha, por processo, um cliente com:
+
+- sessão `requests` com keep-alive e pool de conexões;
+- limite de taxa em balde de fichas compartilhado entre os workers da máquina
+  (estado em um arquivo protegido por flock);
+- novas tentativas limitadas, com backoff exponencial e jitter, para erros de
+  conexão, timeouts e respostas 429/5xx;
+- disjuntor (circuit breaker): depois de N falhas seguidas, as chamadas falham na
+  hora durante alguns segundos, em vez de prender o worker esperando o timeout.
+
+O transporte (quem de fato envia a requisição) é plugável, o que permite testar
+contra um servidor local. Todos os erros herdam de requests.RequestException.
+"""
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .medicao import trecho
+
+try:
+    import fcntl
+except ImportError:  # Windows: o limite vale apenas dentro do processo
+    fcntl = None
+
+STATUS_REPETIVEIS = {429, 502, 503, 504}
+
+PADRAO = {
+    'taxa': 5.0,                 # fichas por segundo
+    'capacidade': 5,             # rajada máxima
+    'espera_maxima': 2.0,        # segundos aguardando uma ficha antes de desistir
+    'timeout': (3.05, 10),       # (conexão, leitura)
+    'tentativas': 2,             # novas tentativas além da primeira
+    'backoff': 0.5,              # base do backoff exponencial, em segundos
+    'falhas_para_abrir': 5,
+    'pausa_disjuntor': 30.0,     # segundos com o disjuntor aberto
+    'conexoes': 10,              # tamanho do pool por host
+}
+
+
+class LimiteTaxaExcedido(requests.exceptions.RequestException):
+    """Nenhuma ficha disponível dentro de espera_maxima."""
+
+
+class DisjuntorAberto(requests.exceptions.RequestException):
+    """O serviço falhou seguidamente; a chamada nem foi feita."""
+
+
+class BaldeDeFichas:
+    """Token bucket compartilhado entre processos por um arquivo de estado."""
+
+    def __init__(self, caminho, taxa, capacidade):
+        self.caminho = caminho
+        self.taxa = float(taxa)
+        self.capacidade = float(capacidade)
+        self._lock = threading.Lock()
+
+    def _tentar(self):
+        """Consome uma ficha e retorna 0, ou retorna quantos segundos faltam para a próxima."""
+        with self._lock, open(self.caminho, 'a+') as arquivo:
+            if fcntl:
+                fcntl.flock(arquivo, fcntl.LOCK_EX)
+            try:
+                arquivo.seek(0)
+                try:
+                    fichas, instante = json.loads(arquivo.read())
+                except ValueError:
+                    fichas, instante = self.capacidade, time.time()
+                agora = time.time()
+                fichas = min(self.capacidade, fichas + max(agora - instante, 0) * self.taxa)
+                espera = 0.0
+                if fichas >= 1:
+                    fichas -= 1
+                else:
+                    espera = (1 - fichas) / self.taxa
+                arquivo.seek(0)
+                arquivo.truncate()
+                arquivo.write(json.dumps([fichas, agora]))
+                arquivo.flush()
+                return espera
+            finally:
+                if fcntl:
+                    fcntl.flock(arquivo, fcntl.LOCK_UN)
+
+    def adquirir(self, espera_maxima):
+        limite = time.monotonic() + espera_maxima
+        while True:
+            espera = self._tentar()
+            if not espera:
+                return
+            if time.monotonic() + espera > limite:
+                raise LimiteTaxaExcedido(f'Limite de {self.taxa:g} requisições/s atingido.')
+            time.sleep(espera)
+
+
+class Disjuntor:
+
+    def __init__(self, falhas_para_abrir, pausa):
+        self.falhas_para_abrir = falhas_para_abrir
+        self.pausa = pausa
+        self._falhas = 0
+        self._aberto_ate = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def aberto(self):
+        return time.monotonic() < self._aberto_ate
+
+    def verificar(self):
+        with self._lock:
+            if self.aberto:
+                raise DisjuntorAberto('Serviço indisponível; novas tentativas suspensas temporariamente.')
+            if self._falhas >= self.falhas_para_abrir:
+                # Meio-aberto: deixa uma chamada de teste passar e reabre se ela falhar
+                self._aberto_ate = time.monotonic() + self.pausa
+
+    def sucesso(self):
+        with self._lock:
+            self._falhas = 0
+            self._aberto_ate = 0.0
+
+    def falha(self):
+        with self._lock:
+            self._falhas += 1
+            if self._falhas >= self.falhas_para_abrir:
+                self._aberto_ate = time.monotonic() + self.pausa
+
+
+def transporte_requests(conexoes):
+    """Transporte padrão: uma Session com keep-alive e pool de conexões."""
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes)
+    sessao.mount('https://', adaptador)
+    sessao.mount('http://', adaptador)
+    return sessao.request
+
+
+class ClienteHTTP:
+
+    def __init__(self, nome, transporte=None, **opcoes):
+        self.nome = nome
+        self.opcoes = {**PADRAO, **opcoes}
+        self.transporte = transporte or transporte_requests(self.opcoes['conexoes'])
+        pasta = getattr(settings, 'CLIENTES_HTTP_DIRETORIO', None) or os.path.join(
+            tempfile.gettempdir(), 'voz_do_povo_http'
+        )
+        os.makedirs(pasta, exist_ok=True)
+        self.balde = BaldeDeFichas(
+            os.path.join(pasta, f'{nome}.balde'), self.opcoes['taxa'], self.opcoes['capacidade']
+        )
+        self.disjuntor = Disjuntor(self.opcoes['falhas_para_abrir'], self.opcoes['pausa_disjuntor'])
+
+    def _espera_backoff(self, tentativa, resposta=None):
+        if resposta is not None and resposta.headers.get('Retry-After', '').isdigit():
+            return min(float(resposta.headers['Retry-After']), self.opcoes['espera_maxima'])
+        return random.uniform(0, self.opcoes['backoff'] * (2 ** tentativa))  # Jitter completo
+
+    def request(self, metodo, url, **kwargs):
+        # Esperas por ficha e backoff contam: é tempo que a requisição passou por causa do serviço
+        with trecho('http'):
+            return self._request(metodo, url, **kwargs)
+
+    def _request(self, metodo, url, **kwargs):
+        kwargs.setdefault('timeout', self.opcoes['timeout'])
+        self.disjuntor.verificar()
+
+        tentativa = 0
+        while True:
+            self.balde.adquirir(self.opcoes['espera_maxima'])
+            try:
+                resposta = self.transporte(metodo, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.disjuntor.falha()
+                if tentativa >= self.opcoes['tentativas'] or self.disjuntor.aberto:
+                    raise
+                time.sleep(self._espera_backoff(tentativa))
+            else:
+                if resposta.status_code not in STATUS_REPETIVEIS:
+                    if resposta.status_code >= 500:
+                        self.disjuntor.falha()
+                    else:
+                        self.disjuntor.sucesso()
+                    return resposta
+                self.disjuntor.falha()
+                if tentativa >= self.opcoes['tentativas'] or self.disjuntor.aberto:
+                    return resposta
+                time.sleep(self._espera_backoff(tentativa, resposta))
+            tentativa += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+
+_clientes = {}
+_clientes_lock = threading.Lock()
+
+
+def cliente(nome):
+    """Cliente do serviço `nome`, configurado em settings.CLIENTES_HTTP (um por processo)."""
+    with _clientes_lock:
+        if nome not in _clientes:
+            _clientes[nome] = ClienteHTTP(nome, **getattr(settings, 'CLIENTES_HTTP', {}).get(nome, {}))
+        return _clientes[nome]
+
+
+def descartar_clientes():
+    with _clientes_lock:
+        _clientes.clear()
@@ -0,0 +1,145 @@
+"""
+Medição por requisição: consultas e tempo no banco, acertos e faltas de cache e
+tempo gasto fora do processo (chamadas HTTP, envio de arquivos ao storage).
+
+MedicaoMiddleware mede a duração de toda requisição e, numa fração delas
+(MEDICAO_AMOSTRAGEM), o detalhamento. O resultado vai no cabeçalho Server-Timing
+(visível nas ferramentas de desenvolvedor do navegador) e num registro de acesso
+estruturado (logger "applications.core.acesso").
+
+O detalhamento custa um execute_wrapper nas conexões do banco e um par de
+perf_counter por trecho medido. Quem faz I/O externo marca o trecho com
+`trecho('http')` / `trecho('armazenamento')` e os caches chamam `contar_cache`;
+fora de uma requisição medida as duas coisas não fazem nada.
+"""
+import logging
+import random
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+from . import metricas
+from .registro import evento
+
+logger = logging.getLogger('applications.core.acesso')
+
+_atual = ContextVar('medicao', default=None)
+
+
+class Medicao:
+
+    def __init__(self):
+        self.consultas = 0
+        self.tempo_banco = 0.0
+        self.cache_acertos = 0
+        self.cache_faltas = 0
+        self.trechos = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper das conexões do banco
+        inicio = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tempo_banco += perf_counter() - inicio
+            self.consultas += 1
+
+
+def atual():
+    """Medição detalhada da requisição em andamento, ou None."""
+    return _atual.get()
+
+
+def contar_cache(acerto):
+    medicao = _atual.get()
+    if medicao is None:
+        return
+    if acerto:
+        medicao.cache_acertos += 1
+    else:
+        medicao.cache_faltas += 1
+
+
+@contextmanager
+def trecho(nome):
+    """Soma a duração do bloco ao trecho `nome` da requisição em andamento."""
+    medicao = _atual.get()
+    if medicao is None:
+        yield
+        return
+    inicio = perf_counter()
+    try:
+        yield
+    finally:
+        medicao.trechos[nome] += perf_counter() - inicio
+
+
+def _ms(segundos):
+    return round(segundos * 1000, 1)
+
+
+class MedicaoMiddleware:
+    """Também alimenta as métricas por view e ação do /api/metrics/ (ver metricas.py)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Views do DRF guardam a classe e, nos viewsets, o mapa método -> ação
+        classe = getattr(view_func, 'cls', None)
+        acoes = getattr(view_func, 'actions', None) or {}
+        request._view_medida = (
+            classe.__name__ if classe else getattr(view_func, '__name__', 'desconhecida'),
+            acoes.get(request.method.lower(), ''),
+        )
+
+    def __call__(self, request):
+        inicio = perf_counter()
+        medicao = Medicao() if random.random() < settings.MEDICAO_AMOSTRAGEM else None
+        if medicao is None:
+            response = self.get_response(request)
+        else:
+            token = _atual.set(medicao)
+            try:
+                with ExitStack() as pilha:
+                    for conexao in connections.all():
+                        pilha.enter_context(conexao.execute_wrapper(medicao))
+                    response = self.get_response(request)
+            finally:
+                _atual.reset(token)
+        duracao = perf_counter() - inicio
+
+        partes = [f'total;dur={_ms(duracao)}']
+        campos = {}
+        if medicao is not None:
+            partes.append(f'db;desc="{medicao.consultas} consultas";dur={_ms(medicao.tempo_banco)}')
+            partes.append(f'cache;desc="acertos={medicao.cache_acertos} faltas={medicao.cache_faltas}"')
+            partes.extend(f'{nome};dur={_ms(segundos)}' for nome, segundos in sorted(medicao.trechos.items()))
+            campos = {
+                'consultas': medicao.consultas, 'banco_ms': _ms(medicao.tempo_banco),
+                'cache_acertos': medicao.cache_acertos, 'cache_faltas': medicao.cache_faltas,
+                **{f'{nome}_ms': _ms(segundos) for nome, segundos in medicao.trechos.items()},
+            }
+        response['Server-Timing'] = ', '.join(partes)
+
+        # Sem view resolvida (404 de rota) tudo cai em "desconhecida", para não criar uma série por caminho
+        view, acao = getattr(request, '_view_medida', ('desconhecida', ''))
+        metricas.observar(metricas.REQUISICAO_SEGUNDOS, duracao, view=view, acao=acao)
+        metricas.incrementar(
+            metricas.RESPOSTAS, view=view, acao=acao, metodo=request.method, status=response.status_code
+        )
+        if medicao is not None:
+            metricas.observar(metricas.CONSULTAS_POR_REQUISICAO, medicao.consultas, view=view, acao=acao)
+
+        correspondencia = getattr(request, 'resolver_match', None)
+        evento(
+            logger, 'requisicao',
+            metodo=request.method, caminho=request.path,
+            rota=correspondencia.view_name if correspondencia else None,
+            status=response.status_code, duracao_ms=_ms(duracao), **campos,
+        )
+        return response
@@ -0,0 +1,214 @@
+"""
+Métricas no formato de texto do Prometheus, somadas entre os workers do gunicorn.
+
+Cada processo grava os seus valores num arquivo próprio (METRICAS_DIRETORIO/<pid>.db),
+mapeado em memória: incrementar é somar um float64 numa posição fixa, sem trava
+entre processos nem I/O de sistema a cada observação. A coleta (GET /api/metrics/,
+em qualquer worker) lê todos os arquivos do diretório e soma os valores por chave;
+não toca no banco. Arquivos de workers já encerrados continuam somando, como
+contadores devem (o diretório é esvaziado a cada deploy, por ficar no /tmp do
+container).
+
+Formato do arquivo: 8 bytes de cabeçalho (quantos bytes estão em uso) e, para cada
+chave, [tamanho da chave (4 bytes)][chave em UTF-8][preenchimento][valor float64],
+com o valor alinhado em 8 bytes. O cabeçalho só é atualizado depois que a entrada
+foi escrita, então quem lê nunca enxerga uma entrada pela metade.
+"""
+import glob
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+TAMANHO_INICIAL = 64 * 1024
+
+BALDES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BALDES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100)
+
+_metricas = {}  # nome -> (tipo, ajuda, baldes)
+
+
+def _diretorio():
+    return getattr(settings, 'METRICAS_DIRETORIO', None) or os.path.join(
+        tempfile.gettempdir(), 'voz_do_povo_metricas'
+    )
+
+
+class ArquivoMetricas:
+    """Valores de um processo, por chave, num arquivo mapeado em memória."""
+
+    def __init__(self, caminho):
+        self._arquivo = open(caminho, 'a+b')
+        if os.fstat(self._arquivo.fileno()).st_size == 0:
+            self._arquivo.truncate(TAMANHO_INICIAL)
+        self._mmap = mmap.mmap(self._arquivo.fileno(), 0)
+        if self._usado() == 0:
+            struct.pack_into('Q', self._mmap, 0, 8)
+        self._posicoes = {chave: posicao for chave, posicao, _ in _entradas(self._mmap)}
+        self._trava = threading.Lock()
+
+    def _usado(self):
+        return struct.unpack_from('Q', self._mmap, 0)[0]
+
+    def _nova(self, chave):
+        codificada = chave.encode('utf-8')
+        preenchimento = (8 - (4 + len(codificada)) % 8) % 8
+        tamanho = 4 + len(codificada) + preenchimento + 8
+        usado = self._usado()
+        if usado + tamanho > len(self._mmap):
+            novo_tamanho = max(len(self._mmap) * 2, usado + tamanho)
+            self._mmap.close()
+            self._arquivo.truncate(novo_tamanho)
+            self._mmap = mmap.mmap(self._arquivo.fileno(), 0)
+        struct.pack_into(f'i{len(codificada)}s', self._mmap, usado, len(codificada), codificada)
+        posicao = usado + tamanho - 8
+        struct.pack_into('d', self._mmap, posicao, 0.0)
+        struct.pack_into('Q', self._mmap, 0, usado + tamanho)
+        self._posicoes[chave] = posicao
+        return posicao
+
+    def somar(self, incrementos):
+        """Soma {chave: delta} de uma vez, sob uma única trava."""
+        with self._trava:
+            for chave, delta in incrementos.items():
+                posicao = self._posicoes.get(chave)
+                if posicao is None:
+                    posicao = self._nova(chave)
+                valor = struct.unpack_from('d', self._mmap, posicao)[0]
+                struct.pack_into('d', self._mmap, posicao, valor + delta)
+
+    def fechar(self):
+        self._mmap.close()
+        self._arquivo.close()
+
+
+def _entradas(dados):
+    usado = struct.unpack_from('Q', dados, 0)[0]
+    posicao = 8
+    while posicao < usado:
+        tamanho_chave = struct.unpack_from('i', dados, posicao)[0]
+        chave = bytes(dados[posicao + 4:posicao + 4 + tamanho_chave]).decode('utf-8')
+        preenchimento = (8 - (4 + tamanho_chave) % 8) % 8
+        posicao_valor = posicao + 4 + tamanho_chave + preenchimento
+        yield chave, posicao_valor, struct.unpack_from('d', dados, posicao_valor)[0]
+        posicao = posicao_valor + 8
+
+
+_processo = None  # (pid, diretório, ArquivoMetricas)
+_processo_trava = threading.Lock()
+
+
+def _arquivo_do_processo():
+    global _processo
+    pid, diretorio = os.getpid(), _diretorio()
+    atual = _processo
+    if atual is not None and atual[0] == pid and atual[1] == diretorio:
+        return atual[2]
+    with _processo_trava:
+        # Primeira métrica do processo, ou primeira depois de um fork
+        if _processo is None or _processo[:2] != (pid, diretorio):
+            os.makedirs(diretorio, exist_ok=True)
+            _processo = (pid, diretorio, ArquivoMetricas(os.path.join(diretorio, f'{pid}.db')))
+        return _processo[2]
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _chave(nome, rotulos):
+    if not rotulos:
+        return nome
+    return nome + '{' + ','.join(f'{rotulo}="{_escapar(valor)}"' for rotulo, valor in rotulos.items()) + '}'
+
+
+def _registrar(nome, tipo, ajuda, baldes=None):
+    _metricas[nome] = (tipo, ajuda, baldes)
+    return nome
+
+
+def incrementar(nome, valor=1, **rotulos):
+    _arquivo_do_processo().somar({_chave(nome, rotulos): valor})
+
+
+def observar(nome, valor, **rotulos):
+    """Registra `valor` no histograma `nome` (baldes cumulativos, _sum e _count)."""
+    _, _, baldes = _metricas[nome]
+    incrementos = {
+        _chave(f'{nome}_bucket', {**rotulos, 'le': limite}): 1 for limite in baldes if valor <= limite
+    }
+    incrementos[_chave(f'{nome}_bucket', {**rotulos, 'le': '+Inf'})] = 1
+    incrementos[_chave(f'{nome}_sum', rotulos)] = valor
+    incrementos[_chave(f'{nome}_count', rotulos)] = 1
+    _arquivo_do_processo().somar(incrementos)
+
+
+def coletar():
+    """Texto de exposição do Prometheus com a soma dos arquivos de todos os processos."""
+    totais = defaultdict(float)
+    for caminho in glob.glob(os.path.join(_diretorio(), '*.db')):
+        try:
+            with open(caminho, 'rb') as arquivo:
+                dados = arquivo.read()
+        except OSError:
+            continue
+        if len(dados) < 8:
+            continue
+        for chave, _, valor in _entradas(dados):
+            totais[chave] += valor
+
+    por_metrica = defaultdict(list)
+    for chave, valor in totais.items():
+        nome = chave.split('{', 1)[0]
+        for sufixo in ('_bucket', '_sum', '_count'):
+            if nome.endswith(sufixo) and nome[:-len(sufixo)] in _metricas:
+                nome = nome[:-len(sufixo)]
+        por_metrica[nome].append((chave, valor))
+
+    linhas = []
+    for nome, (tipo, ajuda, _) in sorted(_metricas.items()):
+        linhas.append(f'# HELP {nome} {ajuda}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for chave, valor in sorted(por_metrica.get(nome, []), key=_ordem):
+            linhas.append(f'{chave} {int(valor) if valor.is_integer() else repr(valor)}')
+    return '\n'.join(linhas) + '\n'
+
+
+def _ordem(item):
+    # Baldes em ordem numérica de "le" (o último rótulo), não alfabética
+    chave = item[0]
+    if '_bucket{' not in chave:
+        return (chave, 0.0)
+    inicio = chave.rindex('le="') + 4
+    return (chave[:inicio], float(chave[inicio:chave.index('"', inicio)]))
+
+
+def limpar():
+    """Apaga os arquivos de todos os processos (testes e reinício manual)."""
+    global _processo
+    with _processo_trava:
+        if _processo is not None:
+            _processo[2].fechar()
+            _processo = None
+        for caminho in glob.glob(os.path.join(_diretorio(), '*.db')):
+            os.remove(caminho)
+
+
+REQUISICAO_SEGUNDOS = _registrar(
+    'voz_requisicao_segundos', 'histogram', 'Duração das requisições por view e ação.', BALDES_SEGUNDOS
+)
+RESPOSTAS = _registrar('voz_respostas_total', 'counter', 'Respostas por view, ação, método e status.')
+CONSULTAS_POR_REQUISICAO = _registrar(
+    'voz_consultas_por_requisicao', 'histogram',
+    'Consultas ao banco por requisição (só requisições com medição detalhada).', BALDES_CONSULTAS
+)
+DEDUPLICACAO = _registrar(
+    'voz_deduplicacao_total', 'counter', 'Envios de denúncia por resultado (criada, apoio_adicionado, ja_apoiada).'
+)
+GEOCODIFICACAO_CACHE = _registrar(
+    'voz_geocodificacao_cache_total', 'counter', 'Consultas ao cache do Nominatim por resultado.'
+)
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_user_code_expires_at_user_is_email_verified_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoDados',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True)),
+                ('versao', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Versão de Dados',
+                'verbose_name_plural': 'Versões de Dados',
+            },
+        ),
+    ]
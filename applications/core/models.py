@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 
@@ -52,4 +53,30 @@ class User(AbstractUser):
     objects = UserManager()
 
     def __str__(self):
-        return self.username
\ No newline at end of file
+        return self.username
+
+class VersaoDados(models.Model):
+    """
+    Versão de um conjunto de dados de referência (categorias, estados, cidades),
+    incrementada a cada alteração. Compartilhada entre processos pelo banco, serve de
+    chave para os caches locais e para os ETags (ver referencia.py).
+    """
+    nome = models.CharField(max_length=50, unique=True)
+    versao = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _('Versão de Dados')
+        verbose_name_plural = _('Versões de Dados')
+
+    def __str__(self):
+        return f'{self.nome} v{self.versao}'
+
+    @classmethod
+    def atual(cls, nome):
+        return cls.objects.filter(nome=nome).values_list('versao', flat=True).first() or 0
+
+    @classmethod
+    def incrementar(cls, *nomes):
+        for nome in nomes:
+            if not cls.objects.filter(nome=nome).update(versao=F('versao') + 1):
+                cls.objects.get_or_create(nome=nome, defaults={'versao': 1})
@@ -0,0 +1,91 @@
+"""
+Dados de referência (categorias, estados, cidades) servidos de um cache por processo.
+
+Cada conjunto tem uma versão em VersaoDados, incrementada sempre que os dados mudam
+(save/delete dos modelos e comando populate_cities). As respostas ficam em memória
+por (conjunto, versão, parâmetros) e levam um ETag forte derivado da mesma chave:
+uma requisição custa uma leitura da versão, e um cliente com o ETag atual recebe 304.
+"""
+import hashlib
+import threading
+
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .medicao import contar_cache
+from .models import VersaoDados
+
+MAX_RESPOSTAS_POR_CONJUNTO = 256
+
+_respostas = {}  # conjunto -> (versao, {chave: dados})
+_trava = threading.Lock()
+
+
+def _do_cache(conjunto, versao, chave):
+    versao_cache, dados = _respostas.get(conjunto, (None, {}))
+    if versao_cache != versao:
+        return None
+    return dados.get(chave)
+
+
+def _guardar(conjunto, versao, chave, dados):
+    with _trava:
+        versao_cache, respostas = _respostas.get(conjunto, (None, {}))
+        if versao_cache != versao:
+            respostas = {}
+            _respostas[conjunto] = (versao, respostas)
+        if len(respostas) < MAX_RESPOSTAS_POR_CONJUNTO:
+            respostas[chave] = dados
+
+
+def limpar_cache():
+    with _trava:
+        _respostas.clear()
+
+
+class DadosReferenciaMixin:
+    """
+    Para viewsets somente leitura de dados de referência: `conjunto_referencia` é o
+    nome da versão em VersaoDados. Com "?todos=true" a listagem não é paginada.
+    """
+    conjunto_referencia = None
+
+    def list(self, request, *args, **kwargs):
+        return self._responder(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._responder(request, super().retrieve, *args, **kwargs)
+
+    def paginate_queryset(self, queryset):
+        if self.request.query_params.get('todos', '').lower() in ('1', 'true'):
+            return None
+        return super().paginate_queryset(queryset)
+
+    def _responder(self, request, gerar, *args, **kwargs):
+        versao = VersaoDados.atual(self.conjunto_referencia)
+        chave = (
+            self.action,
+            tuple(sorted(kwargs.items())),
+            tuple(sorted((nome, tuple(valores)) for nome, valores in request.query_params.lists())),
+            request.accepted_renderer.format,
+            request.get_host(),  # Os links de paginação são absolutos
+        )
+        etag = '"%s"' % hashlib.sha1(
+            repr((self.conjunto_referencia, versao, chave)).encode()
+        ).hexdigest()[:32]
+        cabecalhos = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+        etags_cliente = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in etags_cliente or '*' in etags_cliente:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=cabecalhos)
+
+        dados = _do_cache(self.conjunto_referencia, versao, chave)
+        contar_cache(dados is not None)
+        if dados is None:
+            resposta = gerar(request, *args, **kwargs)
+            if resposta.status_code != status.HTTP_200_OK:
+                return resposta
+            dados = resposta.data
+            _guardar(self.conjunto_referencia, versao, chave, dados)
+        return Response(dados, headers=cabecalhos)
@@ -0,0 +1,147 @@
+"""
+Logs estruturados e fora do caminho da requisição.
+
+- `evento(logger, nome, **campos)`: um registro por decisão, com os campos como
+  valores (nada de f-string). Se o nível estiver desligado, nada é montado.
+- `ManipuladorFila`: o worker só coloca o registro numa fila em memória; uma
+  thread do próprio processo formata e escreve. Com a fila cheia o registro é
+  descartado (e contado), para o log nunca segurar a requisição.
+- `FiltroAmostragem`: mantém só uma fração dos registros abaixo de WARNING de
+  cada logger (settings.LOG_AMOSTRAGEM), decidido antes de entrar na fila.
+- `FormatadorJSON`: uma linha JSON por registro, com os campos do evento.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from decimal import Decimal
+from logging.handlers import QueueHandler, QueueListener
+
+# Argumentos que podem ser formatados depois, em outra thread, sem risco de terem mudado
+_IMUTAVEIS = (str, int, float, bool, Decimal, type(None))
+
+
+def evento(logger, nome, nivel=logging.INFO, **campos):
+    """Registra o evento `nome` com `campos` (valores simples, serializáveis em JSON)."""
+    if logger.isEnabledFor(nivel):
+        logger.log(nivel, nome, extra={'campos': campos})
+
+
+class FormatadorJSON(logging.Formatter):
+
+    def format(self, record):
+        dados = {
+            'momento': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensagem': record.getMessage(),
+        }
+        dados.update(getattr(record, 'campos', None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            dados['excecao'] = record.exc_text
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class FiltroAmostragem(logging.Filter):
+    """
+    `taxas` = {nome do logger: fração mantida}; vale também para os loggers filhos
+    (a entrada mais específica ganha). WARNING e acima passam sempre.
+    """
+
+    def __init__(self, taxas=None):
+        super().__init__()
+        self.taxas = dict(taxas or {})
+        self._por_logger = {}
+
+    def _taxa(self, nome):
+        taxa = self._por_logger.get(nome)
+        if taxa is None:
+            taxa = 1.0
+            partes = nome.split('.')
+            for tamanho in range(len(partes), 0, -1):
+                prefixo = '.'.join(partes[:tamanho])
+                if prefixo in self.taxas:
+                    taxa = self.taxas[prefixo]
+                    break
+            self._por_logger[nome] = taxa
+        return taxa
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        taxa = self._taxa(record.name)
+        return taxa >= 1.0 or random.random() < taxa
+
+
+class ManipuladorFila(QueueHandler):
+    """
+    Handler que enfileira os registros para `destino` (por padrão, stderr), escrito
+    por uma QueueListener. A fila e a thread são recriadas depois de um fork
+    (gunicorn com --preload), já que a thread do processo pai não existe no filho.
+    """
+
+    def __init__(self, destino=None, tamanho_fila=10000):
+        super().__init__(None)
+        self.destino = destino or logging.StreamHandler(sys.stderr)
+        self.tamanho_fila = tamanho_fila
+        self.descartados = 0
+        self._pid = None
+        self._ouvinte = None
+        self._trava = threading.Lock()
+        atexit.register(self.esvaziar)
+
+    def setFormatter(self, fmt):
+        # Quem formata é o destino, na thread da fila
+        super().setFormatter(fmt)
+        self.destino.setFormatter(fmt)
+
+    def _iniciar(self):
+        with self._trava:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.tamanho_fila)
+            self._ouvinte = QueueListener(self.queue, self.destino, respect_handler_level=True)
+            self._ouvinte.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Sem formatar aqui (o QueueHandler padrão formata na thread da requisição).
+        # Só o que pode mudar ou sumir até a escrita é resolvido agora.
+        record = copy.copy(record)
+        if record.args and not all(isinstance(arg, _IMUTAVEIS) for arg in (
+            record.args.values() if isinstance(record.args, dict) else record.args
+        )):
+            record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._iniciar()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+    def esvaziar(self):
+        """Escreve o que está na fila e para a thread (ela volta no próximo registro)."""
+        with self._trava:
+            if self._ouvinte is not None and self._pid == os.getpid():
+                self._ouvinte.stop()
+            self._ouvinte = None
+            self._pid = None
+
+    def close(self):
+        self.esvaziar()
+        self.destino.close()
+        super().close()
@@ -1,2 +1,230 @@
-from django.test import TestCase
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .cliente_http import ClienteHTTP, DisjuntorAberto, LimiteTaxaExcedido
+from . import metricas
+from .medicao import MedicaoMiddleware, trecho
+from .referencia import limpar_cache
+from .registro import FiltroAmostragem, FormatadorJSON, ManipuladorFila
+
+class ServidorStub(ThreadingHTTPServer):
+    """Servidor local que responde com os status da fila `respostas` (200 quando vazia)."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ManipuladorStub)
+        self.respostas = []
+        self.portas_cliente = []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/'
+
+class ManipuladorStub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.portas_cliente.append(self.client_address[1])
+        codigo = self.server.respostas.pop(0) if self.server.respostas else 200
+        corpo = b'{"ok": true}'
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+class ClienteHTTPTests(SimpleTestCase):
+    def setUp(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta, ignore_errors=True)
+        configuracao = override_settings(CLIENTES_HTTP_DIRETORIO=pasta)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        self.servidor = ServidorStub()
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        self.addCleanup(self.servidor.server_close)
+        self.addCleanup(self.servidor.shutdown)
+
+    def _cliente(self, **opcoes):
+        return ClienteHTTP('teste', **{'taxa': 1000, 'capacidade': 1000, 'backoff': 0, **opcoes})
+
+    def test_repete_erros_temporarios_na_mesma_conexao(self):
+        self.servidor.respostas = [503, 502]
+        resposta = self._cliente(tentativas=2).get(self.servidor.url)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json(), {'ok': True})
+        self.assertEqual(len(self.servidor.portas_cliente), 3)
+        self.assertEqual(len(set(self.servidor.portas_cliente)), 1)  # Keep-alive
+
+    def test_disjuntor_falha_rapido(self):
+        cliente = self._cliente(tentativas=0, falhas_para_abrir=2, pausa_disjuntor=60)
+        self.servidor.respostas = [503, 503]
+        self.assertEqual(cliente.get(self.servidor.url).status_code, 503)
+        self.assertEqual(cliente.get(self.servidor.url).status_code, 503)
+
+        with self.assertRaises(DisjuntorAberto):
+            cliente.get(self.servidor.url)
+        self.assertEqual(len(self.servidor.portas_cliente), 2)
+
+    def test_limite_de_taxa_compartilhado(self):
+        self._cliente(taxa=0.1, capacidade=1, espera_maxima=0).get(self.servidor.url)
+        # Outra instância (outro worker) lê o mesmo balde
+        with self.assertRaises(LimiteTaxaExcedido):
+            self._cliente(taxa=0.1, capacidade=1, espera_maxima=0).get(self.servidor.url)
+
+
+class RegistroTests(SimpleTestCase):
+    def _registro(self, nome, nivel=logging.INFO, msg='evento', args=None, **campos):
+        record = logging.LogRecord(nome, nivel, __file__, 1, msg, args, None)
+        record.campos = campos
+        return record
+
+    def test_amostragem_por_logger(self):
+        filtro = FiltroAmostragem({'app': 0.0, 'app.ruidoso.detalhe': 1.0})
+        self.assertFalse(filtro.filter(self._registro('app.ruidoso')))
+        self.assertTrue(filtro.filter(self._registro('app.ruidoso.detalhe')))
+        self.assertTrue(filtro.filter(self._registro('outro')))
+        self.assertTrue(filtro.filter(self._registro('app.ruidoso', logging.WARNING)))
+
+    def test_fila_escreve_json_fora_da_thread_do_registro(self):
+        saida = StringIO()
+        destino = logging.StreamHandler(saida)
+        manipulador = ManipuladorFila(destino, tamanho_fila=2)
+        manipulador.setFormatter(FormatadorJSON())
+        threads = []
+        original = destino.emit
+        destino.emit = lambda record: (threads.append(threading.current_thread()), original(record))
+
+        lista = [1]
+        manipulador.handle(self._registro('app', msg='itens %s', args=(lista,), resultado='criada', candidatas=3))
+        lista.append(2)  # Argumento mutável: formatado antes de entrar na fila
+        manipulador.esvaziar()
+
+        linha = json.loads(saida.getvalue())
+        self.assertEqual(
+            (linha['mensagem'], linha['resultado'], linha['candidatas']), ('itens [1]', 'criada', 3)
+        )
+        self.assertNotIn(threading.current_thread(), threads)
+        manipulador.close()
+
+    def test_fila_cheia_descarta_sem_bloquear(self):
+        manipulador = ManipuladorFila(logging.NullHandler(), tamanho_fila=1)
+        manipulador._iniciar()
+        manipulador._ouvinte.stop()  # Ninguém consome a fila
+        for _ in range(3):
+            manipulador.handle(self._registro('app'))
+        self.assertEqual(manipulador.descartados, 2)
+        manipulador._pid = None
+
+
+class MedicaoTests(TestCase):
+    def setUp(self):
+        limpar_cache()
+
+    def _cabecalho(self, response):
+        return dict(
+            (parte.split(';')[0], parte) for parte in response['Server-Timing'].split(', ')
+        )
+
+    def test_server_timing_e_log_de_acesso(self):
+        with self.assertLogs('applications.core.acesso', 'INFO') as logs, \
+                CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('categoria-list'))
+        metricas = self._cabecalho(response)
+        self.assertIn('total;dur=', metricas['total'])
+        self.assertIn(f'desc="{len(consultas)} consultas"', metricas['db'])
+        self.assertIn('desc="acertos=0 faltas=1"', metricas['cache'])
+
+        campos = logs.records[-1].campos
+        self.assertEqual((campos['rota'], campos['status'], campos['consultas']), ('categoria-list', 200, len(consultas)))
+
+        response = self.client.get(reverse('categoria-list'))
+        self.assertIn('desc="acertos=1 faltas=0"', self._cabecalho(response)['cache'])
+
+    def test_trechos_externos(self):
+        def view(request):
+            with trecho('http'):
+                time.sleep(0.01)
+            return HttpResponse()
+
+        response = MedicaoMiddleware(view)(RequestFactory().get('/'))
+        metricas = self._cabecalho(response)
+        self.assertGreaterEqual(float(metricas['http'].split('dur=')[1]), 10)
+        with trecho('http'):  # Fora de uma requisição não faz nada
+            pass
+
+    @override_settings(MEDICAO_AMOSTRAGEM=0)
+    def test_sem_amostragem_so_o_total(self):
+        response = self.client.get(reverse('categoria-list'))
+        self.assertEqual(list(self._cabecalho(response)), ['total'])
+
+
+def _incrementar_em_outro_processo(diretorio):
+    with override_settings(METRICAS_DIRETORIO=diretorio):
+        metricas.incrementar(metricas.DEDUPLICACAO, resultado='criada', criterio='nenhum')
+
+
+class MetricasTests(TestCase):
+    def setUp(self):
+        diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, diretorio, ignore_errors=True)
+        configuracao = override_settings(METRICAS_DIRETORIO=diretorio)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.addCleanup(metricas.limpar)
+        self.diretorio = diretorio
+        limpar_cache()
+
+    def test_histogramas_e_contadores_por_view_sem_consultar_o_banco(self):
+        self.client.get(reverse('categoria-list'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        texto = response.content.decode()
+
+        rotulos = 'view="CategoriaViewSet",acao="list"'
+        self.assertIn('# TYPE voz_requisicao_segundos histogram', texto)
+        self.assertIn(f'voz_requisicao_segundos_count{{{rotulos}}} 1', texto)
+        self.assertIn(f'voz_requisicao_segundos_bucket{{{rotulos},le="+Inf"}} 1', texto)
+        self.assertIn(f'voz_respostas_total{{{rotulos},metodo="GET",status="200"}} 1', texto)
+        self.assertIn(f'voz_consultas_por_requisicao_count{{{rotulos}}} 1', texto)
+
+        baldes = [linha for linha in texto.splitlines() if linha.startswith(f'voz_requisicao_segundos_bucket{{{rotulos}')]
+        limites = [linha.split('le="')[1].split('"')[0] for linha in baldes]
+        self.assertEqual(limites, [str(limite) for limite in metricas.BALDES_SEGUNDOS] + ['+Inf'])
+
+    def test_soma_os_arquivos_de_todos_os_processos(self):
+        metricas.incrementar(metricas.DEDUPLICACAO, resultado='criada', criterio='nenhum')
+        processo = multiprocessing.get_context('fork').Process(
+            target=_incrementar_em_outro_processo, args=(self.diretorio,)
+        )
+        processo.start()
+        processo.join(10)
+        self.assertEqual(processo.exitcode, 0)
+        self.assertEqual(len(os.listdir(self.diretorio)), 2)
+        self.assertIn('voz_deduplicacao_total{resultado="criada",criterio="nenhum"} 2', metricas.coletar())
+
+    @override_settings(METRICAS_TOKEN='segredo')
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(response.status_code, 200)
@@ -1,9 +1,11 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from applications.denuncias.models import Denuncia, Categoria
 from applications.localidades.models import Estado, Cidade
 from applications.core.models import User
+from applications.core.metricas import coletar
 import time
 
 @csrf_exempt
@@ -43,3 +45,11 @@ def echo_test(request):
         "echo": "pong",
         "timestamp": time.time()
     })
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """Métricas de todos os workers no formato do Prometheus. Não consulta o banco."""
+    token = settings.METRICAS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return JsonResponse({"status": "error", "message": "Token inválido."}, status=401)
+    return HttpResponse(coletar(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db import connection
+from . import busca
 from .models import Categoria, Denuncia, ApoioDenuncia
 
 @admin.register(Categoria)
@@ -10,11 +12,19 @@ class CategoriaAdmin(admin.ModelAdmin):
 class DenunciaAdmin(admin.ModelAdmin):
     list_display = ('titulo', 'autor', 'categoria', 'cidade', 'status', 'data_criacao')
     list_filter = ('status', 'jurisdicao', 'categoria', 'estado')
-    search_fields = ('titulo', 'descricao', 'autor__email', 'autor_convidado')
+    # Título, descrição e endereço vêm do índice textual (ver get_search_results)
+    search_fields = ('=autor__email', '=autor_convidado')
+    search_help_text = 'Busca por palavras no título, descrição e endereço, ou pelo e-mail/nome exato do autor.'
     readonly_fields = ('data_criacao',)
     list_select_related = ('autor', 'categoria', 'cidade', 'estado')
     list_per_page = 50  # Limita para evitar carregar muitas imagens de uma vez
     
+    def get_search_results(self, request, queryset, search_term):
+        resultados, duplicados = super().get_search_results(request, queryset, search_term)
+        if search_term.strip():
+            resultados |= queryset.filter(busca.filtro(search_term, connection))
+        return resultados, duplicados
+
     fieldsets = (
         ('Informações Gerais', {
             'fields': ('titulo', 'descricao', 'autor', 'foto')
@@ -0,0 +1,107 @@
+"""
+Infraestrutura das tabelas agregadas mantidas incrementalmente (mapa, heatmap,
+estatísticas...).
+
+Cada alteração relevante de uma denúncia vira uma lista de `Variacao`: o retrato
+da denúncia (campos usados nas chaves de agregação), quantas denúncias entram ou
+saem (+1/-1) e quanto "peso" (1 + apoios) entra ou sai. Cada tabela registra uma
+função que converte variações em incrementos nas suas próprias linhas.
+"""
+from collections import namedtuple
+
+from django.db import connection
+
+Retrato = namedtuple('Retrato', [
+    'categoria_id', 'status', 'jurisdicao', 'cidade_id', 'estado_id',
+    'latitude', 'longitude', 'data_criacao',
+])
+
+Variacao = namedtuple('Variacao', ['retrato', 'denuncias', 'peso'])
+
+CAMPOS_RETRATO = list(Retrato._fields)
+
+_agregados = []
+
+
+def registrar(modelo, aplicar):
+    """Registra uma tabela agregada e a função que aplica uma lista de variações nela."""
+    _agregados.append((modelo, aplicar))
+
+
+def agregados_registrados():
+    return list(_agregados)
+
+
+def retrato_de(valores):
+    """Cria um Retrato a partir de um objeto Denuncia ou de um dict com os mesmos campos."""
+    if isinstance(valores, dict):
+        obter = valores.get
+    else:
+        obter = lambda campo: getattr(valores, campo)  # noqa: E731
+    if obter('latitude') is None or obter('longitude') is None:
+        return None
+    return Retrato(
+        categoria_id=obter('categoria_id'),
+        status=obter('status'),
+        jurisdicao=obter('jurisdicao'),
+        cidade_id=obter('cidade_id'),
+        estado_id=obter('estado_id'),
+        latitude=float(obter('latitude')),
+        longitude=float(obter('longitude')),
+        data_criacao=obter('data_criacao'),
+    )
+
+
+def notificar(variacoes):
+    variacoes = [v for v in variacoes if v.retrato is not None and (v.denuncias or v.peso)]
+    if not variacoes:
+        return
+    for _, aplicar in _agregados:
+        aplicar(variacoes)
+
+
+def notificar_apoios(denuncia_id, delta):
+    """Apoios mudam apenas o peso da denúncia; o retrato é lido do banco."""
+    if not _agregados or not delta:
+        return
+    from .models import Denuncia
+    valores = Denuncia.objects.filter(pk=denuncia_id).values(*CAMPOS_RETRATO).first()
+    if valores:
+        notificar([Variacao(retrato_de(valores), 0, delta)])
+
+
+def incrementar(modelo, chave, incrementos, tamanho_lote=300):
+    """
+    Soma `incrementos` ({tupla da chave: {campo: delta}}) nas linhas de `modelo`,
+    criando as que não existem, com um único INSERT ... ON CONFLICT DO UPDATE por
+    lote (SQLite >= 3.24 e PostgreSQL). `chave` deve ter uma UniqueConstraint.
+    """
+    if not incrementos:
+        return
+    opts = modelo._meta
+    qn = connection.ops.quote_name
+    tabela = qn(opts.db_table)
+    campos = sorted({campo for deltas in incrementos.values() for campo in deltas})
+    colunas_chave = [opts.get_field(nome).column for nome in chave]
+    colunas_campos = [opts.get_field(nome).column for nome in campos]
+
+    colunas_sql = ', '.join(qn(coluna) for coluna in colunas_chave + colunas_campos)
+    conflito_sql = ', '.join(qn(coluna) for coluna in colunas_chave)
+    atualizacao_sql = ', '.join(
+        f'{qn(coluna)} = {tabela}.{qn(coluna)} + excluded.{qn(coluna)}' for coluna in colunas_campos
+    )
+    linha_sql = '(' + ', '.join(['%s'] * (len(colunas_chave) + len(colunas_campos))) + ')'
+
+    itens = list(incrementos.items())
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(itens), tamanho_lote):
+            lote = itens[inicio:inicio + tamanho_lote]
+            parametros = []
+            for valores_chave, deltas in lote:
+                parametros.extend(valores_chave)
+                parametros.extend(deltas.get(campo, 0) for campo in campos)
+            cursor.execute(
+                f'INSERT INTO {tabela} ({colunas_sql}) VALUES {", ".join([linha_sql] * len(lote))} '
+                f'ON CONFLICT ({conflito_sql}) DO UPDATE SET {atualizacao_sql}',
+                parametros,
+            )
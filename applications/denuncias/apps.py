@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 class DenunciasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'applications.denuncias'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import mapa  # noqa: F401  Registra a tabela agregada do mapa
+        from .busca import instalar_apos_migrate
+        # Refaz os triggers da busca textual se uma migração recriou a tabela (SQLite)
+        post_migrate.connect(instalar_apos_migrate, sender=self)
@@ -0,0 +1,182 @@
+"""
+Busca textual em titulo, descricao e endereco das denúncias.
+
+O índice invertido fica no próprio banco e é mantido por triggers, então vale
+também para bulk_create e QuerySet.update:
+
+- SQLite: tabela virtual FTS5 (conteúdo externo apontando para a tabela das
+  denúncias), tokenizador unicode61 sem acentos. O FTS5 não tem stemmer para
+  português; cada termo é buscado como prefixo ("buraco" acha "buracos").
+- PostgreSQL: coluna tsvector com índice GIN, preenchida por trigger com a
+  configuração "portugues_sem_acento" (stemmer do português + unaccent).
+
+A relevância vem de bm25 (SQLite) ou ts_rank_cd (PostgreSQL), com peso maior
+para o título e depois para o endereço.
+
+No SQLite, refazer a tabela das denúncias (algumas migrações fazem isso) apaga
+os triggers; por isso `instalar` é idempotente e roda de novo em todo post_migrate.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+TABELA = 'denuncias_denuncia'
+TABELA_FTS = 'denuncias_denuncia_busca'
+CONFIGURACAO_PG = 'portugues_sem_acento'
+COLUNAS = ('titulo', 'descricao', 'endereco')
+PESOS_BM25 = (10.0, 1.0, 3.0)  # Na ordem de COLUNAS
+
+_TERMOS = re.compile(r'\w+', re.UNICODE)
+
+_TRIGGERS_SQLITE = {
+    f'{TABELA_FTS}_ai': f"""
+        CREATE TRIGGER {TABELA_FTS}_ai AFTER INSERT ON {TABELA} BEGIN
+            INSERT INTO {TABELA_FTS}(rowid, titulo, descricao, endereco)
+            VALUES (new.id, new.titulo, new.descricao, new.endereco);
+        END
+    """,
+    f'{TABELA_FTS}_ad': f"""
+        CREATE TRIGGER {TABELA_FTS}_ad AFTER DELETE ON {TABELA} BEGIN
+            INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, titulo, descricao, endereco)
+            VALUES ('delete', old.id, old.titulo, old.descricao, old.endereco);
+        END
+    """,
+    f'{TABELA_FTS}_au': f"""
+        CREATE TRIGGER {TABELA_FTS}_au AFTER UPDATE OF titulo, descricao, endereco ON {TABELA} BEGIN
+            INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, titulo, descricao, endereco)
+            VALUES ('delete', old.id, old.titulo, old.descricao, old.endereco);
+            INSERT INTO {TABELA_FTS}(rowid, titulo, descricao, endereco)
+            VALUES (new.id, new.titulo, new.descricao, new.endereco);
+        END
+    """,
+}
+
+_VETOR_PG = f"""
+    setweight(to_tsvector('{CONFIGURACAO_PG}', coalesce({{prefixo}}titulo, '')), 'A')
+    || setweight(to_tsvector('{CONFIGURACAO_PG}', coalesce({{prefixo}}endereco, '')), 'B')
+    || setweight(to_tsvector('{CONFIGURACAO_PG}', coalesce({{prefixo}}descricao, '')), 'C')
+"""
+
+_INSTALACAO_PG = [
+    'CREATE EXTENSION IF NOT EXISTS unaccent',
+    f"""
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '{CONFIGURACAO_PG}') THEN
+            CREATE TEXT SEARCH CONFIGURATION {CONFIGURACAO_PG} (COPY = portuguese);
+            ALTER TEXT SEARCH CONFIGURATION {CONFIGURACAO_PG}
+                ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem;
+        END IF;
+    END $$
+    """,
+    f'ALTER TABLE {TABELA} ADD COLUMN IF NOT EXISTS busca tsvector',
+    f"""
+    CREATE OR REPLACE FUNCTION {TABELA}_busca() RETURNS trigger AS $$
+    BEGIN
+        NEW.busca := {_VETOR_PG.format(prefixo='NEW.')};
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql
+    """,
+    f'DROP TRIGGER IF EXISTS {TABELA}_busca ON {TABELA}',
+    f"""
+    CREATE TRIGGER {TABELA}_busca BEFORE INSERT OR UPDATE OF titulo, descricao, endereco
+    ON {TABELA} FOR EACH ROW EXECUTE FUNCTION {TABELA}_busca()
+    """,
+    f'CREATE INDEX IF NOT EXISTS {TABELA}_busca_gin ON {TABELA} USING GIN (busca)',
+    f'UPDATE {TABELA} SET busca = {_VETOR_PG.format(prefixo="")} WHERE busca IS NULL',
+]
+
+
+def instalar(conexao):
+    """Cria (ou completa) o índice textual e seus triggers. Pode ser chamada várias vezes."""
+    with conexao.cursor() as cursor:
+        if conexao.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name LIKE %s",
+                [f'{TABELA_FTS}%'],
+            )
+            existentes = {nome for (nome,) in cursor.fetchall()}
+            faltando = [nome for nome in (TABELA_FTS, *_TRIGGERS_SQLITE) if nome not in existentes]
+            if not faltando:
+                return
+            if TABELA_FTS not in existentes:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {TABELA_FTS} USING fts5("
+                    f"{', '.join(COLUNAS)}, content='{TABELA}', content_rowid='id', "
+                    f"tokenize='unicode61 remove_diacritics 2')"
+                )
+            for nome, sql in _TRIGGERS_SQLITE.items():
+                if nome not in existentes:
+                    cursor.execute(sql)
+            # Sem os triggers o índice pode ter ficado para trás
+            cursor.execute(f"INSERT INTO {TABELA_FTS}({TABELA_FTS}) VALUES ('rebuild')")
+        elif conexao.vendor == 'postgresql':
+            for sql in _INSTALACAO_PG:
+                cursor.execute(sql)
+
+
+def remover(conexao):
+    with conexao.cursor() as cursor:
+        if conexao.vendor == 'sqlite':
+            for nome in _TRIGGERS_SQLITE:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {nome}')
+            cursor.execute(f'DROP TABLE IF EXISTS {TABELA_FTS}')
+        elif conexao.vendor == 'postgresql':
+            cursor.execute(f'DROP TRIGGER IF EXISTS {TABELA}_busca ON {TABELA}')
+            cursor.execute(f'DROP FUNCTION IF EXISTS {TABELA}_busca()')
+            cursor.execute(f'ALTER TABLE {TABELA} DROP COLUMN IF EXISTS busca')
+
+
+def instalar_apos_migrate(sender, using, **kwargs):
+    conexao = connections[using]
+    if TABELA in conexao.introspection.table_names():
+        instalar(conexao)
+
+
+def _consulta_fts5(texto):
+    # Cada termo entre aspas (nada da sintaxe do FTS5 passa) e como prefixo
+    return ' '.join(f'"{termo}"*' for termo in _TERMOS.findall(texto))
+
+
+def filtro(texto, conexao):
+    """Q que restringe às denúncias que casam com `texto` (nenhuma quando não há termos)."""
+    if conexao.vendor == 'sqlite':
+        consulta = _consulta_fts5(texto)
+        if not consulta:
+            return Q(pk__in=[])
+        return Q(pk__in=RawSQL(f'SELECT rowid FROM {TABELA_FTS} WHERE {TABELA_FTS} MATCH %s', [consulta]))
+    if conexao.vendor == 'postgresql':
+        return Q(pk__in=RawSQL(
+            f"SELECT id FROM {TABELA} WHERE busca @@ websearch_to_tsquery('{CONFIGURACAO_PG}', %s)", [texto]
+        ))
+    # Outros bancos: sem índice, só para não quebrar
+    filtro_simples = Q()
+    for termo in _TERMOS.findall(texto):
+        filtro_simples &= Q(titulo__icontains=termo) | Q(descricao__icontains=termo) | Q(endereco__icontains=termo)
+    return filtro_simples
+
+
+def relevancia(texto, conexao):
+    """Expressão de relevância (maior é melhor) para anotar as denúncias filtradas por `filtro`."""
+    if conexao.vendor == 'sqlite':
+        pesos = ', '.join(str(peso) for peso in PESOS_BM25)
+        return RawSQL(
+            f'SELECT -bm25({TABELA_FTS}, {pesos}) FROM {TABELA_FTS} '
+            f'WHERE {TABELA_FTS} MATCH %s AND rowid = {TABELA}.id',
+            [_consulta_fts5(texto)], output_field=FloatField(),
+        )
+    if conexao.vendor == 'postgresql':
+        return RawSQL(
+            f"ts_rank_cd({TABELA}.busca, websearch_to_tsquery('{CONFIGURACAO_PG}', %s))",
+            [texto], output_field=FloatField(),
+        )
+    return RawSQL('0', [], output_field=FloatField())
+
+
+def buscar(queryset, texto):
+    """`queryset` filtrado por `texto`, anotado com `relevancia` e ordenado por ela."""
+    conexao = connections[queryset.db]
+    return queryset.filter(filtro(texto, conexao)).annotate(
+        relevancia=relevancia(texto, conexao)
+    ).order_by('-relevancia', '-id')
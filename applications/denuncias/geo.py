@@ -0,0 +1,59 @@
+"""
+Grade espacial fixa usada para indexar denúncias por célula.
+
+Cada célula mede CELULA_LAT_GRAUS x CELULA_LON_GRAUS. O tamanho foi escolhido
+para que, até 60° de latitude (todo o território brasileiro), as 9 células
+vizinhas de um ponto cubram qualquer círculo de 100 m ao redor dele.
+"""
+from math import cos, radians, degrees, floor, ceil
+
+EARTH_RADIUS_METERS = 6371000.0
+
+CELULA_LAT_GRAUS = 0.001  # ~111 m
+CELULA_LON_GRAUS = 0.002  # ~204 m no equador, ~111 m a 60°
+
+_LAT_CELULAS = int(round(180 / CELULA_LAT_GRAUS)) + 1
+_LON_CELULAS = int(round(360 / CELULA_LON_GRAUS)) + 1
+
+METROS_POR_GRAU_LAT = radians(1) * EARTH_RADIUS_METERS
+
+
+def indices_celula(latitude, longitude):
+    lat_idx = int(floor((float(latitude) + 90.0) / CELULA_LAT_GRAUS))
+    lon_idx = int(floor((float(longitude) + 180.0) / CELULA_LON_GRAUS))
+    return lat_idx, lon_idx
+
+
+def chave_celula(lat_idx, lon_idx):
+    return lat_idx * _LON_CELULAS + lon_idx
+
+
+def celula_de(latitude, longitude):
+    """Retorna a chave inteira da célula que contém o ponto."""
+    if latitude is None or longitude is None:
+        return None
+    return chave_celula(*indices_celula(latitude, longitude))
+
+
+def celulas_vizinhas(latitude, longitude, raio_metros):
+    """
+    Retorna as chaves de todas as células que podem conter pontos a até
+    `raio_metros` do ponto informado. Para 100 m no Brasil são 9 células;
+    em latitudes altas o número de colunas cresce para manter a cobertura.
+    """
+    lat = float(latitude)
+    lat_idx, lon_idx = indices_celula(latitude, longitude)
+
+    delta_lat = raio_metros / METROS_POR_GRAU_LAT
+    linhas = int(ceil(delta_lat / CELULA_LAT_GRAUS))
+
+    # A coluna mais larga em graus ocorre na latitude mais afastada do equador
+    lat_extrema = min(abs(lat) + delta_lat, 89.9)
+    delta_lon = degrees(raio_metros / (EARTH_RADIUS_METERS * cos(radians(lat_extrema))))
+    colunas = int(ceil(delta_lon / CELULA_LON_GRAUS))
+
+    return [
+        chave_celula(lat_idx + dl, lon_idx + dc)
+        for dl in range(-linhas, linhas + 1)
+        for dc in range(-colunas, colunas + 1)
+    ]
@@ -0,0 +1,143 @@
+"""
+Hash perceptual (dHash de 64 bits) das fotos e busca por distância de Hamming.
+
+A foto é reduzida a 9x8 em tons de cinza e cada bit diz se um pixel é mais claro
+que o vizinho da direita. A mesma foto reenviada (recomprimida, redimensionada,
+com outro EXIF) dá o mesmo hash ou um hash a poucos bits de distância.
+
+Índice: o hash é dividido em BANDAS faixas de 16 bits, cada uma numa coluna
+indexada de Denuncia. Se dois hashes diferem em no máximo BANDAS - 1 bits, pelo
+menos uma faixa é idêntica (casa dos pombos), então a busca é uma consulta por
+igualdade nas faixas seguida da conta exata dos bits. Com hashes bem espalhados,
+cada valor de faixa tem ~N/65536 linhas: umas 15 por faixa com 1 milhão de fotos.
+Hashes com quase todos os bits iguais (fotos lisas, escuras) não são guardados,
+porque não identificam nada e lotariam uma única faixa.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from PIL import Image, ImageOps
+
+from .imagens import grande_demais
+
+BANDAS = 4
+BITS_POR_BANDA = 64 // BANDAS
+MASCARA_BANDA = (1 << BITS_POR_BANDA) - 1
+CAMPOS_BANDAS = tuple(f'foto_hash_b{indice}' for indice in range(BANDAS))
+
+BITS_MINIMOS = 8  # Menos bits ligados (ou desligados) que isso: hash sem informação
+
+
+def para_assinado(valor):
+    """Hash sem sinal -> inteiro que cabe num BigIntegerField."""
+    return valor - (1 << 64) if valor >= (1 << 63) else valor
+
+
+def para_sem_sinal(valor):
+    return valor & ((1 << 64) - 1)
+
+
+def hash_da_foto(arquivo):
+    """
+    dHash (já com sinal, pronto para gravar) da imagem em `arquivo`, ou None quando
+    a imagem não pode ser lida ou é lisa demais para identificar a foto.
+    """
+    posicao = arquivo.tell()
+    arquivo.seek(0)
+    try:
+        imagem = Image.open(arquivo)
+        if grande_demais(imagem):
+            return None
+        imagem.draft('L', (64, 64))  # JPEG: decodifica já em 1/8
+        imagem = ImageOps.exif_transpose(imagem).convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    except (OSError, Image.DecompressionBombError):
+        return None
+    finally:
+        arquivo.seek(posicao)
+
+    pixels = np.asarray(imagem, dtype=np.int16)
+    bits = (pixels[:, :-1] > pixels[:, 1:]).flatten()
+    if not BITS_MINIMOS <= int(bits.sum()) <= 64 - BITS_MINIMOS:
+        return None
+    valor = 0
+    for bit in bits:
+        valor = (valor << 1) | int(bit)
+    return para_assinado(valor)
+
+
+def bandas(foto_hash):
+    """Valores das colunas de faixa para `foto_hash` (None em todas quando não há hash)."""
+    if foto_hash is None:
+        return (None,) * BANDAS
+    valor = para_sem_sinal(foto_hash)
+    return tuple(
+        (valor >> (BITS_POR_BANDA * (BANDAS - 1 - indice))) & MASCARA_BANDA for indice in range(BANDAS)
+    )
+
+
+def distancia(hash_a, hash_b):
+    return (para_sem_sinal(hash_a) ^ para_sem_sinal(hash_b)).bit_count()
+
+
+def distancia_maxima():
+    # Acima de BANDAS - 1 bits a busca por faixas deixaria de ser exata
+    return min(settings.FOTO_HASH_DISTANCIA_MAXIMA, BANDAS - 1)
+
+
+def outra_foto(hash_a, hash_b):
+    """
+    As duas fotos têm hash e nada em comum: outro problema, mesmo lado a lado. Fotos
+    diferentes da mesma cena (outro enquadramento, inclinação) ficam bem acima de
+    distancia_maxima(), por isso o limite é FOTO_HASH_DISTANCIA_OUTRA_FOTO, perto da
+    distância entre fotos ao acaso (32 bits em média). Com 0 nada é vetado.
+    """
+    limite = settings.FOTO_HASH_DISTANCIA_OUTRA_FOTO
+    return bool(limite) and hash_a is not None and hash_b is not None and distancia(hash_a, hash_b) >= limite
+
+
+def parecidas(foto_hash, *colunas):
+    """
+    Denúncias cuja foto está a até distancia_maxima() bits de `foto_hash`, como
+    [(distancia, id, *colunas)] em ordem crescente de distância.
+
+    A consulta filtra só pelas faixas, em SQL montado aqui: outro filtro no mesmo
+    WHERE (categoria, status) pode levar o banco a trocar os índices das faixas
+    pelo da categoria e varrer dezenas de milhares de linhas. Quem chama filtra
+    o resultado, que tem poucas linhas.
+    """
+    return parecidas_em_lote([foto_hash], *colunas).get(foto_hash, [])
+
+
+def parecidas_em_lote(hashes, *colunas):
+    """Como `parecidas`, para vários hashes numa só consulta: {foto_hash: [(distancia, id, *colunas)]}."""
+    from .models import Denuncia
+
+    hashes = list(dict.fromkeys(foto_hash for foto_hash in hashes if foto_hash is not None))
+    if not hashes:
+        return {}
+    tabela = connection.ops.quote_name(Denuncia._meta.db_table)
+    selecionadas = ', '.join(
+        connection.ops.quote_name(Denuncia._meta.get_field(coluna).column) for coluna in ('id', 'foto_hash', *colunas)
+    )
+    faixas = [bandas(foto_hash) for foto_hash in hashes]
+    valores_por_faixa = [sorted({faixa[indice] for faixa in faixas}) for indice in range(BANDAS)]
+    consultas = ' UNION ALL '.join(
+        f'SELECT {selecionadas} FROM {tabela} WHERE {connection.ops.quote_name(campo)} '
+        f'IN ({", ".join(["%s"] * len(valores))})'
+        for campo, valores in zip(CAMPOS_BANDAS, valores_por_faixa)
+    )
+
+    limite = distancia_maxima()
+    encontradas = {foto_hash: {} for foto_hash in hashes}
+    with connection.cursor() as cursor:
+        cursor.execute(consultas, [valor for valores in valores_por_faixa for valor in valores])
+        for pk, outro_hash, *valores in cursor.fetchall():
+            for foto_hash in hashes:
+                bits = distancia(foto_hash, outro_hash)
+                if bits <= limite:
+                    # UNION ALL: a mesma linha pode vir de várias faixas
+                    encontradas[foto_hash][pk] = (bits, pk, *valores)
+    return {
+        foto_hash: sorted(linhas.values(), key=lambda item: item[:2])
+        for foto_hash, linhas in encontradas.items() if linhas
+    }
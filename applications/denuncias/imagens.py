@@ -0,0 +1,320 @@
+"""
+Normalização das fotos das denúncias antes do armazenamento.
+
+A foto é lida direto do upload (o Django já manda arquivos grandes para disco) e
+decodificada em escala reduzida: em JPEG, `draft` faz o decodificador entregar a
+imagem já dividida por 2, 4 ou 8, e `thumbnail(reducing_gap=...)` usa `reduce`
+antes do filtro final. Assim, em JPEG, a memória de pico acompanha o tamanho de
+saída, não os 12 MP da câmera. Os demais formatos (PNG, WebP...) são decodificados
+inteiros, por isso só são aceitos até FOTO_MAX_PIXELS (padrão 4 MP, ~16 MB em
+RGBA); acima disso o envio é recusado antes de qualquer decodificação. A
+orientação EXIF é aplicada e os metadados (inclusive GPS) são descartados ao
+regravar em JPEG.
+
+Com FOTOS_EM_SEGUNDO_PLANO, a requisição grava o original e a normalização roda
+num pool de threads do processo depois do commit.
+
+As variantes menores (VARIANTES, em WebP e JPEG) usadas nos cards do feed vêm de
+`url_variante`: no Cloudinary são transformações na própria URL; nos demais
+storages os arquivos são gerados uma vez, no mesmo pool de threads (agendados
+no primeiro acesso, que ainda recebe a foto original, ou logo depois da
+normalização em segundo plano), e registrados em Denuncia.foto_variantes. Cada
+denúncia grava as suas em variantes/<id>/ e só apaga os arquivos que registrou,
+também quando a foto muda ou a denúncia é excluída (signals.py). Uma geração que
+falha não é reagendada para a mesma foto por FOTO_VARIANTES_ESPERA_FALHA segundos.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from applications.core.medicao import trecho
+from applications.core.registro import evento
+
+logger = logging.getLogger(__name__)
+
+# Lado maior, em pixels, de cada variante
+VARIANTES = {'card': 640, 'thumb': 160}
+
+# formato -> (formato do Pillow, extensão, nome na transformação do Cloudinary)
+FORMATOS = {'webp': ('WEBP', 'webp', 'webp'), 'jpeg': ('JPEG', 'jpg', 'jpg')}
+
+_executor = None
+_executor_lock = threading.Lock()
+_variantes_agendadas = set()
+
+
+class FotoInvalida(ValueError):
+    pass
+
+
+def _tamanho(arquivo):
+    tamanho = getattr(arquivo, 'size', None)
+    if tamanho is None:
+        posicao = arquivo.tell()
+        arquivo.seek(0, os.SEEK_END)
+        tamanho = arquivo.tell()
+        arquivo.seek(posicao)
+    return tamanho
+
+
+def _sem_transparencia(imagem):
+    if imagem.mode in ('RGBA', 'LA') or (imagem.mode == 'P' and 'transparency' in imagem.info):
+        imagem = imagem.convert('RGBA')
+        fundo = Image.new('RGB', imagem.size, 'white')
+        fundo.paste(imagem, mask=imagem.getchannel('A'))
+        return fundo
+    return imagem.convert('RGB')
+
+
+def grande_demais(imagem):
+    """Se a imagem (só com o cabeçalho lido) teria de ser decodificada inteira acima de FOTO_MAX_PIXELS."""
+    return imagem.format != 'JPEG' and imagem.width * imagem.height > settings.FOTO_MAX_PIXELS
+
+
+def _abrir(arquivo, dimensao):
+    imagem = Image.open(arquivo)
+    if grande_demais(imagem):
+        # Só JPEG pode ser decodificado em escala reduzida
+        raise FotoInvalida('A imagem é grande demais; envie uma foto em JPEG ou com menos resolução.')
+    imagem.draft('RGB', (dimensao, dimensao))
+    return imagem
+
+
+def conferir_dimensoes(arquivo):
+    """Recusa (FotoInvalida), lendo só o cabeçalho, o que `normalizar` recusaria pelo tamanho."""
+    posicao = arquivo.tell()
+    arquivo.seek(0)
+    try:
+        _abrir(arquivo, settings.FOTO_DIMENSAO_MAXIMA)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise FotoInvalida(f'Não foi possível processar a imagem: {e}')
+    finally:
+        arquivo.seek(posicao)
+
+
+def normalizar(arquivo, dimensao_maxima=None, qualidade=None):
+    """
+    Retorna (ContentFile JPEG, bytes originais, bytes finais). `arquivo` é qualquer
+    objeto de arquivo legível; ele não é carregado inteiro na memória.
+    """
+    dimensao_maxima = dimensao_maxima or settings.FOTO_DIMENSAO_MAXIMA
+    qualidade = qualidade or settings.FOTO_QUALIDADE
+    bytes_originais = _tamanho(arquivo)
+    arquivo.seek(0)
+
+    try:
+        imagem = ImageOps.exif_transpose(_abrir(arquivo, dimensao_maxima))
+        imagem.thumbnail((dimensao_maxima, dimensao_maxima), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        imagem = _sem_transparencia(imagem)
+
+        saida = BytesIO()
+        imagem.save(saida, 'JPEG', quality=qualidade, optimize=True, progressive=True)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise FotoInvalida(f'Não foi possível processar a imagem: {e}')
+
+    nome = os.path.splitext(os.path.basename(getattr(arquivo, 'name', None) or 'foto'))[0] + '.jpg'
+    return ContentFile(saida.getvalue(), name=nome), bytes_originais, saida.tell()
+
+
+def registrar_economia(nome, bytes_originais, bytes_finais):
+    economia = bytes_originais - bytes_finais
+    evento(
+        logger, 'foto.normalizada', arquivo=nome, bytes_originais=bytes_originais, bytes_finais=bytes_finais,
+        economia_pct=round(100.0 * economia / bytes_originais, 1) if bytes_originais else 0.0,
+    )
+
+
+def normalizar_upload(arquivo):
+    """Normaliza um upload durante a requisição e retorna o arquivo a ser salvo."""
+    foto, bytes_originais, bytes_finais = normalizar(arquivo)
+    registrar_economia(foto.name, bytes_originais, bytes_finais)
+    return foto
+
+
+def normalizar_armazenada(denuncia_id):
+    """Normaliza a foto já gravada de uma denúncia, trocando o arquivo no storage."""
+    from .models import Denuncia
+
+    denuncia = Denuncia.objects.filter(pk=denuncia_id).only('foto').first()
+    if denuncia is None or not denuncia.foto:
+        return
+    nome_original = denuncia.foto.name
+    storage = denuncia.foto.storage
+
+    with storage.open(nome_original, 'rb') as arquivo:
+        foto, bytes_originais, bytes_finais = normalizar(arquivo)
+    novo_nome = storage.save(os.path.join(os.path.dirname(nome_original), foto.name), foto)
+
+    # Só troca se a foto não mudou enquanto processávamos
+    if Denuncia.objects.filter(pk=denuncia_id, foto=nome_original).update(foto=novo_nome):
+        storage.delete(nome_original)
+        registrar_economia(novo_nome, bytes_originais, bytes_finais)
+    else:
+        storage.delete(novo_nome)
+
+
+def _eh_cloudinary(storage):
+    return type(storage).__module__.startswith('cloudinary_storage')
+
+
+def gerar_variantes(denuncia):
+    """Gera e grava as variantes da foto atual de `denuncia`, retornando o registro salvo."""
+    from .models import Denuncia
+
+    nome = denuncia.foto.name
+    storage = denuncia.foto.storage
+    base = os.path.splitext(os.path.basename(nome))[0]
+    variantes = {'origem': nome}
+
+    with storage.open(nome, 'rb') as arquivo:
+        try:
+            imagem = _sem_transparencia(ImageOps.exif_transpose(_abrir(arquivo, max(VARIANTES.values()))))
+        except (OSError, Image.DecompressionBombError) as e:
+            raise FotoInvalida(f'Não foi possível processar a imagem: {e}')
+
+        # Da maior para a menor: cada variante parte da anterior, já reduzida
+        for variante, dimensao in sorted(VARIANTES.items(), key=lambda item: -item[1]):
+            imagem = imagem.copy()
+            imagem.thumbnail((dimensao, dimensao), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            variantes[variante] = {}
+            for formato, (formato_pil, extensao, _) in FORMATOS.items():
+                saida = BytesIO()
+                imagem.save(saida, formato_pil, quality=settings.FOTO_QUALIDADE, optimize=True)
+                destino = os.path.join(_pasta_variantes(nome, denuncia.pk), f'{base}.{variante}.{extensao}')
+                with trecho('armazenamento'):
+                    # Nome ocupado: o storage escolhe outro livre, nada é sobrescrito
+                    variantes[variante][formato] = storage.save(destino, ContentFile(saida.getvalue()))
+
+    # update() não passa pelos signals nem regrava o resto da linha
+    gravadas = Denuncia.objects.filter(pk=denuncia.pk, foto=nome).update(foto_variantes=variantes)
+    # As que esta denúncia deixou de usar, ou as que acabou de gerar, se a foto mudou
+    apagar_variantes(denuncia.pk, denuncia.foto_variantes if gravadas else variantes, storage)
+    if gravadas:
+        denuncia.foto_variantes = variantes
+    return variantes
+
+
+def _pasta_variantes(nome, denuncia_id):
+    # Fotos de denúncias diferentes podem ter o mesmo nome base (x.png e x.jpg)
+    return os.path.join(os.path.dirname(nome), 'variantes', str(denuncia_id))
+
+
+def apagar_variantes(denuncia_id, registro, storage):
+    """
+    Apaga os arquivos de `registro` (um foto_variantes) que estão na pasta da denúncia:
+    registros antigos, de antes das pastas por denúncia, podem apontar para os de outra.
+    """
+    if not registro or 'origem' not in registro:
+        return
+    pasta = _pasta_variantes(registro['origem'], denuncia_id)
+    for chave, formatos in registro.items():
+        if chave != 'origem':
+            for caminho in formatos.values():
+                if os.path.dirname(caminho) == pasta:
+                    storage.delete(caminho)
+
+
+def formato_aceito(request):
+    """WebP quando o cliente anuncia suporte no Accept; JPEG caso contrário."""
+    if request is not None and 'image/webp' in request.META.get('HTTP_ACCEPT', ''):
+        return 'webp'
+    return 'jpeg'
+
+
+def url_variante(denuncia, variante, formato='jpeg'):
+    """URL (relativa ao storage) da `variante` da foto de `denuncia` no `formato` pedido."""
+    if not denuncia.foto:
+        return None
+    storage = denuncia.foto.storage
+
+    if _eh_cloudinary(storage):
+        dimensao = VARIANTES[variante]
+        transformacao = f'c_limit,w_{dimensao},h_{dimensao},f_{FORMATOS[formato][2]},q_auto'
+        return denuncia.foto.url.replace('/upload/', f'/upload/{transformacao}/', 1)
+
+    variantes = denuncia.foto_variantes or {}
+    if variantes.get('origem') != denuncia.foto.name:
+        # Nada de decodificar e enviar arquivos dentro de um GET: a original serve até lá
+        transaction.on_commit(lambda: agendar_variantes(denuncia.pk, denuncia.foto.name))
+        return denuncia.foto.url
+    return storage.url(variantes[variante][formato])
+
+
+def _chave_falha(denuncia_id):
+    return f'denuncias:variantes_falha:{denuncia_id}'
+
+
+def _gerar_ou_marcar_falha(denuncia):
+    # A foto que falhou fica marcada; só uma foto nova é tentada antes da espera
+    try:
+        gerar_variantes(denuncia)
+    except Exception:
+        cache.set(_chave_falha(denuncia.pk), denuncia.foto.name, settings.FOTO_VARIANTES_ESPERA_FALHA)
+        raise
+
+
+def _executar(denuncia_id):
+    from .models import Denuncia
+
+    close_old_connections()
+    try:
+        normalizar_armazenada(denuncia_id)
+        denuncia = Denuncia.objects.filter(pk=denuncia_id).only('foto', 'foto_variantes').first()
+        if denuncia is not None and denuncia.foto and not _eh_cloudinary(denuncia.foto.storage):
+            _gerar_ou_marcar_falha(denuncia)
+    except Exception:
+        logger.exception('Falha ao normalizar a foto da denúncia %s', denuncia_id)
+    finally:
+        close_old_connections()
+
+
+def _executar_variantes(denuncia_id):
+    from .models import Denuncia
+
+    close_old_connections()
+    try:
+        denuncia = Denuncia.objects.filter(pk=denuncia_id).only('foto', 'foto_variantes').first()
+        if denuncia is not None and denuncia.foto and (denuncia.foto_variantes or {}).get('origem') != denuncia.foto.name:
+            _gerar_ou_marcar_falha(denuncia)
+    except Exception:
+        logger.exception('Falha ao gerar as variantes da foto da denúncia %s', denuncia_id)
+    finally:
+        with _executor_lock:
+            _variantes_agendadas.discard(denuncia_id)
+        close_old_connections()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.FOTOS_TRABALHADORES, thread_name_prefix='fotos'
+            )
+        return _executor
+
+
+def agendar_normalizacao(denuncia_id):
+    return _pool().submit(_executar, denuncia_id)
+
+
+def agendar_variantes(denuncia_id, nome_foto=None):
+    """
+    Gera as variantes em segundo plano; uma vez por denúncia, mesmo que várias páginas
+    a peçam, e nunca de novo para a foto `nome_foto` que falhou há pouco.
+    """
+    if nome_foto is not None and cache.get(_chave_falha(denuncia_id)) == nome_foto:
+        return None
+    with _executor_lock:
+        if denuncia_id in _variantes_agendadas:
+            return None
+        _variantes_agendadas.add(denuncia_id)
+    return _pool().submit(_executar_variantes, denuncia_id)
@@ -0,0 +1,185 @@
+"""
+Índice espacial em memória (por worker) das denúncias abertas.
+
+Os pontos ficam em arrays NumPy ordenados pela chave de uma grade grossa;
+uma busca por raio vira poucas buscas binárias (uma por linha da grade)
+seguidas de um haversine vetorizado sobre as candidatas.
+
+O índice é apenas um gerador de candidatas: quem o consulta deve reler as
+denúncias no banco, que continua sendo a fonte da verdade para status e posição.
+Exclusões saem do índice do próprio worker no post_delete; nos demais, quem
+consulta remove as que o banco não devolveu (ver `remover`).
+"""
+import threading
+import time
+from datetime import timedelta
+from math import cos, degrees, floor, radians
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .geo import EARTH_RADIUS_METERS, METROS_POR_GRAU_LAT
+from .models import Denuncia
+from .services import haversine_distance_vetorizada
+
+CELULA_GRAUS = 0.01  # ~1,1 km
+_COLUNAS = int(round(360 / CELULA_GRAUS)) + 1
+
+STATUS_INDEXADOS = [Denuncia.Status.ABERTA, Denuncia.Status.EM_ANALISE]
+
+# Transações que terminam depois da leitura podem ter data_atualizacao anterior
+# à marca; reprocessar uma janela curta é idempotente e evita perdê-las.
+JANELA_SOBREPOSICAO = timedelta(seconds=30)
+
+
+def _chaves(lats, lons):
+    lat_idx = np.floor((lats + 90.0) / CELULA_GRAUS).astype(np.int64)
+    lon_idx = np.floor((lons + 180.0) / CELULA_GRAUS).astype(np.int64)
+    return lat_idx * _COLUNAS + lon_idx
+
+
+class IndiceProximidade:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (ids, lats, lons, categorias, chaves), trocados de uma vez para leituras consistentes
+        self._dados = self._vazio()
+        self._marca = None
+        self._ultima_sincronizacao = 0.0
+        self._ultima_reconstrucao = 0.0
+
+    @staticmethod
+    def _vazio():
+        return (
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+        )
+
+    def __len__(self):
+        return len(self._dados[0])
+
+    def invalidar(self):
+        with self._lock:
+            self._marca = None
+
+    def remover(self, ids):
+        """
+        Tira `ids` do índice. A sincronização incremental (por data_atualizacao) não
+        enxerga exclusões; sem isso elas só sairiam na próxima reconstrução.
+        """
+        with self._lock:
+            atuais = self._dados
+            manter = ~np.isin(atuais[0], np.asarray(list(ids), dtype=np.int64))
+            if not manter.all():
+                self._dados = tuple(array[manter] for array in atuais)
+
+    def sincronizar(self):
+        """Reconstrói ou atualiza incrementalmente, respeitando os intervalos configurados."""
+        agora = time.monotonic()
+        intervalo = getattr(settings, 'PROXIMIDADE_SINCRONIZACAO_SEGUNDOS', 5)
+        reconstrucao = getattr(settings, 'PROXIMIDADE_RECONSTRUCAO_SEGUNDOS', 600)
+
+        if self._marca is not None and agora - self._ultima_sincronizacao < intervalo:
+            return
+
+        with self._lock:
+            if self._marca is None or agora - self._ultima_reconstrucao >= reconstrucao:
+                self._reconstruir()
+                self._ultima_reconstrucao = agora
+            else:
+                self._atualizar()
+            self._ultima_sincronizacao = agora
+
+    @staticmethod
+    def _ler(queryset):
+        return list(queryset.values_list('id', 'latitude', 'longitude', 'categoria_id', 'status', 'data_atualizacao'))
+
+    def _reconstruir(self):
+        marca = timezone.now()
+        linhas = self._ler(Denuncia.objects.filter(status__in=STATUS_INDEXADOS))
+        self._dados = self._mesclar(self._vazio(), linhas)
+        self._marca = marca
+
+    def _atualizar(self):
+        marca = timezone.now()
+        linhas = self._ler(
+            Denuncia.objects.filter(data_atualizacao__gte=self._marca - JANELA_SOBREPOSICAO)
+        )
+        if linhas:
+            ids, lats, lons, categorias, chaves = self._dados
+            alterados = np.fromiter((linha[0] for linha in linhas), dtype=np.int64, count=len(linhas))
+            manter = ~np.isin(ids, alterados)
+            restantes = (ids[manter], lats[manter], lons[manter], categorias[manter], chaves[manter])
+            self._dados = self._mesclar(restantes, [linha for linha in linhas if linha[4] in STATUS_INDEXADOS])
+        self._marca = marca
+
+    @staticmethod
+    def _mesclar(dados, linhas):
+        if not linhas:
+            return dados
+        n = len(linhas)
+        novos_lats = np.fromiter((float(linha[1]) for linha in linhas), dtype=np.float64, count=n)
+        novos_lons = np.fromiter((float(linha[2]) for linha in linhas), dtype=np.float64, count=n)
+        novos = (
+            np.fromiter((linha[0] for linha in linhas), dtype=np.int64, count=n),
+            novos_lats,
+            novos_lons,
+            np.fromiter((linha[3] for linha in linhas), dtype=np.int64, count=n),
+            _chaves(novos_lats, novos_lons),
+        )
+        combinados = [np.concatenate([atual, novo]) for atual, novo in zip(dados, novos)]
+        ordem = np.argsort(combinados[4], kind='stable')
+        return tuple(array[ordem] for array in combinados)
+
+    def buscar(self, latitude, longitude, raio_metros, k, categoria_id=None):
+        """Retorna até `k` pares (id, distância em metros) ordenados pela distância."""
+        self.sincronizar()
+        ids, lats, lons, categorias, chaves = self._dados
+        if not len(ids):
+            return []
+
+        lat, lon = float(latitude), float(longitude)
+        delta_lat = raio_metros / METROS_POR_GRAU_LAT
+        lat_extrema = min(abs(lat) + delta_lat, 89.9)
+        delta_lon = degrees(raio_metros / (EARTH_RADIUS_METERS * cos(radians(lat_extrema))))
+
+        lat_lo = int(floor((lat - delta_lat + 90.0) / CELULA_GRAUS))
+        lat_hi = int(floor((lat + delta_lat + 90.0) / CELULA_GRAUS))
+        lon_lo = int(floor((lon - delta_lon + 180.0) / CELULA_GRAUS))
+        lon_hi = int(floor((lon + delta_lon + 180.0) / CELULA_GRAUS))
+
+        # Cada linha da grade é um intervalo contíguo no array ordenado
+        inicios = np.arange(lat_lo, lat_hi + 1, dtype=np.int64) * _COLUNAS
+        esquerda = np.searchsorted(chaves, inicios + lon_lo, side='left')
+        direita = np.searchsorted(chaves, inicios + lon_hi, side='right')
+        if not (direita > esquerda).any():
+            return []
+        posicoes = np.concatenate([np.arange(e, d) for e, d in zip(esquerda, direita) if d > e])
+
+        if categoria_id is not None:
+            posicoes = posicoes[categorias[posicoes] == int(categoria_id)]
+            if not len(posicoes):
+                return []
+
+        distancias = haversine_distance_vetorizada(lat, lon, lats[posicoes], lons[posicoes])
+        dentro = distancias <= raio_metros
+        posicoes, distancias = posicoes[dentro], distancias[dentro]
+
+        if len(distancias) > k:
+            melhores = np.argpartition(distancias, k - 1)[:k]
+            posicoes, distancias = posicoes[melhores], distancias[melhores]
+        ordem = np.argsort(distancias, kind='stable')
+
+        return [(int(ids[p]), float(d)) for p, d in zip(posicoes[ordem], distancias[ordem])]
+
+
+_indice = IndiceProximidade()
+
+
+def indice_proximidade():
+    return _indice
+
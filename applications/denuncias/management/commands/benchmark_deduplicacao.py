@@ -0,0 +1,124 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from applications.core.models import User
+from applications.denuncias.geo import celula_de
+from applications.denuncias.hash_foto import CAMPOS_BANDAS, bandas, para_assinado, parecidas
+from applications.denuncias.models import Categoria, Denuncia
+from applications.denuncias.services import criar_ou_apoiar_denuncia
+from applications.localidades.models import Cidade, Estado
+
+# Região aproximada do território brasileiro
+LAT_MIN, LAT_MAX = -33.7, 5.2
+LON_MIN, LON_MAX = -73.9, -34.8
+# As denúncias se concentram em áreas urbanas; o desvio (em graus) espalha cada "cidade"
+TOTAL_CENTROS = 300
+DESVIO_CENTRO = 0.03
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede a latência de criação de denúncias (deduplicação por proximidade e por foto) '
+        'e da busca por hash de foto com uma massa sintética. Tudo é executado em uma transação desfeita ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, default=1_000_000, help='Quantidade de denúncias sintéticas.')
+        parser.add_argument('--amostras', type=int, default=500, help='Quantidade de criações medidas.')
+        parser.add_argument('--lote', type=int, default=5000, help='Tamanho do lote do bulk_create.')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self._executar(rng, options)
+                raise _Rollback()
+        except _Rollback:
+            self.stdout.write('Transação desfeita; nenhum dado foi mantido.')
+
+    def _executar(self, rng, options):
+        estado, _ = Estado.objects.get_or_create(uf='ZZ', defaults={'nome': 'Benchmark'})
+        cidade, _ = Cidade.objects.get_or_create(nome='Benchmark', estado=estado)
+        categorias = [Categoria.objects.get_or_create(nome=f'Benchmark {i}')[0] for i in range(11)]
+        usuario = User.objects.create_user(
+            username='benchmark_deduplicacao', email='benchmark@example.com', first_name='Benchmark'
+        )
+
+        inicio = time.perf_counter()
+        pontos = self._popular(rng, options['linhas'], options['lote'], categorias, cidade, estado)
+        self.stdout.write(f'{options["linhas"]} denúncias inseridas em {time.perf_counter() - inicio:.1f}s')
+
+        latencias = {'nova': [], 'apoio': [], 'hash': []}
+        for _ in range(options['amostras']):
+            if rng.random() < 0.5:
+                # Ponto a poucos metros de uma denúncia existente, com a foto levemente alterada
+                lat, lon, categoria, foto_hash = rng.choice(pontos)
+                lat += rng.uniform(-0.0003, 0.0003)
+                lon += rng.uniform(-0.0003, 0.0003)
+                foto_hash = para_assinado((foto_hash ^ (1 << rng.randrange(64))) & ((1 << 64) - 1))
+            else:
+                lat = rng.uniform(LAT_MIN, LAT_MAX)
+                lon = rng.uniform(LON_MIN, LON_MAX)
+                categoria = rng.choice(categorias)
+                foto_hash = para_assinado(rng.getrandbits(64))
+
+            t0 = time.perf_counter()
+            parecidas(foto_hash)
+            latencias['hash'].append((time.perf_counter() - t0) * 1000)
+
+            dados = {
+                'titulo': 'Benchmark', 'descricao': 'Benchmark', 'categoria': categoria,
+                'cidade': cidade, 'estado': estado, 'foto': 'denuncias_fotos/benchmark.jpg',
+                'latitude': round(lat, 8), 'longitude': round(lon, 8),
+                'jurisdicao': Denuncia.Jurisdicao.MUNICIPAL, 'foto_hash': foto_hash,
+            }
+            t0 = time.perf_counter()
+            _, criada, _ = criar_ou_apoiar_denuncia(dados, user=usuario)
+            latencias['nova' if criada else 'apoio'].append((time.perf_counter() - t0) * 1000)
+
+        for resultado, valores in latencias.items():
+            if not valores:
+                continue
+            valores.sort()
+            p95 = valores[int(len(valores) * 0.95) - 1] if len(valores) >= 20 else valores[-1]
+            self.stdout.write(self.style.SUCCESS(
+                f'{resultado:>5}: n={len(valores)} '
+                f'p50={statistics.median(valores):.2f}ms p95={p95:.2f}ms max={valores[-1]:.2f}ms'
+            ))
+
+    def _popular(self, rng, linhas, tamanho_lote, categorias, cidade, estado):
+        centros = [(rng.uniform(LAT_MIN, LAT_MAX), rng.uniform(LON_MIN, LON_MAX)) for _ in range(TOTAL_CENTROS)]
+        pontos = []
+        lote = []
+        for _ in range(linhas):
+            centro_lat, centro_lon = rng.choice(centros)
+            lat = round(rng.gauss(centro_lat, DESVIO_CENTRO), 8)
+            lon = round(rng.gauss(centro_lon, DESVIO_CENTRO), 8)
+            categoria = rng.choice(categorias)
+            status = rng.choice(Denuncia.Status.values)
+            foto_hash = para_assinado(rng.getrandbits(64))
+            # bulk_create não chama save(), então a célula e as faixas do hash são calculadas aqui
+            lote.append(Denuncia(
+                titulo='Benchmark', descricao='Benchmark', categoria=categoria,
+                cidade=cidade, estado=estado, foto='denuncias_fotos/benchmark.jpg',
+                latitude=lat, longitude=lon, celula_geo=celula_de(lat, lon),
+                jurisdicao=Denuncia.Jurisdicao.MUNICIPAL, status=status,
+                foto_hash=foto_hash, **dict(zip(CAMPOS_BANDAS, bandas(foto_hash))),
+            ))
+            if status != Denuncia.Status.RESOLVIDA and len(pontos) < 10_000:
+                pontos.append((lat, lon, categoria, foto_hash))
+            if len(lote) >= tamanho_lote:
+                Denuncia.objects.bulk_create(lote)
+                lote = []
+        if lote:
+            Denuncia.objects.bulk_create(lote)
+        return pontos
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from applications.denuncias.agregacao import CAMPOS_RETRATO, Variacao, agregados_registrados, retrato_de
+from applications.denuncias.models import Denuncia
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstrói do zero as tabelas agregadas mantidas incrementalmente '
+        '(grade do mapa e demais agregados registrados) a partir das denúncias.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=2000, help='Denúncias processadas por lote.')
+        parser.add_argument(
+            '--apenas',
+            nargs='+',
+            metavar='APP.MODELO',
+            help='Reconstrói apenas as tabelas indicadas (ex.: gestao_publica.EstatisticaJurisdicao).',
+        )
+
+    def handle(self, *args, **options):
+        agregados = agregados_registrados()
+        if options['apenas']:
+            pedidos = {label.lower() for label in options['apenas']}
+            agregados = [(modelo, aplicar) for modelo, aplicar in agregados if modelo._meta.label_lower in pedidos]
+            desconhecidos = pedidos - {modelo._meta.label_lower for modelo, _ in agregados}
+            if desconhecidos:
+                raise CommandError(f'Tabela(s) agregada(s) desconhecida(s): {", ".join(sorted(desconhecidos))}')
+        inicio = time.perf_counter()
+
+        with transaction.atomic():
+            for modelo, _ in agregados:
+                removidas, _ = modelo.objects.all().delete()
+                self.stdout.write(f'{modelo._meta.label}: {removidas} linha(s) removida(s).')
+
+            total = 0
+            lote = []
+            linhas = Denuncia.objects.values(*CAMPOS_RETRATO, 'total_apoios').iterator(chunk_size=options['lote'])
+            for valores in linhas:
+                lote.append(Variacao(retrato_de(valores), 1, 1 + valores['total_apoios']))
+                if len(lote) >= options['lote']:
+                    total += self._aplicar(agregados, lote)
+                    lote = []
+            total += self._aplicar(agregados, lote)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} denúncia(s) agregada(s) em {len(agregados)} tabela(s) em {time.perf_counter() - inicio:.1f}s.'
+        ))
+
+    @staticmethod
+    def _aplicar(agregados, variacoes):
+        variacoes = [variacao for variacao in variacoes if variacao.retrato is not None]
+        for _, aplicar in agregados:
+            aplicar(variacoes)
+        return len(variacoes)
@@ -0,0 +1,57 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from applications.denuncias.models import Denuncia, ApoioDenuncia, Comentario
+
+CONTADORES = [
+    ('total_apoios', ApoioDenuncia),
+    ('total_comentarios', Comentario),
+]
+
+
+def contagem_real(modelo):
+    return Coalesce(
+        Subquery(
+            modelo.objects.filter(denuncia=OuterRef('pk'))
+            .order_by().values('denuncia').annotate(total=Count('id')).values('total')
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula total_apoios e total_comentarios das denúncias, corrigindo divergências. '
+        'Se algum total_apoios mudar, reconstrói as tabelas agregadas, cujo peso depende dele.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas informa quantas denúncias estão divergentes, sem corrigir.',
+        )
+
+    def handle(self, *args, **options):
+        for campo, modelo in CONTADORES:
+            divergentes = Denuncia.objects.annotate(real=contagem_real(modelo)).exclude(**{campo: F('real')})
+
+            if options['dry_run']:
+                self.stdout.write(f'{campo}: {divergentes.count()} denúncia(s) divergente(s).')
+                continue
+
+            with transaction.atomic():
+                corrigidas = Denuncia.objects.filter(
+                    pk__in=Subquery(divergentes.values('pk'))
+                ).update(**{campo: contagem_real(modelo)})
+
+            estilo = self.style.WARNING if corrigidas else self.style.SUCCESS
+            self.stdout.write(estilo(f'{campo}: {corrigidas} denúncia(s) corrigida(s).'))
+
+            if campo == 'total_apoios' and corrigidas:
+                # Não dá para saber se o peso nos agregados divergiu junto com o contador
+                # (apoios perdidos) ou não (contador alterado à mão): refaz a partir dele
+                call_command('reconstruir_agregados', stdout=self.stdout, stderr=self.stderr)
@@ -0,0 +1,89 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from applications.denuncias.hash_foto import CAMPOS_BANDAS, distancia, distancia_maxima, hash_da_foto
+from applications.denuncias.models import Denuncia
+from applications.denuncias.services import haversine_distance
+
+
+class Command(BaseCommand):
+    help = (
+        'Lista pares de denúncias separadas com a mesma foto (dHash a poucos bits), '
+        'para revisão e eventual junção.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todas',
+            action='store_true',
+            help='Inclui denúncias resolvidas (por padrão, só abertas e em análise).',
+        )
+        parser.add_argument(
+            '--raio',
+            type=float,
+            help='Só lista pares a até RAIO metros um do outro.',
+        )
+        parser.add_argument(
+            '--calcular-faltantes',
+            action='store_true',
+            help='Antes do relatório, calcula o hash das fotos que ainda não têm (lê cada foto do storage).',
+        )
+
+    def handle(self, *args, **options):
+        if options['calcular_faltantes']:
+            self._calcular_faltantes()
+
+        denuncias = Denuncia.objects.filter(foto_hash__isnull=False)
+        if not options['todas']:
+            denuncias = denuncias.filter(status__in=[Denuncia.Status.ABERTA, Denuncia.Status.EM_ANALISE])
+        linhas = {
+            pk: resto for pk, *resto in denuncias.values_list(
+                'pk', 'foto_hash', 'latitude', 'longitude', 'categoria__nome', *CAMPOS_BANDAS
+            )
+        }
+
+        # Só compara quem divide alguma faixa do hash, como na busca da deduplicação
+        faixas = defaultdict(list)
+        for pk, (_, _, _, _, *valores) in linhas.items():
+            for indice, valor in enumerate(valores):
+                faixas[(indice, valor)].append(pk)
+
+        limite = distancia_maxima()
+        pares = {}
+        for membros in faixas.values():
+            for posicao, pk_a in enumerate(membros):
+                for pk_b in membros[posicao + 1:]:
+                    chave = (min(pk_a, pk_b), max(pk_a, pk_b))
+                    if chave in pares:
+                        continue
+                    bits = distancia(linhas[pk_a][0], linhas[pk_b][0])
+                    if bits > limite:
+                        continue
+                    metros = haversine_distance(linhas[pk_a][1], linhas[pk_a][2], linhas[pk_b][1], linhas[pk_b][2])
+                    if options['raio'] is not None and metros > options['raio']:
+                        continue
+                    pares[chave] = (bits, metros)
+
+        for (pk_a, pk_b), (bits, metros) in sorted(pares.items(), key=lambda item: item[1]):
+            categorias = {linhas[pk_a][3], linhas[pk_b][3]}
+            self.stdout.write(
+                f'#{pk_a} x #{pk_b}: {bits} bit(s) de diferença, {metros:.0f} m, {" / ".join(sorted(categorias))}'
+            )
+        estilo = self.style.WARNING if pares else self.style.SUCCESS
+        self.stdout.write(estilo(f'{len(pares)} par(es) de denúncias com a mesma foto.'))
+
+    def _calcular_faltantes(self):
+        calculadas = 0
+        for denuncia in Denuncia.objects.filter(foto_hash__isnull=True).exclude(foto='').iterator():
+            try:
+                with denuncia.foto.open('rb') as arquivo:
+                    foto_hash = hash_da_foto(arquivo)
+            except OSError as e:
+                self.stdout.write(self.style.ERROR(f'Denúncia #{denuncia.pk}: não foi possível ler a foto ({e}).'))
+                continue
+            if foto_hash is not None:
+                denuncia.foto_hash = foto_hash
+                denuncia.save(update_fields=['foto_hash'])
+                calculadas += 1
+        self.stdout.write(f'Hash calculado para {calculadas} foto(s).')
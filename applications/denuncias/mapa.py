@@ -0,0 +1,153 @@
+"""
+Agrupamento de denúncias para o mapa, calculado no servidor.
+
+A grade é hierárquica: no nível N cada célula mede 360 / 2^N graus. Um tile de
+256 px no zoom Z mede 360 / 2^Z graus, então o nível Z + 3 dá ~8x8 células por
+tile. As contagens por célula de todos os níveis ficam em CelulaMapa, mantidas a
+cada variação, e uma consulta lê apenas as células do viewport: o custo depende
+do número de células na tela, nunca do número de denúncias.
+"""
+from math import floor
+
+from django.db.models import Q, Sum
+
+from . import agregacao
+from .geo import chave_celula, indices_celula
+from .models import CelulaMapa, Denuncia
+
+NIVEL_MINIMO = 3
+NIVEL_MAXIMO = 18
+NIVEIS_POR_ZOOM = 3  # 2^3 = 8 células por tile
+
+ZOOM_PONTOS = 16  # A partir deste zoom, retorna denúncias individuais
+MAX_CELULAS = 400
+MAX_PONTOS = 300
+MAX_LINHAS_GRADE_PONTOS = 200
+
+CHAVE = ('nivel', 'y', 'x', 'categoria', 'status')
+
+
+def tamanho_celula(nivel):
+    return 360.0 / (1 << nivel)
+
+
+def indices(latitude, longitude, nivel):
+    tamanho = tamanho_celula(nivel)
+    return int(floor((longitude + 180.0) / tamanho)), int(floor((latitude + 90.0) / tamanho))
+
+
+def aplicar_variacoes(variacoes):
+    incrementos = {}
+    for variacao in variacoes:
+        if not variacao.denuncias:
+            continue
+        retrato = variacao.retrato
+        for nivel in range(NIVEL_MINIMO, NIVEL_MAXIMO + 1):
+            x, y = indices(retrato.latitude, retrato.longitude, nivel)
+            deltas = incrementos.setdefault(
+                (nivel, y, x, retrato.categoria_id, retrato.status),
+                {'total': 0, 'soma_latitude': 0.0, 'soma_longitude': 0.0},
+            )
+            deltas['total'] += variacao.denuncias
+            deltas['soma_latitude'] += variacao.denuncias * retrato.latitude
+            deltas['soma_longitude'] += variacao.denuncias * retrato.longitude
+    agregacao.incrementar(CelulaMapa, CHAVE, incrementos)
+
+
+agregacao.registrar(CelulaMapa, aplicar_variacoes)
+
+
+def _faixas(bbox, nivel):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x0, y0 = indices(min_lat, min_lon, nivel)
+    x1, y1 = indices(max_lat, max_lon, nivel)
+    return x0, x1, y0, y1
+
+
+def escolher_nivel(bbox, zoom):
+    """Nível correspondente ao zoom, reduzido até o viewport caber em MAX_CELULAS células."""
+    nivel = min(max(zoom + NIVEIS_POR_ZOOM, NIVEL_MINIMO), NIVEL_MAXIMO)
+    while nivel > NIVEL_MINIMO:
+        x0, x1, y0, y1 = _faixas(bbox, nivel)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= MAX_CELULAS:
+            break
+        nivel -= 1
+    return nivel
+
+
+def _filtrar(queryset, categoria_id, status_lista):
+    if categoria_id is not None:
+        queryset = queryset.filter(categoria_id=categoria_id)
+    if status_lista:
+        queryset = queryset.filter(status__in=status_lista)
+    return queryset
+
+
+def clusters(bbox, nivel, categoria_id=None, status_lista=None):
+    x0, x1, y0, y1 = _faixas(bbox, nivel)
+    celulas = _filtrar(
+        CelulaMapa.objects.filter(nivel=nivel, y__range=(y0, y1), x__range=(x0, x1), total__gt=0),
+        categoria_id, status_lista,
+    ).values('x', 'y').annotate(
+        total_celula=Sum('total'),
+        soma_lat=Sum('soma_latitude'),
+        soma_lon=Sum('soma_longitude'),
+    ).order_by()
+
+    return [
+        {
+            'latitude': round(celula['soma_lat'] / celula['total_celula'], 6),
+            'longitude': round(celula['soma_lon'] / celula['total_celula'], 6),
+            'total': celula['total_celula'],
+        }
+        for celula in celulas if celula['total_celula'] > 0
+    ]
+
+
+def pontos(bbox, categoria_id=None, status_lista=None):
+    """
+    Denúncias individuais no viewport, usando as faixas de celula_geo (uma por linha
+    da grade de deduplicação). Retorna None quando o viewport é grande demais ou tem
+    mais de MAX_PONTOS denúncias; nesse caso o chamador deve agrupar.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    lat_lo, lon_lo = indices_celula(min_lat, min_lon)
+    lat_hi, lon_hi = indices_celula(max_lat, max_lon)
+    if lat_hi - lat_lo + 1 > MAX_LINHAS_GRADE_PONTOS:
+        return None
+
+    faixas = Q()
+    for linha in range(lat_lo, lat_hi + 1):
+        faixas |= Q(celula_geo__range=(chave_celula(linha, lon_lo), chave_celula(linha, lon_hi)))
+
+    denuncias = list(_filtrar(
+        Denuncia.objects.filter(faixas).filter(
+            latitude__gte=min_lat, latitude__lte=max_lat,
+            longitude__gte=min_lon, longitude__lte=max_lon,
+        ),
+        categoria_id, status_lista,
+    ).order_by().values('id', 'titulo', 'latitude', 'longitude', 'categoria_id', 'status')[:MAX_PONTOS + 1])
+
+    if len(denuncias) > MAX_PONTOS:
+        return None
+    return [
+        {
+            'id': denuncia['id'],
+            'titulo': denuncia['titulo'],
+            'latitude': float(denuncia['latitude']),
+            'longitude': float(denuncia['longitude']),
+            'categoria': denuncia['categoria_id'],
+            'status': denuncia['status'],
+        }
+        for denuncia in denuncias
+    ]
+
+
+def mapa(bbox, zoom, categoria_id=None, status_lista=None):
+    if zoom >= ZOOM_PONTOS:
+        encontrados = pontos(bbox, categoria_id, status_lista)
+        if encontrados is not None:
+            return {'tipo': 'pontos', 'nivel': None, 'features': encontrados}
+
+    nivel = escolher_nivel(bbox, zoom)
+    return {'tipo': 'clusters', 'nivel': nivel, 'features': clusters(bbox, nivel, categoria_id, status_lista)}
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+from applications.denuncias.geo import celula_de
+
+
+def preencher_celulas(apps, schema_editor):
+    """Calcula a célula da grade para as denúncias já existentes."""
+    Denuncia = apps.get_model('denuncias', 'Denuncia')
+    lote = []
+    for denuncia in Denuncia.objects.only('id', 'latitude', 'longitude').iterator(chunk_size=2000):
+        denuncia.celula_geo = celula_de(denuncia.latitude, denuncia.longitude)
+        lote.append(denuncia)
+        if len(lote) >= 2000:
+            Denuncia.objects.bulk_update(lote, ['celula_geo'])
+            lote = []
+    if lote:
+        Denuncia.objects.bulk_update(lote, ['celula_geo'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('denuncias', '0006_denuncia_endereco'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='denuncia',
+            name='celula_geo',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(preencher_celulas, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['-data_criacao'], name='denuncias_d_data_cr_7b29a2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['status'], name='denuncias_d_status_33bbb7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['categoria'], name='denuncias_d_categor_573a04_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['cidade'], name='denuncias_d_cidade__a4d3d6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['autor', '-data_criacao'], name='denuncias_d_autor_i_928681_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['categoria', 'status', 'celula_geo'], name='denuncias_d_categor_544d99_idx'),
+        ),
+    ]
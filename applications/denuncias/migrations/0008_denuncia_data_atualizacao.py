@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('denuncias', '0007_denuncia_celula_geo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='denuncia',
+            name='data_atualizacao',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['data_atualizacao'], name='denuncias_d_data_at_d1b043_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def preencher_contadores(apps, schema_editor):
+    """Calcula total_apoios e total_comentarios das denúncias existentes."""
+    Denuncia = apps.get_model('denuncias', 'Denuncia')
+    for campo, relacionado in [('total_apoios', 'ApoioDenuncia'), ('total_comentarios', 'Comentario')]:
+        Modelo = apps.get_model('denuncias', relacionado)
+        contagem = (
+            Modelo.objects.filter(denuncia=OuterRef('pk'))
+            .order_by().values('denuncia').annotate(total=Count('id')).values('total')
+        )
+        Denuncia.objects.update(**{campo: Coalesce(Subquery(contagem), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('denuncias', '0008_denuncia_data_atualizacao'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='denuncia',
+            name='total_apoios',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='denuncia',
+            name='total_comentarios',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(preencher_contadores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['-total_apoios', '-data_criacao'], name='denuncias_d_total_a_9996ff_idx'),
+        ),
+    ]
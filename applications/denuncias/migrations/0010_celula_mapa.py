@@ -0,0 +1,70 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:56
+
+from math import floor
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+NIVEL_MINIMO = 3
+NIVEL_MAXIMO = 18
+
+
+def popular_celulas_mapa(apps, schema_editor):
+    """Agrega as denúncias existentes na grade do mapa (mesma regra de mapa.py)."""
+    Denuncia = apps.get_model('denuncias', 'Denuncia')
+    CelulaMapa = apps.get_model('denuncias', 'CelulaMapa')
+
+    celulas = {}
+    for categoria_id, status, latitude, longitude in Denuncia.objects.values_list(
+        'categoria_id', 'status', 'latitude', 'longitude'
+    ).iterator(chunk_size=2000):
+        latitude, longitude = float(latitude), float(longitude)
+        for nivel in range(NIVEL_MINIMO, NIVEL_MAXIMO + 1):
+            tamanho = 360.0 / (1 << nivel)
+            x = int(floor((longitude + 180.0) / tamanho))
+            y = int(floor((latitude + 90.0) / tamanho))
+            celula = celulas.setdefault((nivel, y, x, categoria_id, status), [0, 0.0, 0.0])
+            celula[0] += 1
+            celula[1] += latitude
+            celula[2] += longitude
+
+    CelulaMapa.objects.bulk_create(
+        [
+            CelulaMapa(
+                nivel=nivel, y=y, x=x, categoria_id=categoria_id, status=status,
+                total=total, soma_latitude=soma_lat, soma_longitude=soma_lon,
+            )
+            for (nivel, y, x, categoria_id, status), (total, soma_lat, soma_lon) in celulas.items()
+        ],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('denuncias', '0009_denuncia_contadores_engajamento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CelulaMapa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nivel', models.PositiveSmallIntegerField()),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('status', models.CharField(choices=[('ABERTA', 'Aberta'), ('EM_ANALISE', 'Em Análise'), ('RESOLVIDA', 'Resolvida')], max_length=20)),
+                ('total', models.IntegerField(default=0)),
+                ('soma_latitude', models.FloatField(default=0)),
+                ('soma_longitude', models.FloatField(default=0)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='denuncias.categoria')),
+            ],
+            options={
+                'verbose_name': 'Célula do Mapa',
+                'verbose_name_plural': 'Células do Mapa',
+                'constraints': [models.UniqueConstraint(fields=('nivel', 'y', 'x', 'categoria', 'status'), name='celula_mapa_unica')],
+            },
+        ),
+        migrations.RunPython(popular_celulas_mapa, migrations.RunPython.noop),
+    ]
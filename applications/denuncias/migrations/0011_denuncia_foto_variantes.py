@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('denuncias', '0010_celula_mapa'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='denuncia',
+            name='foto_variantes',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
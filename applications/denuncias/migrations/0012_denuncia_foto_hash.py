@@ -0,0 +1,57 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('denuncias', '0011_denuncia_foto_variantes'),
+        ('localidades', '0003_geocodificacao_cache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='denuncia',
+            name='foto_hash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='denuncia',
+            name='foto_hash_b0',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='denuncia',
+            name='foto_hash_b1',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='denuncia',
+            name='foto_hash_b2',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='denuncia',
+            name='foto_hash_b3',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['foto_hash_b0'], name='denuncias_d_foto_ha_315d67_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['foto_hash_b1'], name='denuncias_d_foto_ha_acf865_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['foto_hash_b2'], name='denuncias_d_foto_ha_98e2b7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='denuncia',
+            index=models.Index(fields=['foto_hash_b3'], name='denuncias_d_foto_ha_cd76a8_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from applications.denuncias import busca
+
+
+def instalar(apps, schema_editor):
+    busca.instalar(schema_editor.connection)
+
+
+def remover(apps, schema_editor):
+    busca.remover(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('denuncias', '0012_denuncia_foto_hash'),
+    ]
+
+    operations = [
+        # Índice textual (FTS5 no SQLite, tsvector + GIN no PostgreSQL); ver busca.py
+        migrations.RunPython(instalar, remover),
+    ]
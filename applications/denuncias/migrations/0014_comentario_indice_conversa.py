@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('denuncias', '0013_busca_textual'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comentario',
+            index=models.Index(fields=['denuncia', 'data_criacao', 'id'], name='denuncias_c_denunci_7a2dfc_idx'),
+        ),
+    ]
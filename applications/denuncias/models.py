@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
+from applications.core.medicao import trecho
+from applications.core.models import VersaoDados
 from applications.localidades.models import Cidade, Estado
+from .geo import celula_de
+from .hash_foto import CAMPOS_BANDAS, bandas
+from .agregacao import CAMPOS_RETRATO, retrato_de
 
 class Categoria(models.Model):
     nome = models.CharField(max_length=100, unique=True)
@@ -10,6 +15,17 @@ class Categoria(models.Model):
         verbose_name = _('Categoria')
         verbose_name_plural = _('Categorias')
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            VersaoDados.incrementar('categorias')
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            resultado = super().delete(*args, **kwargs)
+            VersaoDados.incrementar('categorias')
+        return resultado
+
     def __str__(self):
         return self.nome
 
@@ -41,16 +57,34 @@ class Denuncia(models.Model):
     estado = models.ForeignKey(Estado, on_delete=models.PROTECT, related_name='denuncias')
     
     foto = models.ImageField(upload_to='denuncias_fotos/', blank=False, null=False)
+    # Miniaturas geradas a partir da foto (ver imagens.gerar_variantes)
+    foto_variantes = models.JSONField(default=dict, blank=True, editable=False)
+    # dHash da foto e suas faixas de 16 bits, indexadas para a busca por Hamming (ver hash_foto.py)
+    foto_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+    foto_hash_b0 = models.IntegerField(null=True, blank=True, editable=False)
+    foto_hash_b1 = models.IntegerField(null=True, blank=True, editable=False)
+    foto_hash_b2 = models.IntegerField(null=True, blank=True, editable=False)
+    foto_hash_b3 = models.IntegerField(null=True, blank=True, editable=False)
     
     endereco = models.CharField(max_length=500, blank=True, null=True)
     
     latitude = models.DecimalField(max_digits=10, decimal_places=8)
     longitude = models.DecimalField(max_digits=11, decimal_places=8)
+    celula_geo = models.BigIntegerField(null=True, blank=True, editable=False)  # Ver geo.py
     
     jurisdicao = models.CharField(max_length=20, choices=Jurisdicao.choices)
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.ABERTA)
     
     data_criacao = models.DateTimeField(auto_now_add=True)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    # Contadores desnormalizados, mantidos com F() pelos signals de ApoioDenuncia e
+    # Comentario, que também valem para exclusões em cascata e em lote
+    # (ver comando "recount" para corrigir divergências)
+    total_apoios = models.PositiveIntegerField(default=0, editable=False)
+    total_comentarios = models.PositiveIntegerField(default=0, editable=False)
+
+    CONTADORES = ('total_apoios', 'total_comentarios')
 
     class Meta:
         verbose_name = _('Denúncia')
@@ -62,9 +96,54 @@ class Denuncia(models.Model):
             models.Index(fields=['categoria']),  # Filtra por categoria
             models.Index(fields=['cidade']),  # Filtra por cidade
             models.Index(fields=['autor', '-data_criacao']),  # Minhas denúncias
-            models.Index(fields=['latitude', 'longitude']),  # Busca geográfica
+            models.Index(fields=['categoria', 'status', 'celula_geo']),  # Busca de duplicadas
+            models.Index(fields=['data_atualizacao']),  # Sincronização do índice de proximidade
+            models.Index(fields=['-total_apoios', '-data_criacao']),  # Ordenação por engajamento
+            models.Index(fields=['foto_hash_b0']),  # Fotos parecidas (uma faixa por índice)
+            models.Index(fields=['foto_hash_b1']),
+            models.Index(fields=['foto_hash_b2']),
+            models.Index(fields=['foto_hash_b3']),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Estado salvo usado para calcular as variações das tabelas agregadas (signals.py)
+        if all(campo in instance.__dict__ for campo in CAMPOS_RETRATO):
+            instance._retrato_salvo = retrato_de(instance)
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Mantém a célula da grade sincronizada com as coordenadas
+        self.celula_geo = celula_de(self.latitude, self.longitude)
+        # E as faixas indexadas com o hash da foto
+        for campo, valor in zip(CAMPOS_BANDAS, bandas(self.foto_hash)):
+            setattr(self, campo, valor)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # Nunca regrava os contadores com valores possivelmente desatualizados
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.CONTADORES
+                and field.name != 'foto_variantes'  # Gravado à parte, com update()
+            ]
+            kwargs['update_fields'] = update_fields
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'celula_geo'}
+        if update_fields is not None and 'foto_hash' in update_fields:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set(CAMPOS_BANDAS)
+        if update_fields is None or 'foto' in update_fields:
+            self.enviar_foto()
+        # As tabelas agregadas são atualizadas pelos signals na mesma transação
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def enviar_foto(self):
+        """Grava no storage a foto recém-recebida (o que FileField.pre_save faria), medindo o envio."""
+        if self.foto and not self.foto._committed:
+            with trecho('armazenamento'):
+                self.foto.save(self.foto.name, self.foto.file, save=False)
+
     def __str__(self):
         return self.titulo
 
@@ -78,6 +157,11 @@ class ApoioDenuncia(models.Model):
         verbose_name_plural = _('Apoios de Denúncias')
         unique_together = [['denuncia', 'apoiador']]
 
+    def save(self, *args, **kwargs):
+        # O contador da denúncia é ajustado no post_save (signals.py), na mesma transação
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f'{self.apoiador} apoiou {self.denuncia.titulo}'
 
@@ -98,6 +182,39 @@ class Comentario(models.Model):
         verbose_name = _('Comentário')
         verbose_name_plural = _('Comentários')
         ordering = ['data_criacao']
+        indexes = [
+            models.Index(fields=['denuncia', 'data_criacao', 'id']),  # Conversa paginada por cursor
+        ]
+
+    def save(self, *args, **kwargs):
+        # O contador da denúncia é ajustado no post_save (signals.py), na mesma transação
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f'Comentário de {self.autor} em "{self.denuncia.titulo}"'
+
+class CelulaMapa(models.Model):
+    """
+    Contagem de denúncias por célula da grade hierárquica do mapa, por categoria e status.
+    Mantida incrementalmente (ver mapa.py); soma_latitude/soma_longitude dão o centróide.
+    """
+    nivel = models.PositiveSmallIntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=20, choices=Denuncia.Status.choices)
+    total = models.IntegerField(default=0)
+    soma_latitude = models.FloatField(default=0)
+    soma_longitude = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = _('Célula do Mapa')
+        verbose_name_plural = _('Células do Mapa')
+        constraints = [
+            # Também atende a busca por viewport (nivel + faixa de y + faixa de x)
+            models.UniqueConstraint(fields=['nivel', 'y', 'x', 'categoria', 'status'], name='celula_mapa_unica'),
+        ]
 
     def __str__(self):
-        return f'Comentário de {self.autor} em "{self.denuncia.titulo}"'
\ No newline at end of file
+        return f'Nível {self.nivel} ({self.x}, {self.y}): {self.total}'
@@ -0,0 +1,46 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class FeedCursorPagination(CursorPagination):
+    """
+    Paginação por cursor (keyset) em (-data_criacao, -id): sem OFFSET e sem COUNT,
+    estável quando novas denúncias são inseridas durante a rolagem infinita.
+    """
+    ordering = ('-data_criacao', '-id')
+
+    def decode_cursor(self, request):
+        # "?cursor=" vazio pede a primeira página no modo cursor
+        if not request.query_params.get(self.cursor_query_param):
+            return None
+        return super().decode_cursor(request)
+
+
+class ComentarioCursorPagination(CursorPagination):
+    """
+    Comentários de uma denúncia em keyset (data_criacao, id), do mais antigo ao mais
+    novo, usando o índice (denuncia, data_criacao, id): o custo de uma página não
+    depende do tamanho da conversa.
+    """
+    ordering = ('data_criacao', 'id')
+
+
+class DenunciaPagination(PageNumberPagination):
+    """
+    Paginação por número de página (padrão, usada pelo dashboard web) ou por cursor,
+    quando o parâmetro "cursor" está presente na requisição.
+    """
+    cursor_query_param = FeedCursorPagination.cursor_query_param
+
+    def __init__(self):
+        self.cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.cursor_paginator = FeedCursorPagination()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
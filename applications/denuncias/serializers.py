@@ -1,4 +1,7 @@
+from django.conf import settings
 from rest_framework import serializers
+from .hash_foto import hash_da_foto
+from .imagens import FotoInvalida, conferir_dimensoes, formato_aceito, normalizar_upload, url_variante
 from .models import Categoria, Denuncia, ApoioDenuncia, Comentario
 from applications.autenticacao.serializers import UserSerializer
 
@@ -7,12 +10,32 @@ class CategoriaSerializer(serializers.ModelSerializer):
         model = Categoria
         fields = '__all__'
 
-class DenunciaListSerializer(serializers.ModelSerializer):
+class VariantesFotoMixin(serializers.Serializer):
+    """
+    Campos foto_thumb e foto_card, em WebP quando o Accept da requisição permitir.
+    As views que usam estes campos devem responder com Vary: Accept.
+    """
+    foto_thumb = serializers.SerializerMethodField()
+    foto_card = serializers.SerializerMethodField()
+
+    def _url_variante(self, obj, variante):
+        request = self.context.get('request')
+        url = url_variante(obj, variante, formato_aceito(request))
+        if url and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def get_foto_thumb(self, obj):
+        return self._url_variante(obj, 'thumb')
+
+    def get_foto_card(self, obj):
+        return self._url_variante(obj, 'card')
+
+class DenunciaListSerializer(VariantesFotoMixin, serializers.ModelSerializer):
     """
     Serializer otimizado para listagem de denúncias.
     Não inclui objetos nested pesados, apenas IDs e nomes.
     """
-    total_apoios = serializers.IntegerField(read_only=True)  # Vem do annotate
     categoria_nome = serializers.CharField(source='categoria.nome', read_only=True)
     cidade_nome = serializers.CharField(source='cidade.nome', read_only=True)
     estado_nome = serializers.CharField(source='estado.nome', read_only=True)
@@ -26,8 +49,8 @@ class DenunciaListSerializer(serializers.ModelSerializer):
             'id', 'titulo', 'descricao', 'autor_nome', 'autor_convidado',
             'categoria', 'categoria_nome', 'cidade', 'cidade_nome',
             'estado', 'estado_nome', 'estado_sigla',
-            'foto', 'endereco', 'latitude', 'longitude',
-            'jurisdicao', 'status', 'data_criacao', 'total_apoios', 'eh_autor'
+            'foto', 'foto_thumb', 'foto_card', 'endereco', 'latitude', 'longitude',
+            'jurisdicao', 'status', 'data_criacao', 'total_apoios', 'total_comentarios', 'eh_autor'
         ]
     
     def get_autor_nome(self, obj):
@@ -51,12 +74,11 @@ class DenunciaListSerializer(serializers.ModelSerializer):
         # Verifica se o usuário autenticado é o autor
         return obj.autor is not None and obj.autor.id == user.id
 
-class DenunciaSerializer(serializers.ModelSerializer):
+class DenunciaSerializer(VariantesFotoMixin, serializers.ModelSerializer):
     """
     Serializer completo para detalhes de denúncia (create, update, retrieve).
     """
     autor = UserSerializer(read_only=True, required=False)
-    total_apoios = serializers.IntegerField(read_only=True, default=0)  # Vem do annotate
     autor_convidado = serializers.CharField(
         max_length=150, 
         required=False, 
@@ -73,11 +95,11 @@ class DenunciaSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'titulo', 'descricao', 'autor', 'autor_convidado',
             'categoria', 'categoria_nome', 'cidade', 'cidade_nome',
-            'estado', 'estado_nome', 'foto', 'endereco',
+            'estado', 'estado_nome', 'foto', 'foto_thumb', 'foto_card', 'endereco',
             'latitude', 'longitude', 'jurisdicao', 'status',
-            'data_criacao', 'total_apoios', 'eh_autor'
+            'data_criacao', 'total_apoios', 'total_comentarios', 'eh_autor'
         ]
-        read_only_fields = ('autor', 'data_criacao', 'total_apoios', 'eh_autor')
+        read_only_fields = ('autor', 'data_criacao', 'total_apoios', 'total_comentarios', 'eh_autor')
         extra_kwargs = {
             'autor_convidado': {'write_only': False, 'required': False}
         }
@@ -98,7 +120,21 @@ class DenunciaSerializer(serializers.ModelSerializer):
         # Verifica se o usuário autenticado é o autor
         return obj.autor is not None and obj.autor.id == user.id
 
+    def validate_foto(self, foto):
+        try:
+            # Em segundo plano, a foto é normalizada depois de gravada (ver imagens.py)
+            if settings.FOTOS_EM_SEGUNDO_PLANO:
+                conferir_dimensoes(foto)
+                return foto
+            return normalizar_upload(foto)
+        except FotoInvalida as e:
+            raise serializers.ValidationError(str(e))
+
     def validate(self, data):
+        if data.get('foto'):
+            # Usado na deduplicação por foto (services.mesma_foto)
+            data['foto_hash'] = hash_da_foto(data['foto'])
+
         request = self.context.get('request')
         user = request.user if request else None
         autor_convidado = data.get('autor_convidado')
@@ -136,4 +172,20 @@ class ComentarioSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comentario
         fields = ['id', 'denuncia', 'autor', 'autor_convidado', 'texto', 'data_criacao']
-        read_only_fields = ('id', 'autor', 'data_criacao')
\ No newline at end of file
+        read_only_fields = ('id', 'autor', 'data_criacao')
+
+class ComentarioResumoSerializer(serializers.ModelSerializer):
+    """
+    Comentário para a listagem da conversa: o autor vem só com id e nome
+    (sem e-mail ou datas da conta). Espera a consulta de comentarios_da_denuncia.
+    """
+    autor = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Comentario
+        fields = ['id', 'autor', 'autor_convidado', 'texto', 'data_criacao']
+
+    def get_autor(self, obj):
+        if obj.autor_id is None:
+            return None
+        return {'id': obj.autor_id, 'nome': obj.autor.get_full_name() or obj.autor.username}
@@ -1,12 +1,31 @@
+from collections import defaultdict
 from math import radians, sin, cos, sqrt, atan2
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 import logging
+import numpy as np
+
+from applications.core import metricas
+from applications.core.registro import evento
 
 from .models import Denuncia, ApoioDenuncia
+from .geo import celula_de, celulas_vizinhas
+from .hash_foto import CAMPOS_BANDAS, bandas, distancia_maxima, parecidas, parecidas_em_lote
+from .imagens import agendar_normalizacao
+from . import agregacao, hash_foto
+from .agregacao import CAMPOS_RETRATO, Variacao, retrato_de
 
 SEARCH_RADIUS_METERS = 100
+CANDIDATAS_MAXIMAS = 50  # Denúncias comparadas por envio, as mais recentes da vizinhança
+LOTE_MAXIMO = 1000  # IDs por requisição nas ações em lote dos gestores
+LOTE_DENUNCIAS_MAXIMO = 50  # Denúncias (cada uma com foto) por requisição na sincronização em lote
 EARTH_RADIUS_KM = 6371.0
 
+STATUS_DEDUPLICADOS = (Denuncia.Status.ABERTA, Denuncia.Status.EM_ANALISE)  # Recebem apoios de novas denúncias
+
 logger = logging.getLogger(__name__)
 
 def haversine_distance(lat1, lon1, lat2, lon2):
@@ -21,57 +40,146 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     distance_km = EARTH_RADIUS_KM * c
     return distance_km * 1000
 
+def haversine_distance_vetorizada(lat, lon, lats, lons):
+    """Versão em lote de haversine_distance: distâncias (m) de um ponto a arrays de pontos."""
+    lat1, lon1 = radians(float(lat)), radians(float(lon))
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+
+    a = np.sin(dlat / 2)**2 + cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_KM * c * 1000
+
+def candidatas_proximas(categoria, latitude, longitude, excluir=None):
+    """
+    Até CANDIDATAS_MAXIMAS denúncias não resolvidas da categoria nas células vizinhas
+    ao ponto, mais recentes primeiro, só com os campos da comparação.
+    Sondagem por igualdade no índice (categoria, status, celula_geo); as células cobrem
+    todo o raio e a distância exata é decidida por primeira_no_raio.
+    """
+    candidatas = _abertas_nas_celulas([categoria], celulas_vizinhas(latitude, longitude, SEARCH_RADIUS_METERS))
+    if excluir is not None:
+        candidatas = candidatas.exclude(pk=excluir)
+    return candidatas.only('id', 'latitude', 'longitude', 'foto_hash', 'data_criacao').order_by(
+        '-data_criacao'
+    )[:CANDIDATAS_MAXIMAS]
+
+def _abertas_nas_celulas(categorias, celulas):
+    """Denúncias não resolvidas das `categorias` nas `celulas` da grade."""
+    return Denuncia.objects.filter(categoria__in=categorias, status__in=STATUS_DEDUPLICADOS, celula_geo__in=celulas)
+
+def primeira_no_raio(candidatas, latitude, longitude, foto_hash=None):
+    """
+    (denuncia completa, distancia) da primeira candidata a até SEARCH_RADIUS_METERS, ou
+    (None, None). Com `foto_hash`, ignora as candidatas com outra foto (hash_foto.outra_foto).
+    """
+    for denuncia in candidatas:
+        if hash_foto.outra_foto(foto_hash, denuncia.foto_hash):
+            continue
+        distancia = haversine_distance(
+            latitude, longitude,
+            denuncia.latitude, denuncia.longitude
+        )
+        if distancia <= SEARCH_RADIUS_METERS:
+            # As candidatas vêm só com os campos da comparação
+            return Denuncia.objects.get(pk=denuncia.pk), distancia
+    return None, None
+
+def mesma_foto(categoria, latitude, longitude, foto_hash):
+    """
+    Denúncia não resolvida da categoria com a mesma foto (dHash a poucos bits) a até
+    FOTO_DUPLICADA_RAIO_METROS do ponto: o mesmo problema reenviado com outro GPS.
+    Retorna (denuncia, distancia) ou (None, None).
+    """
+    pk, distancia = mais_parecida(
+        _parecidas_abertas(parecidas(foto_hash, 'latitude', 'longitude', 'categoria', 'status'), categoria.pk),
+        latitude, longitude,
+    )
+    if pk is None:
+        return None, None
+    return Denuncia.objects.get(pk=pk), distancia
+
+def _parecidas_abertas(encontradas, categoria_id):
+    """Resultado de hash_foto.parecidas restrito à categoria e às não resolvidas: [(bits, pk, lat, lon)]."""
+    return [
+        (bits, pk, lat, lon)
+        for bits, pk, lat, lon, outra_categoria, situacao in encontradas
+        if outra_categoria == categoria_id and situacao in STATUS_DEDUPLICADOS
+    ]
+
+def mais_parecida(encontradas, latitude, longitude):
+    """
+    Entre [(bits, chave, lat, lon)], a chave da foto mais parecida (e, no empate,
+    mais próxima) a até FOTO_DUPLICADA_RAIO_METROS do ponto, com a distância.
+    """
+    melhor = None
+    for bits, chave, lat, lon in encontradas:
+        distancia = haversine_distance(latitude, longitude, lat, lon)
+        if distancia <= settings.FOTO_DUPLICADA_RAIO_METROS and (melhor is None or (bits, distancia) < melhor[:2]):
+            melhor = (bits, distancia, chave)
+    if melhor is None:
+        return None, None
+    return melhor[2], melhor[1]
+
+def transferir_apoios(origem, destino):
+    """
+    Move os apoios de `origem` para `destino` com um UPDATE e remove, com um DELETE,
+    os que já existiam no destino (mesmo apoiador). Retorna quantos foram movidos.
+    Nem o UPDATE nem o DELETE passam pelos signals (que custariam consultas por
+    apoio), então contadores e agregados são ajustados aqui, uma vez por denúncia.
+    """
+    apoiadores_destino = ApoioDenuncia.objects.filter(denuncia=destino).values('apoiador')
+    movidos = ApoioDenuncia.objects.filter(denuncia=origem).exclude(
+        apoiador__in=apoiadores_destino
+    ).update(denuncia=destino)
+    # ApoioDenuncia não tem dependentes: o DELETE direto não deixa nada para a cascata
+    removidos = ApoioDenuncia.objects.filter(denuncia=origem)._raw_delete(ApoioDenuncia.objects.db)
+
+    Denuncia.objects.filter(pk=destino.pk).update(total_apoios=F('total_apoios') + movidos)
+    Denuncia.objects.filter(pk=origem.pk).update(total_apoios=F('total_apoios') - (movidos + removidos))
+    origem.total_apoios = 0
+    agregacao.notificar([
+        Variacao(retrato_de(origem), 0, -(movidos + removidos)),
+        Variacao(retrato_de(destino), 0, movidos),
+    ])
+    return movidos
+
 def criar_ou_apoiar_denuncia(validated_data, user=None, autor_convidado=None):
     new_lat = validated_data.get('latitude')
     new_lon = validated_data.get('longitude')
     categoria = validated_data.get('categoria')
 
-    logger.info(f"🆕 Nova denúncia/apoio recebido:")
-    logger.info(f"   Categoria: {categoria.nome}")
-    logger.info(f"   Coordenadas: {new_lat}, {new_lon}")
-    logger.info(f"   Usuário: {user.username if user else autor_convidado}")
+    def registrar(resultado, denuncia, criterio=None, candidatas=None, distancia=None):
+        # Um evento por decisão, só com o que já foi calculado (nenhuma consulta a mais)
+        metricas.incrementar(metricas.DEDUPLICACAO, resultado=resultado, criterio=criterio or 'nenhum')
+        evento(
+            logger, 'denuncia.deduplicacao',
+            resultado=resultado, denuncia_id=denuncia.pk, categoria_id=categoria.pk,
+            criterio=criterio, candidatas=candidatas,
+            distancia_m=None if distancia is None else round(distancia, 1),
+            usuario_id=user.pk if user else None, convidado=user is None,
+        )
 
     with transaction.atomic():
-        # Otimização: filtro geográfico aproximado (bounding box)
-        # 100m ≈ 0.001 graus (aproximado)
-        lat_delta = 0.001
-        lon_delta = 0.001
-        
-        denuncias_candidatas = Denuncia.objects.filter(
-            categoria=categoria,
-            status__in=[Denuncia.Status.ABERTA, Denuncia.Status.EM_ANALISE],
-            # Bounding box: reduz drasticamente candidatos antes do haversine
-            latitude__gte=float(new_lat) - lat_delta,
-            latitude__lte=float(new_lat) + lat_delta,
-            longitude__gte=float(new_lon) - lon_delta,
-            longitude__lte=float(new_lon) + lon_delta,
-        ).only('id', 'latitude', 'longitude', 'titulo').order_by('-data_criacao')[:50]  # Limita a 50
-
-        logger.info(f"🔍 Buscando denúncias similares:")
-        logger.info(f"   Raio: {SEARCH_RADIUS_METERS}m")
-        logger.info(f"   Categoria: {categoria.nome}")
-        logger.info(f"   Candidatas encontradas: {denuncias_candidatas.count()}")
-
-        denuncia_proxima = None
-        distancia_encontrada = None
-        
-        for denuncia in denuncias_candidatas:
-            distancia = haversine_distance(
-                new_lat, new_lon,
-                denuncia.latitude, denuncia.longitude
+        # A mesma foto decide primeiro, mesmo com o GPS um pouco deslocado
+        denuncia_proxima, distancia_encontrada = mesma_foto(
+            categoria, new_lat, new_lon, validated_data.get('foto_hash')
+        )
+        criterio = 'foto'
+        total_candidatas = None
+        if not denuncia_proxima:
+            criterio = 'proximidade'
+            candidatas = list(candidatas_proximas(categoria, new_lat, new_lon))
+            total_candidatas = len(candidatas)
+            denuncia_proxima, distancia_encontrada = primeira_no_raio(
+                candidatas, new_lat, new_lon, validated_data.get('foto_hash')
             )
-            logger.debug(f"Denuncia ID {denuncia.id}: distancia = {distancia}m")
-            
-            if distancia <= SEARCH_RADIUS_METERS:
-                denuncia_proxima = denuncia
-                distancia_encontrada = distancia
-                break
 
         if denuncia_proxima:
-            logger.info(f"Denuncia similar encontrada (ID: {denuncia_proxima.id})")
-            logger.info(f"Distancia: {distancia_encontrada:.2f} metros")
-            logger.info(f"Adicionando apoio...")
-
             if user:
                 apoio_existente = ApoioDenuncia.objects.filter(
                     denuncia=denuncia_proxima,
@@ -81,22 +189,17 @@ def criar_ou_apoiar_denuncia(validated_data, user=None, autor_convidado=None):
                 apoio_existente = False
 
             if apoio_existente:
-                logger.info(f"Usuario {user.username} ja apoiou esta denuncia")
+                registrar('ja_apoiada', denuncia_proxima, criterio, total_candidatas, distancia_encontrada)
                 return denuncia_proxima, False, False
 
             ApoioDenuncia.objects.create(
                 denuncia=denuncia_proxima,
                 apoiador=user if user else None
             )
-            
-            logger.info(f"Apoio registrado com sucesso!")
-            logger.info(f"Total de apoios: {denuncia_proxima.apoios.count()}")
-            
+            denuncia_proxima.total_apoios += 1
+            registrar('apoio_adicionado', denuncia_proxima, criterio, total_candidatas, distancia_encontrada)
             return denuncia_proxima, False, True
 
-        logger.info(f"Nenhuma denuncia similar encontrada em {SEARCH_RADIUS_METERS}m")
-        logger.info(f"Criando nova denuncia...")
-        
         # Remover autor_convidado do validated_data para evitar conflito
         denuncia_data = validated_data.copy()
         denuncia_data.pop('autor_convidado', None)
@@ -106,8 +209,231 @@ def criar_ou_apoiar_denuncia(validated_data, user=None, autor_convidado=None):
         denuncia_data['autor_convidado'] = autor_convidado if not user else None
         
         nova_denuncia = Denuncia.objects.create(**denuncia_data)
-        
-        logger.info(f"Nova denuncia criada (ID: {nova_denuncia.id})")
-        logger.info(f"Autor: {nova_denuncia.autor or nova_denuncia.autor_convidado}")
-        
+        if settings.FOTOS_EM_SEGUNDO_PLANO:
+            transaction.on_commit(lambda: agendar_normalizacao(nova_denuncia.pk))
+
+        registrar('criada', nova_denuncia, candidatas=total_candidatas)
         return nova_denuncia, True, False
+
+def criar_ou_apoiar_em_lote(itens, user):
+    """
+    criar_ou_apoiar_denuncia para várias denúncias de um mesmo usuário, como as que
+    um cliente acumulou offline. Cada item (validated_data de DenunciaSerializer) é
+    deduplicado contra o banco e contra os itens anteriores do próprio lote, com o
+    mesmo resultado de enviá-los um a um, mas com uma consulta por etapa (fotos
+    parecidas, vizinhança, apoios existentes) e as gravações em bulk_create numa
+    única transação. As fotos (com o hash já calculado na validação) são gravadas no
+    storage antes dela.
+
+    Retorna [(denuncia_id, resultado)] na ordem de `itens`, com resultado "criada",
+    "apoio_adicionado" ou "ja_apoiada". bulk_create e update() não passam por save()
+    nem pelos signals: célula, faixas do hash, contadores e tabelas agregadas são
+    tratados aqui.
+    """
+    if not itens:
+        return []
+    # Fotos gravadas no storage antes da transação, sem E/S de rede com a escrita
+    # travada; as dos itens que viram apoio são apagadas depois
+    fotos = []
+    for item in itens:
+        provisoria = Denuncia(foto=item['foto'])
+        provisoria.enviar_foto()
+        fotos.append(provisoria.foto)
+    try:
+        destinos, novas, apoiadas, resultados = _gravar_lote(itens, fotos, user)
+    except Exception:
+        for foto in fotos:
+            foto.storage.delete(foto.name)
+        raise
+    usadas = {nova.foto.name for nova in novas}
+    for foto in fotos:
+        if foto.name not in usadas:
+            foto.storage.delete(foto.name)
+
+    for resultado in resultados:
+        metricas.incrementar(metricas.DEDUPLICACAO, resultado=resultado, criterio='lote')
+    evento(
+        logger, 'denuncia.lote', usuario_id=user.pk, itens=len(itens), criadas=len(novas),
+        apoios_adicionados=len(apoiadas), ja_apoiadas=len(destinos) - len(novas) - len(apoiadas),
+    )
+    return [
+        (destino if isinstance(destino, int) else destino.pk, resultado)
+        for (destino, _), resultado in zip(destinos, resultados)
+    ]
+
+def _gravar_lote(itens, fotos, user):
+    """Deduplicação e gravação de criar_ou_apoiar_em_lote, numa transação: (destinos, novas, apoiadas, resultados)."""
+    with transaction.atomic():
+        por_foto = parecidas_em_lote(
+            [item.get('foto_hash') for item in itens], 'latitude', 'longitude', 'categoria', 'status'
+        )
+
+        # Vizinhança de todos os itens numa consulta, separada por (categoria, célula).
+        # As CANDIDATAS_MAXIMAS mais recentes de cada célula bastam: as de um item,
+        # nas células vizinhas dele, estão entre elas
+        celulas = [celulas_vizinhas(item['latitude'], item['longitude'], SEARCH_RADIUS_METERS) for item in itens]
+        vizinhas = defaultdict(list)
+        for linha in _abertas_nas_celulas(
+            {item['categoria'].pk for item in itens}, set().union(*celulas),
+        ).annotate(ordem=Window(
+            RowNumber(), partition_by=[F('categoria_id'), F('celula_geo')], order_by=F('data_criacao').desc(),
+        )).filter(ordem__lte=CANDIDATAS_MAXIMAS).order_by().values_list(
+            'data_criacao', 'id', 'categoria_id', 'celula_geo', 'latitude', 'longitude', 'foto_hash'
+        ):
+            vizinhas[(linha[2], linha[3])].append(linha)
+
+        # Primeira passada: para onde vai cada item (pk já gravado, Denuncia nova do lote ou None)
+        novas = []
+        destinos = []
+        limite_bits = distancia_maxima()
+        for item, celulas_item, foto in zip(itens, celulas, fotos):
+            categoria_id = item['categoria'].pk
+            latitude, longitude = item['latitude'], item['longitude']
+            foto_hash = item.get('foto_hash')
+
+            # A mesma foto decide primeiro, entre as gravadas e as novas do lote
+            encontradas = _parecidas_abertas(por_foto.get(foto_hash, []), categoria_id)
+            if foto_hash is not None:
+                encontradas += [
+                    (hash_foto.distancia(foto_hash, nova.foto_hash), nova, nova.latitude, nova.longitude)
+                    for nova in novas
+                    if nova.categoria_id == categoria_id and nova.status in STATUS_DEDUPLICADOS
+                    and nova.foto_hash is not None and hash_foto.distancia(foto_hash, nova.foto_hash) <= limite_bits
+                ]
+            destino, _ = mais_parecida(encontradas, latitude, longitude)
+
+            if destino is None:
+                # Mais recentes primeiro, como em candidatas_proximas: as novas do lote, depois as gravadas
+                destino = next((
+                    nova for nova in reversed(novas)
+                    if nova.categoria_id == categoria_id and nova.status in STATUS_DEDUPLICADOS
+                    and not hash_foto.outra_foto(foto_hash, nova.foto_hash)
+                    and haversine_distance(latitude, longitude, nova.latitude, nova.longitude) <= SEARCH_RADIUS_METERS
+                ), None)
+            if destino is None:
+                # Mesmo limite de candidatas_proximas
+                candidatas = sorted(
+                    (linha for celula in celulas_item for linha in vizinhas.get((categoria_id, celula), [])),
+                    reverse=True,
+                )[:CANDIDATAS_MAXIMAS]
+                destino = next((
+                    pk for _, pk, _, _, lat, lon, outro_hash in candidatas
+                    if not hash_foto.outra_foto(foto_hash, outro_hash)
+                    and haversine_distance(latitude, longitude, lat, lon) <= SEARCH_RADIUS_METERS
+                ), None)
+
+            if destino is None:
+                dados = item.copy()
+                dados.pop('autor_convidado', None)
+                dados['foto'] = foto.name  # Já gravada no storage
+                destino = Denuncia(autor=user, autor_convidado=None, **dados)
+                # bulk_create não chama Denuncia.save
+                destino.celula_geo = celula_de(destino.latitude, destino.longitude)
+                for campo, valor in zip(CAMPOS_BANDAS, bandas(destino.foto_hash)):
+                    setattr(destino, campo, valor)
+                novas.append(destino)
+                destinos.append((destino, True))
+            else:
+                destinos.append((destino, False))
+
+        # Segunda passada: apoios, na ordem do lote (o segundo apoio ao mesmo destino já foi dado)
+        ja_apoiadas = set(ApoioDenuncia.objects.filter(
+            apoiador=user, denuncia_id__in={destino for destino, _ in destinos if isinstance(destino, int)}
+        ).values_list('denuncia_id', flat=True))
+        apoiadas = []
+        resultados = []
+        for destino, criada in destinos:
+            if criada:
+                resultados.append('criada')
+                continue
+            chave = destino if isinstance(destino, int) else ('nova', id(destino))
+            if chave in ja_apoiadas:
+                resultados.append('ja_apoiada')
+                continue
+            ja_apoiadas.add(chave)
+            apoiadas.append(destino)
+            resultados.append('apoio_adicionado')
+
+        for nova in novas:
+            nova.total_apoios = sum(1 for destino in apoiadas if destino is nova)
+        Denuncia.objects.bulk_create(novas)
+        ApoioDenuncia.objects.bulk_create([
+            ApoioDenuncia(denuncia_id=destino if isinstance(destino, int) else destino.pk, apoiador=user)
+            for destino in apoiadas
+        ])
+
+        apoios_gravadas = defaultdict(int)
+        for destino in apoiadas:
+            if isinstance(destino, int):
+                apoios_gravadas[destino] += 1
+        variacoes = [Variacao(retrato_de(nova), 1, 1 + nova.total_apoios) for nova in novas]
+        if apoios_gravadas:
+            Denuncia.objects.filter(pk__in=apoios_gravadas).update(total_apoios=F('total_apoios') + Case(
+                *[When(pk=pk, then=Value(total)) for pk, total in apoios_gravadas.items()],
+                output_field=IntegerField(),
+            ))
+            variacoes += [
+                Variacao(retrato_de(valores), 0, apoios_gravadas[valores['id']])
+                for valores in Denuncia.objects.filter(pk__in=apoios_gravadas).values('id', *CAMPOS_RETRATO)
+            ]
+        agregacao.notificar(variacoes)
+
+        if settings.FOTOS_EM_SEGUNDO_PLANO:
+            for nova in novas:
+                transaction.on_commit(lambda pk=nova.pk: agendar_normalizacao(pk))
+    return destinos, novas, apoiadas, resultados
+
+def ids_do_lote(valor):
+    """Lista de IDs de uma ação em lote, sem repetições e na ordem recebida. Levanta ValueError."""
+    if not isinstance(valor, list) or not valor:
+        raise ValueError('Informe uma lista não vazia de IDs.')
+    if len(valor) > LOTE_MAXIMO:
+        raise ValueError(f'No máximo {LOTE_MAXIMO} IDs por requisição.')
+    try:
+        return list(dict.fromkeys(int(item) for item in valor))
+    except (TypeError, ValueError):
+        raise ValueError('Os IDs devem ser números inteiros.')
+
+def alterar_status_em_lote(ids, novo_status, pode_alterar):
+    """
+    Altera o status das denúncias `ids` com um único UPDATE. `pode_alterar(valores)`
+    decide, a partir dos campos lidos numa única consulta, se a denúncia está na
+    jurisdição de quem pede. Retorna [{'id', 'resultado'}] na ordem de `ids`, com
+    resultado "alterada", "sem_alteracao", "fora_da_jurisdicao" ou "nao_encontrada".
+    O UPDATE não passa pelos signals, então as tabelas agregadas e a
+    data_atualizacao (usada pelo índice de proximidade) são tratadas aqui.
+    """
+    with transaction.atomic():
+        linhas = {
+            valores['id']: valores for valores in Denuncia.objects.select_for_update().filter(pk__in=ids).values(
+                'id', 'total_apoios', *agregacao.CAMPOS_RETRATO
+            )
+        }
+        resultados = {}
+        alterar = []
+        for denuncia_id in ids:
+            valores = linhas.get(denuncia_id)
+            if valores is None:
+                resultados[denuncia_id] = 'nao_encontrada'
+            elif not pode_alterar(valores):
+                resultados[denuncia_id] = 'fora_da_jurisdicao'
+            elif valores['status'] == novo_status:
+                resultados[denuncia_id] = 'sem_alteracao'
+            else:
+                resultados[denuncia_id] = 'alterada'
+                alterar.append(valores)
+
+        if alterar:
+            Denuncia.objects.filter(pk__in=[valores['id'] for valores in alterar]).update(
+                status=novo_status, data_atualizacao=timezone.now()
+            )
+            variacoes = []
+            for valores in alterar:
+                antigo = retrato_de(valores)
+                peso = 1 + valores['total_apoios']
+                variacoes.append(Variacao(antigo, -1, -peso))
+                variacoes.append(Variacao(antigo._replace(status=novo_status), 1, peso))
+            agregacao.notificar(variacoes)
+
+    return [{'id': denuncia_id, 'resultado': resultados[denuncia_id]} for denuncia_id in ids]
+
@@ -0,0 +1,103 @@
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from . import agregacao
+from .agregacao import CAMPOS_RETRATO, Variacao, retrato_de
+from .imagens import apagar_variantes
+from .indice import indice_proximidade
+from .models import ApoioDenuncia, Comentario, Denuncia
+
+
+@receiver(pre_save, sender=Denuncia)
+def carregar_retrato_salvo(sender, instance, **kwargs):
+    # Instâncias carregadas com only()/defer() ou criadas à mão com pk não têm o
+    # estado anterior; ele é lido do banco antes de ser sobrescrito.
+    if instance._state.adding or hasattr(instance, '_retrato_salvo'):
+        return
+    valores = Denuncia.objects.filter(pk=instance.pk).values(*CAMPOS_RETRATO).first()
+    instance._retrato_salvo = retrato_de(valores) if valores else None
+
+
+@receiver(post_save, sender=Denuncia)
+def denuncia_salva(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    novo = retrato_de(instance)
+    if created:
+        agregacao.notificar([Variacao(novo, 1, 1 + instance.total_apoios)])
+    else:
+        antigo = getattr(instance, '_retrato_salvo', None)
+        if antigo != novo:
+            peso = 1 + _total_apoios_salvo(instance)
+            agregacao.notificar([Variacao(antigo, -1, -peso), Variacao(novo, 1, peso)])
+        if _variantes_carregadas(instance) and instance.foto_variantes.get('origem') != instance.foto.name:
+            # Foto trocada: as variantes da anterior não servem mais
+            _apagar_variantes_no_commit(instance)
+    instance._retrato_salvo = novo
+
+
+@receiver(pre_delete, sender=Denuncia)
+def carregar_apoios_salvos(sender, instance, **kwargs):
+    instance._apoios_removidos = _total_apoios_salvo(instance)
+
+
+@receiver(post_delete, sender=Denuncia)
+def denuncia_removida(sender, instance, **kwargs):
+    antigo = getattr(instance, '_retrato_salvo', None) or retrato_de(instance)
+    apoios = getattr(instance, '_apoios_removidos', instance.total_apoios)
+    agregacao.notificar([Variacao(antigo, -1, -(1 + apoios))])
+    indice_proximidade().remover([instance.pk])
+    if _variantes_carregadas(instance):
+        # A foto original fica: a denúncia promovida na exclusão continua usando
+        _apagar_variantes_no_commit(instance)
+
+
+def _variantes_carregadas(instance):
+    # Instâncias carregadas com only()/defer() sem o campo não trazem o registro
+    return 'foto_variantes' in instance.__dict__ and bool(instance.foto_variantes)
+
+
+def _apagar_variantes_no_commit(instance):
+    denuncia_id, registro, storage = instance.pk, instance.foto_variantes, instance.foto.storage
+    transaction.on_commit(lambda: apagar_variantes(denuncia_id, registro, storage))
+
+
+def _total_apoios_salvo(instance):
+    # O contador em memória pode estar desatualizado: apoios o incrementam só no banco
+    total = Denuncia.objects.filter(pk=instance.pk).values_list('total_apoios', flat=True).first()
+    return instance.total_apoios if total is None else total
+
+
+def _removida_junto(origin):
+    # Apoios e comentários excluídos em cascata pela própria denúncia: o post_delete
+    # dela já desconta os apoios e a linha dos contadores deixa de existir
+    return isinstance(origin, Denuncia) or (isinstance(origin, QuerySet) and origin.model is Denuncia)
+
+
+@receiver(post_save, sender=ApoioDenuncia)
+def apoio_salvo(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Denuncia.objects.filter(pk=instance.denuncia_id).update(total_apoios=F('total_apoios') + 1)
+        agregacao.notificar_apoios(instance.denuncia_id, 1)
+
+
+@receiver(post_delete, sender=ApoioDenuncia)
+def apoio_removido(sender, instance, origin=None, **kwargs):
+    # Também para exclusões em lote e em cascata (ex.: usuário excluído)
+    if not _removida_junto(origin):
+        Denuncia.objects.filter(pk=instance.denuncia_id).update(total_apoios=F('total_apoios') - 1)
+        agregacao.notificar_apoios(instance.denuncia_id, -1)
+
+
+@receiver(post_save, sender=Comentario)
+def comentario_salvo(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Denuncia.objects.filter(pk=instance.denuncia_id).update(total_comentarios=F('total_comentarios') + 1)
+
+
+@receiver(post_delete, sender=Comentario)
+def comentario_removido(sender, instance, origin=None, **kwargs):
+    if not _removida_junto(origin):
+        Denuncia.objects.filter(pk=instance.denuncia_id).update(total_comentarios=F('total_comentarios') - 1)
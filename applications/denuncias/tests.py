@@ -1,11 +1,32 @@
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.conf import settings
+from django.test import override_settings
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from applications.core.models import User
-from .models import Denuncia, Categoria, Comentario
+from .models import Denuncia, Categoria, Comentario, ApoioDenuncia, CelulaMapa
+from .geo import celula_de
+from .indice import indice_proximidade
+from .hash_foto import distancia, hash_da_foto
+from .imagens import gerar_variantes, normalizar_armazenada
+from .mapa import NIVEL_MINIMO
+from .services import CANDIDATAS_MAXIMAS, mesma_foto
+from applications.gestao_publica.agregados import RESOLUCAO_MAXIMA
+from applications.gestao_publica.models import CelulaHeatmap
 from applications.localidades.models import Estado, Cidade
 from django.core.files.uploadedfile import SimpleUploadedFile
-from io import BytesIO
+from io import BytesIO, StringIO
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
 from PIL import Image
 
 def create_dummy_image():
@@ -15,7 +36,23 @@ def create_dummy_image():
     image_file.seek(0)
     return SimpleUploadedFile('test.png', image_file.read(), content_type='image/png')
 
-class DenunciaAPITests(APITestCase):
+class MidiaTemporariaMixin:
+    """MEDIA_ROOT próprio da classe de testes, apagado no fim: nada vai para a mídia real nem sobra entre execuções."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._midia = tempfile.mkdtemp()
+        cls._midia_settings = override_settings(MEDIA_ROOT=cls._midia)
+        cls._midia_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._midia_settings.disable()
+        shutil.rmtree(cls._midia, ignore_errors=True)
+
+class DenunciaAPITests(MidiaTemporariaMixin, APITestCase):
     def setUp(self):
         self.estado = Estado.objects.create(nome='Test Estado', uf='TE')
         self.cidade = Cidade.objects.create(nome='Test Cidade', estado=self.estado)
@@ -67,7 +104,7 @@ class DenunciaAPITests(APITestCase):
         self.assertEqual(denuncia.autor, self.user)
         self.assertIsNone(denuncia.autor_convidado)
 
-class ComentarioAPITests(APITestCase):
+class ComentarioAPITests(MidiaTemporariaMixin, APITestCase):
     def setUp(self):
         self.estado = Estado.objects.create(nome='Test Estado', uf='TE')
         self.cidade = Cidade.objects.create(nome='Test Cidade', estado=self.estado)
@@ -113,4 +150,932 @@ class ComentarioAPITests(APITestCase):
         self.assertEqual(Comentario.objects.count(), 1)
         comentario = Comentario.objects.get()
         self.assertEqual(comentario.autor, self.user)
-        self.assertIsNone(comentario.autor_convidado)
\ No newline at end of file
+        self.assertIsNone(comentario.autor_convidado)
+
+class DeduplicacaoGeograficaTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Test Estado', uf='TE')
+        self.cidade = Cidade.objects.create(nome='Test Cidade', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Test Categoria')
+        self.autor = User.objects.create_user(username='autor', email='autor@example.com', password='password123', first_name='Autor')
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='password123', first_name='Test')
+        # Ponto encostado na borda de uma célula da grade
+        self.denuncia = Denuncia.objects.create(
+            titulo='Buraco', descricao='Buraco na via.', autor=self.autor,
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude='-23.55000010', longitude='-46.63300000',
+            jurisdicao='MUNICIPAL', foto=create_dummy_image()
+        )
+        self.client.login(username='testuser', password='password123')
+
+    def _post(self, latitude, longitude):
+        data = {
+            'titulo': 'Outro buraco', 'descricao': 'Mesmo lugar.',
+            'categoria': self.categoria.id, 'cidade': self.cidade.id, 'estado': self.estado.id,
+            'latitude': latitude, 'longitude': longitude,
+            'jurisdicao': 'MUNICIPAL', 'foto': create_dummy_image(),
+        }
+        return self.client.post(reverse('denuncia-list'), data, format='multipart')
+
+    def test_celula_calculada_ao_salvar(self):
+        self.assertEqual(self.denuncia.celula_geo, celula_de(self.denuncia.latitude, self.denuncia.longitude))
+
+    def test_apoio_em_celula_vizinha_dentro_do_raio(self):
+        # ~78 m ao norte, já na célula seguinte
+        response = self._post('-23.54930000', '-46.63300000')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['apoio_adicionado'])
+        self.assertEqual(Denuncia.objects.count(), 1)
+
+    def test_nova_denuncia_fora_do_raio(self):
+        # ~110 m ao norte
+        response = self._post('-23.54901000', '-46.63300000')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Denuncia.objects.count(), 2)
+
+    def test_um_evento_por_decisao_sem_consultas_para_o_log(self):
+        with self.assertLogs('applications.denuncias.services', 'INFO') as logs, \
+                CaptureQueriesContext(connection) as consultas:
+            self._post('-23.54930000', '-46.63300000')
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].getMessage(), 'denuncia.deduplicacao')
+        campos = logs.records[0].campos
+        self.assertEqual(
+            (campos['resultado'], campos['criterio'], campos['candidatas'], campos['denuncia_id']),
+            ('apoio_adicionado', 'proximidade', 1, self.denuncia.id)
+        )
+        self.assertAlmostEqual(campos['distancia_m'], 78, delta=1)
+        self.assertFalse([q for q in consultas.captured_queries if 'COUNT(' in q['sql']])
+
+    def test_sondagem_so_com_os_campos_da_comparacao_e_limitada(self):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self._post('-23.54930000', '-46.63300000')
+        self.assertEqual(response.data['denuncia']['titulo'], 'Buraco')
+        sondagem = [q['sql'] for q in consultas.captured_queries if '"celula_geo" IN' in q['sql']]
+        self.assertEqual(len(sondagem), 1)
+        self.assertIn(f'LIMIT {CANDIDATAS_MAXIMAS}', sondagem[0])
+        self.assertNotIn('"descricao"', sondagem[0])
+
+
+class DenunciasProximasTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Test Estado', uf='TE')
+        self.cidade = Cidade.objects.create(nome='Test Cidade', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Test Categoria')
+        self.outra_categoria = Categoria.objects.create(nome='Outra Categoria')
+        self.pontos = {}
+        for nome, lat, categoria, status_denuncia in [
+            ('perto', '-23.55100000', self.categoria, 'ABERTA'),
+            ('medio', '-23.55500000', self.categoria, 'EM_ANALISE'),
+            ('longe', '-23.58000000', self.categoria, 'ABERTA'),
+            ('resolvida', '-23.55050000', self.categoria, 'RESOLVIDA'),
+            ('outra', '-23.55060000', self.outra_categoria, 'ABERTA'),
+        ]:
+            self.pontos[nome] = Denuncia.objects.create(
+                titulo=nome, descricao=nome, autor_convidado='Convidado',
+                categoria=categoria, cidade=self.cidade, estado=self.estado,
+                latitude=lat, longitude='-46.63300000', status=status_denuncia,
+                jurisdicao='MUNICIPAL', foto=create_dummy_image()
+            )
+        indice_proximidade().invalidar()
+
+    def test_ordenadas_por_distancia_dentro_do_raio(self):
+        url = reverse('denuncia-proximas')
+        response = self.client.get(url, {'lat': '-23.5500', 'lon': '-46.6330', 'raio': 1000, 'categoria': self.categoria.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['titulo'] for item in response.data], ['perto', 'medio'])
+        self.assertLess(response.data[0]['distancia'], response.data[1]['distancia'])
+
+    def test_k_limita_resultados(self):
+        url = reverse('denuncia-proximas')
+        response = self.client.get(url, {'lat': '-23.5500', 'lon': '-46.6330', 'k': 1})
+        self.assertEqual([item['titulo'] for item in response.data], ['outra'])
+
+    def test_excluida_sai_do_indice(self):
+        indice = indice_proximidade()
+        indice.sincronizar()
+        total = len(indice)
+        self.pontos['perto'].delete()
+        self.assertEqual(len(indice), total - 1)
+
+    def test_excluida_em_outro_worker_nao_ocupa_vaga(self):
+        url = reverse('denuncia-proximas')
+        parametros = {'lat': '-23.5500', 'lon': '-46.6330', 'raio': 5000, 'k': 2, 'categoria': self.categoria.id}
+        self.client.get(url, parametros)  # Constrói o índice
+        # Sem signals, como uma exclusão feita por outro processo
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM denuncias_denuncia WHERE id = %s', [self.pontos['perto'].id])
+        response = self.client.get(url, parametros)
+        self.assertEqual([item['titulo'] for item in response.data], ['medio', 'longe'])
+
+    def test_parametros_obrigatorios(self):
+        response = self.client.get(reverse('denuncia-proximas'), {'lat': '-23.55'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_valores_nao_finitos(self):
+        url = reverse('denuncia-proximas')
+        self.client.get(url, {'lat': '-23.5500', 'lon': '-46.6330'})  # Índice com linhas
+        for parametros in ({'raio': 'nan'}, {'raio': 'inf'}, {'lat': 'nan'}, {'lon': '-inf'}):
+            response = self.client.get(url, {'lat': '-23.5500', 'lon': '-46.6330', **parametros})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, parametros)
+
+
+class DeletarDenunciaComApoiosTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Test Estado', uf='TE')
+        self.cidade = Cidade.objects.create(nome='Test Cidade', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Test Categoria')
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='password123', first_name='Test')
+        self.client.login(username='testuser', password='password123')
+
+    def _denuncia(self, autor, latitude):
+        return Denuncia.objects.create(
+            titulo='Buraco', descricao='Buraco na via.', autor=autor,
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude=latitude, longitude='-46.63300000',
+            jurisdicao='MUNICIPAL', foto=create_dummy_image()
+        )
+
+    def _apoiadores(self, quantidade, prefixo):
+        return [
+            User.objects.create_user(username=f'{prefixo}{i}', email=f'{prefixo}{i}@example.com', first_name='Apoiador')
+            for i in range(quantidade)
+        ]
+
+    def _deletar(self, quantidade_apoios, prefixo, conflitos=1):
+        origem = self._denuncia(self.user, '-23.55000000')
+        destino = self._denuncia(None, '-23.55050000')
+        apoiadores = self._apoiadores(quantidade_apoios, prefixo)
+        for apoiador in apoiadores:
+            ApoioDenuncia.objects.create(denuncia=origem, apoiador=apoiador)
+        # Os primeiros apoiadores já apoiam o destino: seus apoios são descartados
+        for apoiador in apoiadores[:conflitos]:
+            ApoioDenuncia.objects.create(denuncia=destino, apoiador=apoiador)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(reverse('denuncia-detail', args=[origem.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['denuncia_destino_id'], destino.id)
+        self.assertEqual(response.data['apoios_transferidos'], quantidade_apoios - conflitos)
+        self.assertEqual(destino.apoios.count(), quantidade_apoios)
+        self.assertFalse(Denuncia.objects.filter(id=origem.id).exists())
+
+        destino.refresh_from_db()
+        self.assertEqual(destino.total_apoios, quantidade_apoios)
+        peso = CelulaHeatmap.objects.filter(resolucao=RESOLUCAO_MAXIMA).aggregate(peso=Sum('peso'))['peso']
+        self.assertEqual(peso, 1 + quantidade_apoios)
+        return len(queries)
+
+    def test_transferencia_com_numero_constante_de_queries(self):
+        consultas = []
+        for quantidade, conflitos in [(2, 1), (6, 1), (6, 5)]:
+            with self.subTest(apoios=quantidade, conflitos=conflitos):
+                consultas.append(self._deletar(quantidade, f'a{len(consultas)}_', conflitos))
+            Denuncia.objects.all().delete()
+        self.assertEqual(len(set(consultas)), 1, consultas)
+
+    def test_promove_apoio_mais_antigo_sem_denuncia_proxima(self):
+        origem = self._denuncia(self.user, '-23.55000000')
+        origem.foto_hash = hash_da_foto(create_textured_image(1))
+        origem.save(update_fields=['foto_hash'])
+        apoiadores = self._apoiadores(3, 'c')
+        for apoiador in apoiadores:
+            ApoioDenuncia.objects.create(denuncia=origem, apoiador=apoiador)
+
+        response = self.client.delete(reverse('denuncia-detail', args=[origem.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['apoios_preservados'], 2)
+        nova = Denuncia.objects.get(id=response.data['nova_denuncia_id'])
+        self.assertEqual(nova.autor, apoiadores[0])
+        self.assertEqual(
+            set(nova.apoios.values_list('apoiador_id', flat=True)),
+            {apoiadores[1].id, apoiadores[2].id}
+        )
+        # A promovida herda o hash: a mesma foto reenviada de longe ainda a encontra
+        self.assertEqual(nova.foto_hash, origem.foto_hash)
+        encontrada, _ = mesma_foto(self.categoria, -23.551, -46.633, origem.foto_hash)
+        self.assertEqual(encontrada, nova)
+
+
+class ContadoresEngajamentoTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Test Estado', uf='TE')
+        self.cidade = Cidade.objects.create(nome='Test Cidade', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Test Categoria')
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='password123', first_name='Test')
+        self.denuncia = Denuncia.objects.create(
+            titulo='Buraco', descricao='Buraco na via.', autor_convidado='Convidado',
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude='-23.55000000', longitude='-46.63300000',
+            jurisdicao='MUNICIPAL', foto=create_dummy_image()
+        )
+        self.client.login(username='testuser', password='password123')
+
+    def test_contadores_acompanham_criacao_e_remocao(self):
+        apoio = ApoioDenuncia.objects.create(denuncia=self.denuncia, apoiador=self.user)
+        self.client.post(reverse('comentario-list'), {'denuncia': self.denuncia.id, 'texto': 'Oi'}, format='json')
+        self.denuncia.refresh_from_db()
+        self.assertEqual((self.denuncia.total_apoios, self.denuncia.total_comentarios), (1, 1))
+
+        apoio.delete()
+        Comentario.objects.get().delete()
+        self.denuncia.refresh_from_db()
+        self.assertEqual((self.denuncia.total_apoios, self.denuncia.total_comentarios), (0, 0))
+
+    def test_exclusao_em_cascata_e_em_lote_ajusta_contadores_e_peso(self):
+        outro = User.objects.create_user(username='outro', email='outro@example.com', password='password123', first_name='Outro')
+        ApoioDenuncia.objects.create(denuncia=self.denuncia, apoiador=self.user)
+        ApoioDenuncia.objects.create(denuncia=self.denuncia, apoiador=outro)
+        Comentario.objects.create(denuncia=self.denuncia, autor=outro, texto='Oi')
+        self.assertEqual(self._peso_no_heatmap(), 3)
+
+        self.user.delete()
+        self.denuncia.refresh_from_db()
+        self.assertEqual(self.denuncia.total_apoios, 1)
+        self.assertEqual(self._peso_no_heatmap(), 2)
+
+        ApoioDenuncia.objects.all().delete()
+        Comentario.objects.all().delete()
+        self.denuncia.refresh_from_db()
+        self.assertEqual((self.denuncia.total_apoios, self.denuncia.total_comentarios), (0, 0))
+        self.assertEqual(self._peso_no_heatmap(), 1)
+
+        # A própria denúncia excluída: os apoios em cascata não são descontados duas vezes
+        ApoioDenuncia.objects.create(denuncia=self.denuncia, apoiador=outro)
+        Denuncia.objects.all().delete()
+        self.assertEqual(self._peso_no_heatmap(), 0)
+
+    def _peso_no_heatmap(self):
+        # Uma linha por resolução; todas têm o mesmo peso
+        return CelulaHeatmap.objects.filter(resolucao=RESOLUCAO_MAXIMA).aggregate(peso=Sum('peso'))['peso'] or 0
+
+    def test_save_nao_sobrescreve_contadores(self):
+        desatualizada = Denuncia.objects.get(pk=self.denuncia.pk)
+        ApoioDenuncia.objects.create(denuncia=self.denuncia, apoiador=self.user)
+        desatualizada.status = Denuncia.Status.EM_ANALISE
+        desatualizada.save()
+        self.denuncia.refresh_from_db()
+        self.assertEqual(self.denuncia.total_apoios, 1)
+
+    def test_recount_corrige_divergencias(self):
+        ApoioDenuncia.objects.create(denuncia=self.denuncia, apoiador=self.user)
+        Denuncia.objects.update(total_apoios=7, total_comentarios=3)
+        call_command('recount', stdout=StringIO())
+        self.denuncia.refresh_from_db()
+        self.assertEqual((self.denuncia.total_apoios, self.denuncia.total_comentarios), (1, 0))
+        self.assertEqual(self._peso_no_heatmap(), 2)
+
+    def test_recount_refaz_peso_de_apoios_perdidos(self):
+        # Apoio gravado sem signals: contador e peso ficam para trás juntos
+        ApoioDenuncia.objects.bulk_create([ApoioDenuncia(denuncia=self.denuncia, apoiador=self.user)])
+        self.assertEqual(self._peso_no_heatmap(), 1)
+        call_command('recount', stdout=StringIO())
+        self.assertEqual(self._peso_no_heatmap(), 2)
+
+    def test_listagem_expoe_contadores_sem_group_by(self):
+        ApoioDenuncia.objects.create(denuncia=self.denuncia, apoiador=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('denuncia-list'), {'ordering': '-total_apoios'})
+        self.assertEqual(response.data['results'][0]['total_apoios'], 1)
+        self.assertEqual(response.data['results'][0]['total_comentarios'], 0)
+        self.assertFalse(any('GROUP BY' in query['sql'] for query in queries.captured_queries))
+
+
+class PaginacaoCursorTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Test Estado', uf='TE')
+        self.cidade = Cidade.objects.create(nome='Test Cidade', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Test Categoria')
+        for i in range(25):
+            self._criar(i)
+
+    def _criar(self, i):
+        return Denuncia.objects.create(
+            titulo=f'Denúncia {i}', descricao='Descrição.', autor_convidado='Convidado',
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude='-23.55000000', longitude=f'-46.{63300000 + i * 10000}',
+            jurisdicao='MUNICIPAL', foto=create_dummy_image()
+        )
+
+    def test_cursor_estavel_com_insercoes(self):
+        url = reverse('denuncia-list')
+        primeira = self.client.get(url, {'cursor': ''})
+        self.assertEqual(primeira.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', primeira.data)
+        self.assertEqual(len(primeira.data['results']), 20)
+
+        self._criar(99)  # Nova denúncia no topo do feed durante a rolagem
+
+        segunda = self.client.get(primeira.data['next'])
+        ids = [item['id'] for item in primeira.data['results'] + segunda.data['results']]
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+        self.assertIsNone(segunda.data['next'])
+
+    def test_paginacao_por_numero_continua_padrao(self):
+        response = self.client.get(reverse('denuncia-list'), {'page': 2})
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 5)
+
+
+class MapaAgrupamentoTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Test Estado', uf='TE')
+        self.cidade = Cidade.objects.create(nome='Test Cidade', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Test Categoria')
+        self.url = reverse('denuncia-mapa')
+        # Dois aglomerados distantes (São Paulo e Rio de Janeiro)
+        self.denuncias = [
+            self._criar(lat, lon)
+            for lat, lon in [
+                ('-23.55000000', '-46.63300000'),
+                ('-23.55100000', '-46.63400000'),
+                ('-23.55200000', '-46.63500000'),
+                ('-22.90600000', '-43.17200000'),
+            ]
+        ]
+
+    def _criar(self, latitude, longitude):
+        return Denuncia.objects.create(
+            titulo='Denúncia', descricao='Descrição.', autor_convidado='Convidado',
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude=latitude, longitude=longitude,
+            jurisdicao='MUNICIPAL', foto=create_dummy_image()
+        )
+
+    def _totais(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, sorted(feature.get('total', 1) for feature in response.data['features'])
+
+    def test_clusters_em_zoom_baixo(self):
+        data, totais = self._totais({'bbox': '-74,-34,-34,6', 'zoom': 4})
+        self.assertEqual(data['tipo'], 'clusters')
+        self.assertEqual(totais, [1, 3])
+
+    def test_status_e_remocao_atualizam_a_grade(self):
+        denuncia = self.denuncias[0]
+        denuncia.status = Denuncia.Status.RESOLVIDA
+        denuncia.save()
+        _, totais = self._totais({'bbox': '-74,-34,-34,6', 'zoom': 4, 'status': 'ABERTA'})
+        self.assertEqual(totais, [1, 2])
+
+        Denuncia.objects.filter(pk=self.denuncias[3].pk).delete()
+        _, totais = self._totais({'bbox': '-74,-34,-34,6', 'zoom': 4})
+        self.assertEqual(totais, [3])
+
+    def test_pontos_em_zoom_alto(self):
+        data, _ = self._totais({'bbox': '-46.64,-23.56,-46.63,-23.54', 'zoom': 17})
+        self.assertEqual(data['tipo'], 'pontos')
+        self.assertEqual(len(data['features']), 3)
+
+    def test_reconstrucao_reproduz_incremental(self):
+        antes = set(CelulaMapa.objects.filter(total__gt=0).values_list('nivel', 'x', 'y', 'status', 'total'))
+        call_command('reconstruir_agregados', stdout=StringIO())
+        depois = set(CelulaMapa.objects.values_list('nivel', 'x', 'y', 'status', 'total'))
+        self.assertEqual(antes, depois)
+
+    def test_bbox_invalido(self):
+        response = self.client.get(self.url, {'bbox': '1,2,3', 'zoom': 4})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+def create_camera_image(largura=1200, altura=800, orientacao=6):
+    """JPEG 'de câmera': grande, com orientação e GPS no EXIF."""
+    image_file = BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = orientacao
+    exif[0x8825] = {1: 'S', 2: (23.0, 33.0, 1.0)}
+    Image.new('RGB', (largura, altura), 'red').save(image_file, 'jpeg', exif=exif, quality=95)
+    image_file.seek(0)
+    return SimpleUploadedFile('camera.JPG', image_file.read(), content_type='image/jpeg')
+
+@override_settings(FOTO_DIMENSAO_MAXIMA=400)
+class NormalizacaoFotoTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Estado Foto', uf='FT')
+        self.cidade = Cidade.objects.create(nome='Cidade Foto', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Categoria Foto')
+
+    def _abrir(self, denuncia):
+        denuncia.foto.open('rb')
+        try:
+            imagem = Image.open(BytesIO(denuncia.foto.read()))
+            imagem.load()
+        finally:
+            denuncia.foto.close()
+        return imagem
+
+    def test_upload_e_reduzido_rotacionado_e_sem_exif(self):
+        data = {
+            'titulo': 'Foto grande', 'descricao': 'Descrição', 'autor_convidado': 'Convidado',
+            'categoria': self.categoria.id, 'cidade': self.cidade.id, 'estado': self.estado.id,
+            'latitude': -23.55, 'longitude': -46.63, 'jurisdicao': 'MUNICIPAL',
+            'foto': create_camera_image(),
+        }
+        with self.assertLogs('applications.denuncias.imagens', 'INFO') as logs:
+            response = self.client.post(reverse('denuncia-list'), data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        campos = logs.records[0].campos
+        self.assertLess(campos['bytes_finais'], campos['bytes_originais'])
+
+        imagem = self._abrir(Denuncia.objects.get())
+        self.assertEqual(imagem.format, 'JPEG')
+        self.assertEqual(imagem.size, (267, 400))  # Orientação 6: retrato
+        self.assertEqual(len(imagem.getexif()), 0)
+
+    def test_arquivo_invalido_e_recusado(self):
+        data = {
+            'titulo': 'Foto quebrada', 'descricao': 'Descrição', 'autor_convidado': 'Convidado',
+            'categoria': self.categoria.id, 'cidade': self.cidade.id, 'estado': self.estado.id,
+            'latitude': -23.55, 'longitude': -46.63, 'jurisdicao': 'MUNICIPAL',
+            'foto': SimpleUploadedFile('foto.jpg', b'\xff\xd8nao e jpeg', content_type='image/jpeg'),
+        }
+        response = self.client.post(reverse('denuncia-list'), data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('foto', response.data)
+
+    @override_settings(FOTO_MAX_PIXELS=10_000)
+    def test_formato_sem_decodificacao_reduzida_limitado_em_pixels(self):
+        grande = BytesIO()
+        Image.new('RGB', (200, 200), 'red').save(grande, 'png')
+        data = {
+            'titulo': 'PNG grande', 'descricao': 'Descrição', 'autor_convidado': 'Convidado',
+            'categoria': self.categoria.id, 'cidade': self.cidade.id, 'estado': self.estado.id,
+            'latitude': -23.55, 'longitude': -46.63, 'jurisdicao': 'MUNICIPAL',
+        }
+        for segundo_plano in (False, True):
+            with self.settings(FOTOS_EM_SEGUNDO_PLANO=segundo_plano):
+                arquivo = SimpleUploadedFile('grande.png', grande.getvalue(), content_type='image/png')
+                response = self.client.post(reverse('denuncia-list'), {**data, 'foto': arquivo}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('grande demais', str(response.data['foto']))
+        self.assertIsNone(hash_da_foto(BytesIO(grande.getvalue())))
+
+        # JPEG bem acima do limite passa: é decodificado em escala reduzida
+        response = self.client.post(reverse('denuncia-list'), {**data, 'foto': create_camera_image()}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_normalizacao_em_segundo_plano_troca_o_arquivo(self):
+        denuncia = Denuncia.objects.create(
+            titulo='Original', descricao='Descrição', autor_convidado='Convidado',
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude=-23.55, longitude=-46.63, jurisdicao='MUNICIPAL', foto=create_camera_image(),
+        )
+        original = denuncia.foto.name
+        normalizar_armazenada(denuncia.pk)
+
+        denuncia.refresh_from_db()
+        self.assertNotEqual(denuncia.foto.name, original)
+        self.assertFalse(denuncia.foto.storage.exists(original))
+        self.assertEqual(self._abrir(denuncia).size, (267, 400))
+
+    def test_variantes_seguem_o_accept(self):
+        denuncia = Denuncia.objects.create(
+            titulo='Variantes', descricao='Descrição', autor_convidado='Convidado',
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude=-23.55, longitude=-46.63, jurisdicao='MUNICIPAL', foto=create_camera_image(),
+        )
+        url = reverse('denuncia-list')
+        # O primeiro acesso só agenda a geração e recebe a original
+        with self.captureOnCommitCallbacks() as agendadas:
+            response = self.client.get(url, HTTP_ACCEPT='application/json, image/webp')
+        self.assertIn('Accept', response['Vary'])
+        self.assertTrue(response.data['results'][0]['foto_thumb'].endswith(denuncia.foto.url))
+        self.assertEqual(len(agendadas), 2)  # thumb e card; a geração roda uma vez por denúncia
+
+        gerar_variantes(denuncia)
+        with self.captureOnCommitCallbacks() as agendadas:
+            item = self.client.get(url, HTTP_ACCEPT='application/json, image/webp').data['results'][0]
+        self.assertEqual(agendadas, [])
+        self.assertTrue(item['foto_thumb'].endswith('.thumb.webp'))
+        self.assertTrue(item['foto_card'].endswith('.card.webp'))
+
+        denuncia.refresh_from_db()
+        self.assertEqual(denuncia.foto_variantes['origem'], denuncia.foto.name)
+        self.assertIn('jpeg', denuncia.foto_variantes['thumb'])
+        with denuncia.foto.storage.open(denuncia.foto_variantes['thumb']['webp']) as arquivo:
+            self.assertEqual(max(Image.open(arquivo).size), 160)
+
+        item = self.client.get(url, HTTP_ACCEPT='application/json').data['results'][0]
+        self.assertTrue(item['foto_thumb'].endswith('.thumb.jpg'))
+
+    def test_variantes_refeitas_quando_a_foto_muda(self):
+        denuncia = Denuncia.objects.create(
+            titulo='Troca', descricao='Descrição', autor_convidado='Convidado',
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude=-23.55, longitude=-46.63, jurisdicao='MUNICIPAL', foto=create_camera_image(),
+        )
+        antigas = gerar_variantes(denuncia)
+        # Foto trocada por outra de outro nome base
+        denuncia.foto = SimpleUploadedFile('outra.png', create_dummy_image().read(), content_type='image/png')
+        denuncia.save(update_fields=['foto'])
+        novas = gerar_variantes(denuncia)
+
+        self.assertEqual(novas['origem'], denuncia.foto.name)
+        self.assertTrue(novas['card']['jpeg'].endswith('outra.card.jpg'))
+        self.assertFalse(denuncia.foto.storage.exists(antigas['card']['jpeg']))
+
+        # Regerar com o mesmo nome base não sobrescreve arquivos: grava novos e apaga os registrados
+        refeitas = gerar_variantes(denuncia)
+        self.assertNotEqual(refeitas['card']['jpeg'], novas['card']['jpeg'])
+        self.assertFalse(denuncia.foto.storage.exists(novas['card']['jpeg']))
+        self.assertTrue(denuncia.foto.storage.exists(refeitas['card']['jpeg']))
+
+    def test_fotos_com_o_mesmo_nome_base_nao_compartilham_variantes(self):
+        denuncias = []
+        for extensao, formato, cor in [('png', 'png', (255, 0, 0)), ('jpg', 'jpeg', (0, 0, 255))]:
+            arquivo = BytesIO()
+            Image.new('RGB', (300, 200), cor).save(arquivo, formato)
+            denuncias.append(Denuncia.objects.create(
+                titulo=extensao, descricao='Descrição', autor_convidado='Convidado',
+                categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+                latitude=-23.55, longitude=-46.63, jurisdicao='MUNICIPAL',
+                foto=SimpleUploadedFile(f'x.{extensao}', arquivo.getvalue(), content_type=f'image/{formato}'),
+            ))
+        primeira, segunda = [gerar_variantes(denuncia) for denuncia in denuncias]
+        self.assertNotEqual(primeira['thumb']['jpeg'], segunda['thumb']['jpeg'])
+
+        storage = denuncias[0].foto.storage
+        with storage.open(primeira['thumb']['jpeg']) as arquivo:
+            vermelho, _, azul = Image.open(arquivo).convert('RGB').getpixel((0, 0))
+        self.assertGreater(vermelho, 200)
+        self.assertLess(azul, 50)
+
+    def test_falha_nao_e_reagendada_para_a_mesma_foto(self):
+        self.addCleanup(cache.clear)
+        Denuncia.objects.create(
+            titulo='Quebrada', descricao='Descrição', autor_convidado='Convidado',
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude=-23.55, longitude=-46.63, jurisdicao='MUNICIPAL',
+            foto=SimpleUploadedFile('quebrada.jpg', b'\xff\xd8nao e jpeg', content_type='image/jpeg'),
+        )
+        # Pool síncrono; close_old_connections fecharia a conexão da transação do teste
+        pool = mock.Mock()
+        pool.submit.side_effect = lambda funcao, *args: funcao(*args)
+        with mock.patch('applications.denuncias.imagens._pool', return_value=pool), \
+                mock.patch('applications.denuncias.imagens.close_old_connections'):
+            with self.assertLogs('applications.denuncias.imagens', 'ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.get(reverse('denuncia-list'))
+            self.assertEqual(pool.submit.call_count, 1)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(reverse('denuncia-list'))
+        self.assertEqual(pool.submit.call_count, 1)
+        self.assertTrue(response.data['results'][0]['foto_thumb'].endswith('quebrada.jpg'))
+
+    def test_variantes_apagadas_com_a_denuncia_e_com_a_foto(self):
+        denuncia = Denuncia.objects.create(
+            titulo='Apagar', descricao='Descrição', autor_convidado='Convidado',
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude=-23.55, longitude=-46.63, jurisdicao='MUNICIPAL', foto=create_camera_image(),
+        )
+        storage = denuncia.foto.storage
+        antigas = gerar_variantes(denuncia)
+        denuncia.foto = SimpleUploadedFile('nova.png', create_dummy_image().read(), content_type='image/png')
+        with self.captureOnCommitCallbacks(execute=True):
+            denuncia.save()
+        self.assertFalse(storage.exists(antigas['thumb']['jpeg']))
+
+        novas = gerar_variantes(denuncia)
+        with self.captureOnCommitCallbacks(execute=True):
+            Denuncia.objects.get(pk=denuncia.pk).delete()
+        self.assertFalse(storage.exists(novas['thumb']['jpeg']))
+        self.assertFalse(storage.exists(novas['card']['webp']))
+        self.assertTrue(storage.exists(denuncia.foto.name))  # A original pode seguir em uso
+
+def create_textured_image(seed, tamanho=(900, 600), formato='jpeg', corte=0.0):
+    """Foto com detalhe suficiente para gerar um dHash informativo; `corte` enquadra a mesma cena mais de perto."""
+    pixels = np.random.default_rng(seed).integers(0, 256, (8, 12), dtype=np.uint8)
+    image_file = BytesIO()
+    imagem = Image.fromarray(pixels, 'L').resize(tamanho, Image.Resampling.BICUBIC).convert('RGB')
+    if corte:
+        largura, altura = tamanho
+        imagem = imagem.crop((
+            int(largura * corte), int(altura * corte), largura - int(largura * corte), altura - int(altura * corte)
+        ))
+    imagem.save(image_file, formato)
+    image_file.seek(0)
+    return SimpleUploadedFile(f'foto.{formato}', image_file.read(), content_type=f'image/{formato}')
+
+class DeduplicacaoPorFotoTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Estado Hash', uf='HS')
+        self.cidade = Cidade.objects.create(nome='Cidade Hash', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Categoria Hash')
+        self.user = User.objects.create_user(username='hash', email='hash@example.com', password='password123', first_name='Hash')
+        self.client.login(username='hash', password='password123')
+
+    def _post(self, foto, latitude):
+        data = {
+            'titulo': 'Poste apagado', 'descricao': 'Descrição',
+            'categoria': self.categoria.id, 'cidade': self.cidade.id, 'estado': self.estado.id,
+            'latitude': latitude, 'longitude': '-46.63300000', 'jurisdicao': 'MUNICIPAL', 'foto': foto,
+        }
+        return self.client.post(reverse('denuncia-list'), data, format='multipart')
+
+    def test_hash_resiste_a_recompressao_e_ignora_fotos_lisas(self):
+        original = hash_da_foto(create_textured_image(1))
+        reenviada = hash_da_foto(create_textured_image(1, tamanho=(450, 300), formato='png'))
+        self.assertIsNotNone(original)
+        self.assertLessEqual(distancia(original, reenviada), 3)
+        self.assertGreater(distancia(original, hash_da_foto(create_textured_image(2))), 3)
+        self.assertIsNone(hash_da_foto(create_dummy_image()))
+
+    def test_mesma_foto_com_gps_deslocado_vira_apoio(self):
+        self.assertEqual(self._post(create_textured_image(1), '-23.55000000').status_code, status.HTTP_201_CREATED)
+        self.client.logout()
+        User.objects.create_user(username='outro', email='outro@example.com', password='password123', first_name='Outro')
+        self.client.login(username='outro', password='password123')
+
+        # ~500 m ao norte: fora do raio de proximidade, mas é a mesma foto
+        response = self._post(create_textured_image(1, tamanho=(800, 533)), '-23.54550000')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['apoio_adicionado'])
+
+        # Outra foto no mesmo ponto distante é outra denúncia
+        response = self._post(create_textured_image(2), '-23.54550000')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Denuncia.objects.count(), 2)
+
+    def test_fotos_diferentes_no_mesmo_ponto_nao_se_juntam(self):
+        self.assertEqual(self._post(create_textured_image(1), '-23.55000000').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self._post(create_textured_image(2), '-23.55000000').status_code, status.HTTP_201_CREATED)
+        # Sem hash (foto lisa) a proximidade continua decidindo
+        response = self._post(create_dummy_image(), '-23.55000000')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Denuncia.objects.count(), 2)
+
+    def test_outra_foto_da_mesma_cena_no_raio_vira_apoio(self):
+        original = hash_da_foto(create_textured_image(1))
+        for corte in (0.05, 0.1):
+            # Longe demais para ser "a mesma foto", perto demais para ser outra coisa
+            self.assertGreater(distancia(original, hash_da_foto(create_textured_image(1, corte=corte))), 3)
+
+        self.assertEqual(self._post(create_textured_image(1), '-23.55000000').status_code, status.HTTP_201_CREATED)
+        for corte, latitude in ((0.05, '-23.55020000'), (0.1, '-23.55040000')):
+            response = self._post(create_textured_image(1, corte=corte), latitude)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, corte)
+        self.assertEqual(Denuncia.objects.count(), 1)
+
+    def test_relatorio_lista_pares_com_a_mesma_foto(self):
+        dados = dict(
+            titulo='Foto', descricao='Descrição', autor_convidado='Convidado',
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            longitude=-46.633, jurisdicao='MUNICIPAL', foto=create_dummy_image(),
+        )
+        a = Denuncia.objects.create(latitude=-23.55, foto_hash=hash_da_foto(create_textured_image(1)), **dados)
+        b = Denuncia.objects.create(latitude=-23.50, foto_hash=hash_da_foto(create_textured_image(1, formato='png')), **dados)
+        Denuncia.objects.create(latitude=-23.55, foto_hash=hash_da_foto(create_textured_image(2)), **dados)
+        Denuncia.objects.create(latitude=-23.55, **dados)
+
+        saida = StringIO()
+        call_command('relatorio_fotos_duplicadas', stdout=saida)
+        self.assertIn(f'#{a.pk} x #{b.pk}', saida.getvalue())
+        self.assertIn('1 par(es)', saida.getvalue())
+
+        saida = StringIO()
+        call_command('relatorio_fotos_duplicadas', raio=1000, stdout=saida)
+        self.assertIn('0 par(es)', saida.getvalue())
+
+class BuscaTextualTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Estado Busca', uf='BU')
+        self.cidade = Cidade.objects.create(nome='Cidade Busca', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Categoria Busca')
+        self.url = reverse('denuncia-list')
+
+    def _criar(self, titulo, descricao, endereco=None):
+        return Denuncia.objects.create(
+            titulo=titulo, descricao=descricao, endereco=endereco, autor_convidado='Convidado',
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude=-23.55, longitude=-46.63, jurisdicao='MUNICIPAL', foto=create_dummy_image(),
+        )
+
+    def _ids(self, q):
+        return [item['id'] for item in self.client.get(self.url, {'q': q}).data['results']]
+
+    def test_busca_ordena_por_relevancia_e_ignora_acentos(self):
+        na_descricao = self._criar('Calçada quebrada', 'Tem um buraco perto da calçada.')
+        no_titulo = self._criar('Buraco enorme', 'Na frente da escola.', 'Rua das Flôres, 10')
+        self._criar('Poste apagado', 'Sem luz há dias.')
+
+        self.assertEqual(self._ids('buraco'), [no_titulo.id, na_descricao.id])
+        self.assertEqual(self._ids('flores'), [no_titulo.id])
+        self.assertEqual(self._ids('calcad'), [na_descricao.id])  # Prefixo
+        self.assertEqual(self._ids('"*)('), [])
+
+    def test_indice_acompanha_alteracoes(self):
+        denuncia = self._criar('Lixo acumulado', 'Esquina da praça.')
+        denuncia.titulo = 'Entulho na calçada'
+        denuncia.save()
+        self.assertEqual(self._ids('lixo'), [])
+        self.assertEqual(self._ids('entulho'), [denuncia.id])
+
+        Denuncia.objects.filter(pk=denuncia.pk).update(descricao='Perto do mercado.')
+        self.assertEqual(self._ids('mercado'), [denuncia.id])
+
+        denuncia.delete()
+        self.assertEqual(self._ids('entulho'), [])
+
+    def test_busca_do_admin_usa_o_indice(self):
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password123')
+        self.client.force_login(admin)
+        denuncia = self._criar('Semáforo quebrado', 'Cruzamento perigoso.')
+        self._criar('Poste apagado', 'Sem luz há dias.')
+
+        response = self.client.get(reverse('admin:denuncias_denuncia_changelist'), {'q': 'semaforo'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list), [denuncia])
+
+class ConversaComentariosTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Estado Conversa', uf='CV')
+        self.cidade = Cidade.objects.create(nome='Cidade Conversa', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Categoria Conversa')
+        self.user = User.objects.create_user(username='falante', email='falante@example.com', password='password123', first_name='Ana', last_name='Lima')
+        self.denuncia = Denuncia.objects.create(
+            titulo='Conversa', descricao='Descrição', autor=self.user,
+            categoria=self.categoria, cidade=self.cidade, estado=self.estado,
+            latitude=-23.55, longitude=-46.63, jurisdicao='MUNICIPAL', foto=create_dummy_image(),
+        )
+        for numero in range(25):
+            Comentario.objects.create(
+                denuncia=self.denuncia, texto=f'Comentário {numero}',
+                autor=self.user if numero % 2 else None, autor_convidado=None if numero % 2 else 'Visitante',
+            )
+        self.url = reverse('denuncia-comentarios', args=[self.denuncia.id])
+
+    def test_paginas_por_cursor_sem_count_e_com_autor_resumido(self):
+        with self.assertNumQueries(2):  # Existência da denúncia + página
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        primeira = response.data['results']
+        self.assertEqual(len(primeira), 20)
+        self.assertEqual(primeira[0]['texto'], 'Comentário 0')
+        self.assertEqual(primeira[1]['autor'], {'id': self.user.id, 'nome': 'Ana Lima'})
+
+        segunda = self.client.get(response.data['next']).data
+        self.assertEqual([item['texto'] for item in segunda['results']], [f'Comentário {n}' for n in range(20, 25)])
+        self.assertIsNone(segunda['next'])
+
+    def test_listagem_plana_mantem_o_formato(self):
+        url = reverse('comentario-list')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        response = self.client.get(url, {'denuncia_id': self.denuncia.id})
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(response.data['results'][1]['autor']['email'], self.user.email)
+
+    def test_denuncia_inexistente(self):
+        response = self.client.get(reverse('denuncia-comentarios', args=[self.denuncia.id + 1000]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class SincronizacaoEmLoteTests(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Estado Lote', uf='LT')
+        self.cidade = Cidade.objects.create(nome='Cidade Lote', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Categoria Lote')
+        self.user = User.objects.create_user(username='agente', email='agente@example.com', password='password123', first_name='Agente')
+        self.client.login(username='agente', password='password123')
+        self.url = reverse('denuncia-lote')
+
+    def _item(self, ref, latitude, foto='foto_0', **extra):
+        item = {
+            'ref': ref, 'titulo': 'Calçada quebrada', 'descricao': 'Descrição',
+            'categoria': self.categoria.id, 'cidade': self.cidade.id, 'estado': self.estado.id,
+            'latitude': latitude, 'longitude': '-46.63300000', 'jurisdicao': 'MUNICIPAL', 'foto': foto,
+        }
+        item.update(extra)
+        return item
+
+    def _enviar(self, itens, fotos):
+        return self.client.post(self.url, {'itens': json.dumps(itens), **fotos}, format='multipart')
+
+    def test_deduplica_contra_o_banco_e_dentro_do_lote(self):
+        outro = User.objects.create_user(username='outro', email='outro@example.com', password='password123')
+        existente = Denuncia.objects.create(
+            titulo='Existente', descricao='Descrição', autor=outro, categoria=self.categoria,
+            cidade=self.cidade, estado=self.estado, latitude='-23.56000000', longitude='-46.63300000',
+            jurisdicao='MUNICIPAL', foto=create_dummy_image(),
+        )
+        itens = [
+            self._item('a', '-23.56000000', 'f0'),                 # Apoio à existente
+            self._item('b', '-23.56020000', 'f1'),                 # Já apoiada pelo item "a"
+            self._item('c', '-23.50000000', 'f2'),                 # Nova
+            self._item('d', '-23.50050000', 'f3'),                 # Apoio à nova do item "c"
+            self._item('e', '-23.40000000', 'f4', titulo='Entulho'),  # Nova
+            self._item('f', '-23.45000000', 'ausente'),            # Sem a foto
+        ]
+        fotos = {f'f{i}': create_dummy_image() for i in range(5)}
+
+        response = self._enviar(itens, fotos)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['ref'], item['resultado']) for item in response.data['resultados']],
+            [('a', 'apoio_adicionado'), ('b', 'ja_apoiada'), ('c', 'criada'),
+             ('d', 'apoio_adicionado'), ('e', 'criada'), ('f', 'invalida')]
+        )
+        self.assertIn('foto', response.data['resultados'][5]['erros'])
+        self.assertEqual((response.data['criadas'], response.data['apoios_adicionados']), (2, 2))
+
+        resultados = response.data['resultados']
+        self.assertEqual(resultados[0]['denuncia_id'], existente.id)
+        self.assertEqual(resultados[3]['denuncia_id'], resultados[2]['denuncia_id'])
+        nova = Denuncia.objects.get(pk=resultados[2]['denuncia_id'])
+        self.assertEqual((nova.autor, nova.total_apoios), (self.user, 1))
+        self.assertEqual(nova.celula_geo, celula_de(nova.latitude, nova.longitude))
+        existente.refresh_from_db()
+        self.assertEqual(existente.total_apoios, 1)
+        self.assertEqual(ApoioDenuncia.objects.filter(apoiador=self.user).count(), 2)
+
+        # Mapa, busca e índice de proximidade enxergam as novas sem passar por save()
+        self.assertEqual(sum(CelulaMapa.objects.filter(nivel=NIVEL_MINIMO).values_list('total', flat=True)), 3)
+        busca = self.client.get(reverse('denuncia-list'), {'q': 'entulho'})
+        self.assertEqual([item['id'] for item in busca.data['results']], [resultados[4]['denuncia_id']])
+        # Sem o intervalo entre sincronizações: o índice pode ter sido sincronizado por outro teste há pouco
+        with self.settings(PROXIMIDADE_SINCRONIZACAO_SEGUNDOS=0):
+            proximas = self.client.get(reverse('denuncia-proximas'), {'lat': '-23.5000', 'lon': '-46.6330', 'raio': 100})
+        self.assertEqual([item['id'] for item in proximas.data], [nova.id])
+
+        # Reenviar o mesmo lote (nova tentativa do aplicativo) não duplica nada
+        response = self._enviar(itens[:5], {f'f{i}': create_dummy_image() for i in range(5)})
+        self.assertEqual([item['resultado'] for item in response.data['resultados']], [
+            'ja_apoiada', 'ja_apoiada', 'ja_apoiada', 'ja_apoiada', 'apoio_adicionado',
+        ])
+        self.assertEqual(Denuncia.objects.count(), 3)
+
+    def test_mesma_foto_dentro_do_lote(self):
+        itens = [self._item('a', '-23.55000000', 'f0'), self._item('b', '-23.54550000', 'f1')]
+        fotos = {'f0': create_textured_image(1), 'f1': create_textured_image(1, tamanho=(800, 533))}
+        response = self._enviar(itens, fotos)
+        self.assertEqual([item['resultado'] for item in response.data['resultados']], ['criada', 'apoio_adicionado'])
+        self.assertIsNotNone(Denuncia.objects.get().foto_hash_b0)
+
+    def test_fotos_diferentes_no_mesmo_ponto_dentro_do_lote(self):
+        itens = [self._item('a', '-23.55000000', 'f0'), self._item('b', '-23.55000000', 'f1')]
+        fotos = {'f0': create_textured_image(1), 'f1': create_textured_image(2)}
+        response = self._enviar(itens, fotos)
+        self.assertEqual([item['resultado'] for item in response.data['resultados']], ['criada', 'criada'])
+
+        # Contra as já gravadas, no lote seguinte
+        response = self._enviar([self._item('c', '-23.55000000', 'f0')], {'f0': create_textured_image(3)})
+        self.assertEqual([item['resultado'] for item in response.data['resultados']], ['criada'])
+
+    def test_consultas_nao_crescem_com_o_lote(self):
+        def enviar(quantidade, inicio):
+            itens = [self._item(str(i), f'-23.{inicio + i:02d}000000', f'f{i}') for i in range(quantidade)]
+            fotos = {f'f{i}': create_dummy_image() for i in range(quantidade)}
+            with CaptureQueriesContext(connection) as consultas:
+                response = self._enviar(itens, fotos)
+            self.assertEqual(response.data['criadas'], quantidade)
+            # Tudo fora a validação de cada item (categoria, cidade, estado)
+            return len(consultas) - 3 * quantidade
+
+        self.assertEqual(enviar(2, 10), enviar(8, 30))
+
+    def test_mesmo_limite_de_candidatas_que_o_envio_avulso(self):
+        outro = User.objects.create_user(username='outro', email='outro@example.com', password='password123')
+        dados = dict(
+            descricao='Descrição', autor=outro, categoria=self.categoria, cidade=self.cidade,
+            estado=self.estado, jurisdicao='MUNICIPAL', foto=create_dummy_image(),
+        )
+        Denuncia.objects.create(titulo='Antiga', latitude='-23.56050000', longitude='-46.63300000', **dados)
+        # Mais recentes, na vizinhança mas a ~150 m: ocupam as vagas da sondagem
+        for numero in range(CANDIDATAS_MAXIMAS):
+            Denuncia.objects.create(titulo=f'Recente {numero}', latitude='-23.56050000', longitude='-46.63150000', **dados)
+
+        with CaptureQueriesContext(connection) as consultas:
+            response = self._enviar([self._item('a', '-23.56050000', 'f0')], {'f0': create_dummy_image()})
+        self.assertEqual(response.data['resultados'][0]['resultado'], 'criada')
+        sondagem = [q['sql'] for q in consultas.captured_queries if '"celula_geo" IN' in q['sql']]
+        self.assertEqual(len(sondagem), 1)
+        self.assertIn('ROW_NUMBER()', sondagem[0])
+
+    def test_fotos_enviadas_antes_da_transacao(self):
+        profundidades = []
+        enviar_foto = Denuncia.enviar_foto
+
+        def registrar(denuncia):
+            profundidades.append(len(connection.atomic_blocks))
+            enviar_foto(denuncia)
+
+        pasta = os.path.join(settings.MEDIA_ROOT, 'denuncias_fotos')
+        antes = set(os.listdir(pasta)) if os.path.isdir(pasta) else set()
+        fora = len(connection.atomic_blocks)
+        itens = [self._item('a', '-23.55000000', 'f0'), self._item('b', '-23.55010000', 'f1')]
+        with mock.patch.object(Denuncia, 'enviar_foto', registrar):
+            response = self._enviar(itens, {'f0': create_dummy_image(), 'f1': create_dummy_image()})
+        self.assertEqual([item['resultado'] for item in response.data['resultados']], ['criada', 'apoio_adicionado'])
+        self.assertEqual(profundidades, [fora, fora])
+
+        # A foto do item que virou apoio não fica no storage
+        self.assertEqual(set(os.listdir(pasta)) - antes, {os.path.basename(Denuncia.objects.get().foto.name)})
+
+    def test_requer_autenticacao_e_lista(self):
+        response = self.client.post(self.url, {'itens': 'não é json'}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.logout()
+        response = self._enviar([self._item('a', '-23.55000000')], {'foto_0': create_dummy_image()})
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
@@ -1,9 +1,16 @@
+import json
+import math
+
 from rest_framework import viewsets, permissions, mixins, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
-from django.db.models import Count, Prefetch
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.cache import patch_vary_headers
 
+from applications.core.referencia import DadosReferenciaMixin
+from applications.gestao_publica.jurisdicao import jurisdicao_do_gestor
 from applications.gestao_publica.permissions import IsGestorWithJurisdiction
 from .models import Categoria, Denuncia, ApoioDenuncia, Comentario
 from .serializers import (
@@ -11,9 +18,52 @@ from .serializers import (
     DenunciaSerializer, 
     DenunciaListSerializer,
     ApoioDenunciaSerializer, 
-    ComentarioSerializer
+    ComentarioSerializer,
+    ComentarioResumoSerializer,
+)
+from .services import (
+    LOTE_DENUNCIAS_MAXIMO,
+    criar_ou_apoiar_denuncia,
+    criar_ou_apoiar_em_lote,
+    candidatas_proximas,
+    primeira_no_raio,
+    transferir_apoios,
+    haversine_distance,
+    ids_do_lote,
+    alterar_status_em_lote,
 )
-from .services import criar_ou_apoiar_denuncia
+from .indice import indice_proximidade, STATUS_INDEXADOS
+from . import busca
+from .pagination import ComentarioCursorPagination, DenunciaPagination
+from .mapa import mapa as agrupar_mapa
+
+PROXIMAS_RAIO_PADRAO = 1000
+PROXIMAS_RAIO_MAXIMO = 10000
+PROXIMAS_K_PADRAO = 20
+PROXIMAS_K_MAXIMO = 100
+PROXIMAS_TENTATIVAS = 3  # Buscas no índice por requisição, descontando as excluídas
+
+ORDENACOES_PERMITIDAS = [
+    'data_criacao', '-data_criacao',
+    'total_apoios', '-total_apoios',
+    'total_comentarios', '-total_comentarios',
+]
+
+def comentarios_da_denuncia(denuncia_id):
+    """Comentários de uma denúncia carregando do autor só o que ComentarioResumoSerializer usa."""
+    return Comentario.objects.filter(denuncia_id=denuncia_id).select_related('autor').only(
+        'id', 'denuncia_id', 'autor_convidado', 'texto', 'data_criacao',
+        'autor__id', 'autor__username', 'autor__first_name', 'autor__last_name',
+    )
+
+def listar_comentarios(view, request, denuncia_id):
+    """Uma página da conversa, por cursor e sem COUNT (ver ComentarioCursorPagination)."""
+    if not Denuncia.objects.filter(pk=denuncia_id).exists():
+        return Response({'error': 'Denúncia não encontrada.'}, status=status.HTTP_404_NOT_FOUND)
+    paginador = ComentarioCursorPagination()
+    pagina = paginador.paginate_queryset(comentarios_da_denuncia(denuncia_id), request, view=view)
+    serializer = ComentarioResumoSerializer(pagina, many=True, context={'request': request})
+    return paginador.get_paginated_response(serializer.data)
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -30,21 +80,21 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         
         return False
 
-class CategoriaViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Categoria.objects.all()
+class CategoriaViewSet(DadosReferenciaMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Categoria.objects.order_by('nome')
     serializer_class = CategoriaSerializer
     permission_classes = [permissions.AllowAny]
+    conjunto_referencia = 'categorias'
 
 class DenunciaViewSet(viewsets.ModelViewSet):
     serializer_class = DenunciaSerializer
+    pagination_class = DenunciaPagination  # Página numerada ou ?cursor= (rolagem infinita)
     
     def get_queryset(self):
-        # Otimização: select_related para ForeignKeys, prefetch_related para ManyToMany
-        # annotate para contar apoios em uma única query
+        # Otimização: select_related para ForeignKeys; total_apoios e total_comentarios
+        # são colunas mantidas pelos próprios modelos (sem JOIN + GROUP BY)
         queryset = Denuncia.objects.select_related(
             'autor', 'categoria', 'cidade', 'estado'
-        ).annotate(
-            total_apoios=Count('apoios')  # Conta apoios em 1 query ao invés de N queries
         )
         
         # Filtro para "Minhas Denúncias" - apenas denúncias do usuário autenticado
@@ -64,6 +114,15 @@ class DenunciaViewSet(viewsets.ModelViewSet):
         if categoria_param:
             queryset = queryset.filter(categoria_id=categoria_param)
         
+        # Busca textual: ordena por relevância, a não ser que "ordering" seja informado
+        q = self.request.query_params.get('q', '').strip()
+        if q:
+            queryset = busca.buscar(queryset, q)
+        
+        ordering_param = self.request.query_params.get('ordering', None)
+        if ordering_param in ORDENACOES_PERMITIDAS:
+            queryset = queryset.order_by(ordering_param, '-id')
+        
         return queryset
     
     def get_serializer_class(self):
@@ -72,11 +131,18 @@ class DenunciaViewSet(viewsets.ModelViewSet):
             return DenunciaListSerializer
         return DenunciaSerializer
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        # foto_thumb/foto_card mudam de formato conforme o Accept (ver VariantesFotoMixin)
+        response = super().finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
             permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
         else:
-            permission_classes = [permissions.AllowAny]
+            # Ações com permission_classes próprias (change_status, resolver...) usam as delas
+            permission_classes = self.permission_classes
         return [permission() for permission in permission_classes]
 
     def create(self, request, *args, **kwargs):
@@ -130,10 +196,56 @@ class DenunciaViewSet(viewsets.ModelViewSet):
                 headers=headers
             )
 
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def lote(self, request):
+        """
+        Recebe de uma vez as denúncias que o aplicativo acumulou offline.
+        POST /api/denuncias/denuncias/lote/ (multipart)
+          itens: JSON com a lista de denúncias; o "foto" de cada item é o nome da parte com o arquivo
+        Cada item tem o mesmo resultado que teria em POST /api/denuncias/denuncias/.
+        """
+        itens = request.data.get('itens')
+        if isinstance(itens, str):
+            try:
+                itens = json.loads(itens)
+            except ValueError:
+                itens = None
+        if not isinstance(itens, list) or not itens or not all(isinstance(item, dict) for item in itens):
+            return Response(
+                {'error': 'O campo "itens" deve ser uma lista não vazia de denúncias.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(itens) > LOTE_DENUNCIAS_MAXIMO:
+            return Response(
+                {'error': f'No máximo {LOTE_DENUNCIAS_MAXIMO} denúncias por requisição.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        resultados = []
+        validos = []
+        for item in itens:
+            dados = {campo: valor for campo, valor in item.items() if campo != 'ref'}
+            referencia = item.get('foto')
+            dados['foto'] = request.FILES.get(referencia) if isinstance(referencia, str) else None
+            serializer = self.get_serializer(data=dados)
+            if serializer.is_valid():
+                validos.append(serializer.validated_data)
+                resultados.append({'ref': item.get('ref'), 'resultado': None})
+            else:
+                resultados.append({'ref': item.get('ref'), 'resultado': 'invalida', 'erros': serializer.errors})
+
+        gravados = iter(criar_ou_apoiar_em_lote(validos, request.user))
+        for resultado in resultados:
+            if resultado['resultado'] is None:
+                resultado['denuncia_id'], resultado['resultado'] = next(gravados)
+
+        return Response({
+            'criadas': sum(1 for item in resultados if item['resultado'] == 'criada'),
+            'apoios_adicionados': sum(1 for item in resultados if item['resultado'] == 'apoio_adicionado'),
+            'resultados': resultados,
+        })
+
     def destroy(self, request, *args, **kwargs):
-        from .services import haversine_distance, SEARCH_RADIUS_METERS
-        from django.db import transaction
-        
         denuncia = self.get_object()
         
         # Validação de permissão: usuário autenticado OU guest com mesmo nome
@@ -160,35 +272,20 @@ class DenunciaViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
         
-        apoios = list(denuncia.apoios.all().select_related('apoiador'))
-        total_apoios = len(apoios)
+        total_apoios = denuncia.apoios.count()
         
         if total_apoios > 0:
             with transaction.atomic():
-                denuncias_proximas = Denuncia.objects.filter(
-                    categoria=denuncia.categoria,
-                    status__in=['ABERTA', 'EM_ANALISE']
-                ).exclude(id=denuncia.id)
-                
-                denuncia_destino = None
-                for candidata in denuncias_proximas:
-                    distancia = haversine_distance(
-                        denuncia.latitude, denuncia.longitude,
-                        candidata.latitude, candidata.longitude
-                    )
-                    if distancia <= SEARCH_RADIUS_METERS:
-                        denuncia_destino = candidata
-                        break
+                # Mesma busca da deduplicação: células vizinhas + haversine
+                candidatas = candidatas_proximas(
+                    denuncia.categoria_id, denuncia.latitude, denuncia.longitude, excluir=denuncia.id
+                )
+                denuncia_destino, _ = primeira_no_raio(
+                    candidatas, denuncia.latitude, denuncia.longitude, denuncia.foto_hash
+                )
                 
                 if denuncia_destino:
-                    apoios_transferidos = 0
-                    for apoio in apoios:
-                        if not denuncia_destino.apoios.filter(apoiador=apoio.apoiador).exists():
-                            apoio.denuncia = denuncia_destino
-                            apoio.save()
-                            apoios_transferidos += 1
-                        else:
-                            apoio.delete()
+                    apoios_transferidos = transferir_apoios(denuncia, denuncia_destino)
                     
                     denuncia.delete()
                     
@@ -201,41 +298,38 @@ class DenunciaViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_200_OK
                     )
                 else:
-                    apoio_mais_antigo = apoios[0] if apoios else None
+                    apoio_mais_antigo = denuncia.apoios.select_related('apoiador').order_by('data_apoio', 'id').first()
+                    
+                    nova_denuncia = Denuncia.objects.create(
+                        titulo=denuncia.titulo,
+                        descricao=f"[Denúncia promovida automaticamente] {denuncia.descricao}",
+                        autor=apoio_mais_antigo.apoiador,
+                        categoria=denuncia.categoria,
+                        cidade=denuncia.cidade,
+                        estado=denuncia.estado,
+                        foto=denuncia.foto,
+                        foto_hash=denuncia.foto_hash,  # Continua achável por mesma_foto
+                        endereco=denuncia.endereco,
+                        latitude=denuncia.latitude,
+                        longitude=denuncia.longitude,
+                        jurisdicao=denuncia.jurisdicao,
+                        status=denuncia.status
+                    )
+                    
+                    # O apoiador promovido vira autor; os demais apoios seguem para a nova denúncia
+                    apoio_mais_antigo.delete()
+                    transferir_apoios(denuncia, nova_denuncia)
+                    
+                    denuncia.delete()
                     
-                    if apoio_mais_antigo:
-                        nova_denuncia = Denuncia.objects.create(
-                            titulo=denuncia.titulo,
-                            descricao=f"[Denúncia promovida automaticamente] {denuncia.descricao}",
-                            autor=apoio_mais_antigo.apoiador,
-                            categoria=denuncia.categoria,
-                            cidade=denuncia.cidade,
-                            estado=denuncia.estado,
-                            foto=denuncia.foto,
-                            endereco=denuncia.endereco,
-                            latitude=denuncia.latitude,
-                            longitude=denuncia.longitude,
-                            jurisdicao=denuncia.jurisdicao,
-                            status=denuncia.status
-                        )
-                        
-                        for apoio in apoios[1:]:
-                            if not nova_denuncia.apoios.filter(apoiador=apoio.apoiador).exists():
-                                apoio.denuncia = nova_denuncia
-                                apoio.save()
-                        
-                        apoio_mais_antigo.delete()
-                        
-                        denuncia.delete()
-                        
-                        return Response(
-                            {
-                                'message': f'Denúncia deletada com sucesso. O apoio mais antigo foi promovido como nova denúncia principal e {len(apoios)-1} apoio(s) foram preservados.',
-                                'nova_denuncia_id': nova_denuncia.id,
-                                'apoios_preservados': len(apoios) - 1
-                            },
-                            status=status.HTTP_200_OK
-                        )
+                    return Response(
+                        {
+                            'message': f'Denúncia deletada com sucesso. O apoio mais antigo foi promovido como nova denúncia principal e {total_apoios-1} apoio(s) foram preservados.',
+                            'nova_denuncia_id': nova_denuncia.id,
+                            'apoios_preservados': total_apoios - 1
+                        },
+                        status=status.HTTP_200_OK
+                    )
         
         return super().destroy(request, *args, **kwargs)
 
@@ -258,12 +352,126 @@ class DenunciaViewSet(viewsets.ModelViewSet):
         
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = DenunciaListSerializer(page, many=True)
+            serializer = DenunciaListSerializer(page, many=True, context=self.get_serializer_context())
             return self.get_paginated_response(serializer.data)
         
-        serializer = DenunciaListSerializer(queryset, many=True)
+        serializer = DenunciaListSerializer(queryset, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
+    def comentarios(self, request, pk=None):
+        """
+        Comentários da denúncia, do mais antigo ao mais novo, paginados por cursor.
+        GET /api/denuncias/denuncias/{id}/comentarios/?cursor=
+        """
+        try:
+            denuncia_id = int(pk)
+        except ValueError:
+            return Response({'error': 'Denúncia não encontrada.'}, status=status.HTTP_404_NOT_FOUND)
+        return listar_comentarios(self, request, denuncia_id)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def proximas(self, request):
+        """
+        Denúncias abertas mais próximas de um ponto, ordenadas pela distância.
+        GET /api/denuncias/denuncias/proximas/?lat=&lon=&raio=&k=&categoria=
+        """
+        try:
+            lat = float(request.query_params['lat'])
+            lon = float(request.query_params['lon'])
+            raio = float(request.query_params.get('raio', PROXIMAS_RAIO_PADRAO))
+            k = int(request.query_params.get('k', PROXIMAS_K_PADRAO))
+            categoria = request.query_params.get('categoria')
+            categoria = int(categoria) if categoria else None
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'Os parâmetros "lat" e "lon" são obrigatórios; "raio", "k" e "categoria" devem ser numéricos.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # float() aceita "nan" e "inf", que passariam pelas comparações abaixo
+        if not all(map(math.isfinite, (lat, lon, raio))):
+            return Response(
+                {'error': 'Os parâmetros "lat", "lon" e "raio" devem ser números finitos.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or raio <= 0 or k <= 0:
+            return Response(
+                {'error': 'Coordenadas fora do intervalo ou "raio"/"k" não positivos.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        raio = min(raio, PROXIMAS_RAIO_MAXIMO)
+        k = min(k, PROXIMAS_K_MAXIMO)
+
+        indice = indice_proximidade()
+        for _ in range(PROXIMAS_TENTATIVAS):
+            resultados = indice.buscar(lat, lon, raio, k, categoria)
+            if not resultados:
+                return Response([])
+
+            # O índice só sugere candidatas; status e posição são confirmados no banco
+            denuncias = Denuncia.objects.select_related(
+                'autor', 'categoria', 'cidade', 'estado'
+            ).filter(id__in=[denuncia_id for denuncia_id, _ in resultados], status__in=STATUS_INDEXADOS)
+
+            encontradas = []
+            for denuncia in denuncias:
+                distancia = haversine_distance(lat, lon, denuncia.latitude, denuncia.longitude)
+                if distancia <= raio:
+                    encontradas.append((distancia, denuncia))
+
+            # Excluídas (ou resolvidas) que o índice deste worker ainda não viu ocupam
+            # vagas de k: saem do índice e a busca é refeita
+            devolvidas = {denuncia.id for denuncia in denuncias}
+            ausentes = [denuncia_id for denuncia_id, _ in resultados if denuncia_id not in devolvidas]
+            if not ausentes or len(resultados) < k:
+                break
+            indice.remover(ausentes)
+        encontradas.sort(key=lambda item: item[0])
+
+        serializer = DenunciaListSerializer(
+            [denuncia for _, denuncia in encontradas], many=True, context=self.get_serializer_context()
+        )
+        data = serializer.data
+        for item, (distancia, _) in zip(data, encontradas):
+            item['distancia'] = round(distancia, 1)
+        return Response(data)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def mapa(self, request):
+        """
+        Agrupamentos (centróide + total) das denúncias no viewport, ou as denúncias
+        individuais em zoom alto. O tamanho da resposta é limitado independentemente do volume.
+        GET /api/denuncias/denuncias/mapa/?bbox=min_lon,min_lat,max_lon,max_lat&zoom=&categoria=&status=
+        """
+        try:
+            min_lon, min_lat, max_lon, max_lat = [float(valor) for valor in request.query_params['bbox'].split(',')]
+            zoom = int(request.query_params['zoom'])
+            categoria = request.query_params.get('categoria')
+            categoria = int(categoria) if categoria else None
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'Os parâmetros "bbox" (min_lon,min_lat,max_lon,max_lat) e "zoom" são obrigatórios e numéricos.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if not (-180 <= min_lon < max_lon <= 180 and -90 <= min_lat < max_lat <= 90) or not 0 <= zoom <= 22:
+            return Response(
+                {'error': 'Viewport inválido: os limites devem estar em ordem e dentro do intervalo, e "zoom" entre 0 e 22.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        status_param = request.query_params.get('status')
+        status_lista = status_param.split(',') if status_param else None
+        status_choices = [choice[0] for choice in Denuncia.Status.choices]
+        if status_lista and any(valor not in status_choices for valor in status_lista):
+            return Response(
+                {'error': f'Status inválido. Opções válidas: {status_choices}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(agrupar_mapa((min_lon, min_lat, max_lon, max_lat), zoom, categoria, status_lista))
+
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def resolver(self, request, pk=None):
         denuncia = self.get_object()
@@ -297,10 +505,40 @@ class DenunciaViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         denuncia.status = novo_status
-        denuncia.save()
+        denuncia.save(update_fields=['status', 'data_atualizacao'])
         serializer = self.get_serializer(denuncia)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def change_status_lote(self, request):
+        """
+        Altera o status de várias denúncias da jurisdição do gestor de uma vez.
+        POST /api/denuncias/denuncias/change_status_lote/  {"ids": [1, 2, ...], "status": "RESOLVIDA"}
+        """
+        jurisdicao = jurisdicao_do_gestor(request.user)
+        if jurisdicao is None:
+            return Response(
+                {'error': 'Apenas gestores públicos com entidade associada podem alterar status.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        novo_status = request.data.get('status')
+        status_choices = [choice[0] for choice in Denuncia.Status.choices]
+        if novo_status not in status_choices:
+            return Response(
+                {'error': f'Status inválido. Opções válidas: {status_choices}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            ids = ids_do_lote(request.data.get('ids'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        resultados = alterar_status_em_lote(ids, novo_status, jurisdicao.abrange)
+        return Response({
+            'alteradas': sum(1 for item in resultados if item['resultado'] == 'alterada'),
+            'resultados': resultados,
+        })
+
 class ApoioDenunciaViewSet(mixins.CreateModelMixin,
                            mixins.RetrieveModelMixin,
                            mixins.DestroyModelMixin,
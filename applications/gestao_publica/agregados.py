@@ -0,0 +1,95 @@
+"""
+Tabelas agregadas dos gestores (heatmap, estatísticas e série diária), mantidas
+incrementalmente a cada variação das denúncias.
+
+O heatmap usa a mesma grade hierárquica do mapa público (no nível N cada célula mede
+360 / 2^N graus), guardando apenas as resoluções úteis para um heatmap. O peso de
+uma denúncia é 1 + apoios: novas denúncias e mudanças de status chegam como
+variações de `denuncias`, apoios criados/removidos como variações só de `peso`.
+"""
+from django.utils import timezone
+
+from applications.denuncias import agregacao
+from applications.denuncias.mapa import indices
+from applications.denuncias.models import Denuncia
+
+from .models import CelulaHeatmap, ContagemDiaria, EstatisticaJurisdicao
+
+RESOLUCAO_MINIMA = 10
+RESOLUCAO_MAXIMA = 17
+RESOLUCAO_PADRAO = 14
+
+CHAVE_HEATMAP = ('jurisdicao', 'escopo_id', 'resolucao', 'categoria_id', 'status', 'y', 'x')
+CHAVE_ESTATISTICAS = ('jurisdicao', 'escopo_id', 'status', 'categoria')
+CHAVE_CONTAGEM_DIARIA = ('jurisdicao', 'escopo_id', 'dia', 'categoria', 'status')
+
+
+def escopo(jurisdicao, cidade_id, estado_id):
+    """Id da cidade ou do estado cujo gestor enxerga uma denúncia desta jurisdição."""
+    if jurisdicao == Denuncia.Jurisdicao.MUNICIPAL:
+        return cidade_id
+    if jurisdicao == Denuncia.Jurisdicao.ESTADUAL:
+        return estado_id
+    return None
+
+
+def dia_local(data_criacao):
+    """Dia de criação no fuso do projeto, o mesmo usado por TruncDay nas consultas."""
+    if timezone.is_aware(data_criacao):
+        return timezone.localdate(data_criacao)
+    return data_criacao.date()
+
+
+def aplicar_heatmap(variacoes):
+    incrementos = {}
+    for variacao in variacoes:
+        retrato = variacao.retrato
+        escopo_id = escopo(retrato.jurisdicao, retrato.cidade_id, retrato.estado_id)
+        if escopo_id is None or retrato.categoria_id is None:
+            continue
+        for resolucao in range(RESOLUCAO_MINIMA, RESOLUCAO_MAXIMA + 1):
+            x, y = indices(retrato.latitude, retrato.longitude, resolucao)
+            deltas = incrementos.setdefault(
+                (retrato.jurisdicao, escopo_id, resolucao, retrato.categoria_id, retrato.status, y, x),
+                {'total': 0, 'peso': 0, 'soma_latitude': 0.0, 'soma_longitude': 0.0},
+            )
+            deltas['total'] += variacao.denuncias
+            deltas['peso'] += variacao.peso
+            deltas['soma_latitude'] += variacao.denuncias * retrato.latitude
+            deltas['soma_longitude'] += variacao.denuncias * retrato.longitude
+    agregacao.incrementar(CelulaHeatmap, CHAVE_HEATMAP, incrementos)
+
+
+def aplicar_estatisticas(variacoes):
+    incrementos = {}
+    for variacao in variacoes:
+        retrato = variacao.retrato
+        escopo_id = escopo(retrato.jurisdicao, retrato.cidade_id, retrato.estado_id)
+        if not variacao.denuncias or escopo_id is None or retrato.categoria_id is None:
+            continue
+        deltas = incrementos.setdefault(
+            (retrato.jurisdicao, escopo_id, retrato.status, retrato.categoria_id), {'total': 0}
+        )
+        deltas['total'] += variacao.denuncias
+    agregacao.incrementar(EstatisticaJurisdicao, CHAVE_ESTATISTICAS, incrementos)
+
+
+def aplicar_contagem_diaria(variacoes):
+    incrementos = {}
+    for variacao in variacoes:
+        retrato = variacao.retrato
+        escopo_id = escopo(retrato.jurisdicao, retrato.cidade_id, retrato.estado_id)
+        if (not variacao.denuncias or escopo_id is None or retrato.categoria_id is None
+                or retrato.data_criacao is None):
+            continue
+        deltas = incrementos.setdefault(
+            (retrato.jurisdicao, escopo_id, dia_local(retrato.data_criacao), retrato.categoria_id, retrato.status),
+            {'total': 0},
+        )
+        deltas['total'] += variacao.denuncias
+    agregacao.incrementar(ContagemDiaria, CHAVE_CONTAGEM_DIARIA, incrementos)
+
+
+agregacao.registrar(CelulaHeatmap, aplicar_heatmap)
+agregacao.registrar(EstatisticaJurisdicao, aplicar_estatisticas)
+agregacao.registrar(ContagemDiaria, aplicar_contagem_diaria)
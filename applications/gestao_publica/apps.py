@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class GestaoPublicaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'applications.gestao_publica'
+
+    def ready(self):
+        from . import agregados  # noqa: F401  Registra a tabela agregada do heatmap
+        from . import jurisdicao  # noqa: F401  Invalida o cache de jurisdição dos gestores
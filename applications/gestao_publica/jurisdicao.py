@@ -0,0 +1,123 @@
+"""
+Jurisdição do gestor público: a entidade que ele gerencia e o recorte de denúncias
+que ele enxerga.
+
+Resolvida uma vez por requisição (memorizada no próprio `request.user`, o mesmo
+objeto para permissões e views) e guardada no cache do Django por
+JURISDICAO_CACHE_TTL segundos entre requisições, junto com a versão "jurisdicao" de
+VersaoDados. Mudanças em OfficialEntity.gestores, na localidade da entidade ou num
+gestor incrementam essa versão (receivers abaixo), e uma entrada de outra versão é
+descartada: como a versão fica no banco, a invalidação vale para todos os workers,
+mesmo com o cache em memória local. Uma requisição custa uma leitura da versão.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from applications.core.medicao import contar_cache
+from applications.core.models import VersaoDados
+from applications.denuncias.models import Denuncia
+from .models import OfficialEntity
+
+VERSAO = 'jurisdicao'  # Nome em VersaoDados
+_SEM_JURISDICAO = ()  # Guardado no cache para gestores sem entidade
+
+
+class Jurisdicao(namedtuple('Jurisdicao', ['entidade_id', 'jurisdicao', 'escopo_id'])):
+
+    def filtro(self):
+        """Q das denúncias visíveis para o gestor."""
+        if self.jurisdicao == Denuncia.Jurisdicao.MUNICIPAL:
+            return Q(jurisdicao=self.jurisdicao, cidade_id=self.escopo_id)
+        return Q(jurisdicao=self.jurisdicao, estado_id=self.escopo_id)
+
+    def denuncias(self):
+        return Denuncia.objects.filter(self.filtro())
+
+    def abrange(self, denuncia):
+        """Se a denúncia (objeto Denuncia ou dict com jurisdicao, cidade_id e estado_id) é visível."""
+        if isinstance(denuncia, dict):
+            obter = denuncia.get
+        else:
+            obter = lambda campo: getattr(denuncia, campo)  # noqa: E731
+        if obter('jurisdicao') != self.jurisdicao:
+            return False
+        if self.jurisdicao == Denuncia.Jurisdicao.MUNICIPAL:
+            return obter('cidade_id') == self.escopo_id
+        return obter('estado_id') == self.escopo_id
+
+
+def _chave(user_id):
+    return f'gestao_publica:jurisdicao:{user_id}'
+
+
+def _do_banco(user):
+    entidade = OfficialEntity.objects.filter(gestores=user).order_by('pk').values_list(
+        'pk', 'cidade_id', 'estado_id'
+    ).first()
+    if entidade is None:
+        return None
+    entidade_id, cidade_id, estado_id = entidade
+    if cidade_id:
+        return Jurisdicao(entidade_id, Denuncia.Jurisdicao.MUNICIPAL, cidade_id)
+    if estado_id:
+        return Jurisdicao(entidade_id, Denuncia.Jurisdicao.ESTADUAL, estado_id)
+    return None
+
+
+def jurisdicao_do_gestor(user):
+    """Jurisdicao do gestor (entidade, jurisdicao e escopo_id), ou None para quem não é gestor com entidade."""
+    if not user.is_authenticated or getattr(user, 'tipo_usuario', None) != 'GESTOR_PUBLICO':
+        return None
+    if hasattr(user, '_jurisdicao_gestor'):
+        return user._jurisdicao_gestor
+
+    versao = VersaoDados.atual(VERSAO)
+    versao_guardada, guardada = cache.get(_chave(user.pk), (None, None))
+    contar_cache(versao_guardada == versao)
+    if versao_guardada != versao:
+        resolvida = _do_banco(user)
+        cache.set(
+            _chave(user.pk), (versao, tuple(resolvida) if resolvida else _SEM_JURISDICAO),
+            settings.JURISDICAO_CACHE_TTL,
+        )
+    else:
+        resolvida = Jurisdicao(*guardada) if guardada else None
+    user._jurisdicao_gestor = resolvida
+    return resolvida
+
+
+def esquecer():
+    """Invalida a jurisdição em cache de todos os gestores, em todos os processos."""
+    VersaoDados.incrementar(VERSAO)
+
+
+@receiver(m2m_changed, sender=OfficialEntity.gestores.through)
+def _gestores_alterados(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        esquecer()
+
+
+@receiver(post_save, sender=OfficialEntity)
+def _entidade_alterada(sender, instance, created, **kwargs):
+    if not created:
+        esquecer()
+
+
+@receiver(pre_delete, sender=OfficialEntity)
+def _entidade_removida(sender, instance, **kwargs):
+    esquecer()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _usuario_alterado(sender, instance, update_fields=None, **kwargs):
+    # O tipo_usuario é conferido a cada requisição; só importa quem é (ou virou) gestor.
+    # O login grava last_login e não muda nada aqui.
+    if instance.tipo_usuario != 'GESTOR_PUBLICO' or update_fields == frozenset({'last_login'}):
+        return
+    esquecer()
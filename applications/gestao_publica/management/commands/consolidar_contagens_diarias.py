@@ -0,0 +1,72 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from applications.denuncias import agregacao
+from applications.denuncias.models import Denuncia
+from applications.gestao_publica.agregados import CHAVE_CONTAGEM_DIARIA
+from applications.gestao_publica.models import ContagemDiaria
+
+ESCOPOS = [
+    (Denuncia.Jurisdicao.MUNICIPAL, 'cidade_id'),
+    (Denuncia.Jurisdicao.ESTADUAL, 'estado_id'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula as contagens diárias dos últimos dias a partir das denúncias e '
+        'corrige divergências. Feito para rodar todas as noites.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=2, help='Quantos dias, contando hoje, conferir.')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas informa quantas linhas estão divergentes, sem corrigir.',
+        )
+
+    def handle(self, *args, **options):
+        primeiro_dia = timezone.localdate() - timedelta(days=max(options['dias'], 1) - 1)
+        inicio = timezone.make_aware(datetime.combine(primeiro_dia, time.min))
+
+        with transaction.atomic():
+            reais = {}
+            for jurisdicao, escopo in ESCOPOS:
+                linhas = (
+                    Denuncia.objects.filter(jurisdicao=jurisdicao, data_criacao__gte=inicio)
+                    .annotate(dia=TruncDate('data_criacao'))
+                    .values(escopo, 'dia', 'categoria_id', 'status')
+                    .annotate(total=Count('id'))
+                    .order_by()
+                )
+                for linha in linhas:
+                    chave = (jurisdicao, linha[escopo], linha['dia'], linha['categoria_id'], linha['status'])
+                    reais[chave] = linha['total']
+
+            salvas = {
+                tuple(linha[:-1]): linha[-1]
+                for linha in ContagemDiaria.objects.filter(dia__gte=primeiro_dia).values_list(
+                    'jurisdicao', 'escopo_id', 'dia', 'categoria_id', 'status', 'total'
+                )
+            }
+
+            incrementos = {}
+            for chave in reais.keys() | salvas.keys():
+                diferenca = reais.get(chave, 0) - salvas.get(chave, 0)
+                if diferenca:
+                    incrementos[chave] = {'total': diferenca}
+
+            if not options['dry_run']:
+                agregacao.incrementar(ContagemDiaria, CHAVE_CONTAGEM_DIARIA, incrementos)
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(incrementos)} contagem(ns) divergente(s) desde {primeiro_dia}.')
+            return
+        estilo = self.style.WARNING if incrementos else self.style.SUCCESS
+        self.stdout.write(estilo(f'{len(incrementos)} contagem(ns) corrigida(s) desde {primeiro_dia}.'))
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:59
+
+from math import floor
+
+from django.db import migrations, models
+
+RESOLUCAO_MINIMA = 10
+RESOLUCAO_MAXIMA = 17
+
+
+def popular_celulas_heatmap(apps, schema_editor):
+    """Agrega as denúncias existentes na grade do heatmap (mesma regra de agregados.py)."""
+    Denuncia = apps.get_model('denuncias', 'Denuncia')
+    CelulaHeatmap = apps.get_model('gestao_publica', 'CelulaHeatmap')
+
+    celulas = {}
+    linhas = Denuncia.objects.filter(jurisdicao__in=['MUNICIPAL', 'ESTADUAL']).values_list(
+        'jurisdicao', 'cidade_id', 'estado_id', 'categoria_id', 'status', 'latitude', 'longitude', 'total_apoios'
+    )
+    for jurisdicao, cidade_id, estado_id, categoria_id, status, latitude, longitude, apoios in linhas.iterator(chunk_size=2000):
+        escopo_id = cidade_id if jurisdicao == 'MUNICIPAL' else estado_id
+        if escopo_id is None or categoria_id is None:
+            continue
+        latitude, longitude = float(latitude), float(longitude)
+        for resolucao in range(RESOLUCAO_MINIMA, RESOLUCAO_MAXIMA + 1):
+            tamanho = 360.0 / (1 << resolucao)
+            x = int(floor((longitude + 180.0) / tamanho))
+            y = int(floor((latitude + 90.0) / tamanho))
+            celula = celulas.setdefault((jurisdicao, escopo_id, resolucao, categoria_id, status, y, x), [0, 0, 0.0, 0.0])
+            celula[0] += 1
+            celula[1] += 1 + apoios
+            celula[2] += latitude
+            celula[3] += longitude
+
+    CelulaHeatmap.objects.bulk_create(
+        [
+            CelulaHeatmap(
+                jurisdicao=jurisdicao, escopo_id=escopo_id, resolucao=resolucao,
+                categoria_id=categoria_id, status=status, y=y, x=x,
+                total=total, peso=peso, soma_latitude=soma_lat, soma_longitude=soma_lon,
+            )
+            for (jurisdicao, escopo_id, resolucao, categoria_id, status, y, x), (total, peso, soma_lat, soma_lon)
+            in celulas.items()
+        ],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao_publica', '0001_initial'),
+        ('denuncias', '0009_denuncia_contadores_engajamento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CelulaHeatmap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolucao', models.PositiveSmallIntegerField()),
+                ('jurisdicao', models.CharField(choices=[('MUNICIPAL', 'Municipal'), ('ESTADUAL', 'Estadual'), ('FEDERAL', 'Federal'), ('PRIVADO', 'Privado')], max_length=20)),
+                ('escopo_id', models.IntegerField()),
+                ('categoria_id', models.IntegerField()),
+                ('status', models.CharField(choices=[('ABERTA', 'Aberta'), ('EM_ANALISE', 'Em Análise'), ('RESOLVIDA', 'Resolvida')], max_length=20)),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('total', models.IntegerField(default=0)),
+                ('peso', models.IntegerField(default=0)),
+                ('soma_latitude', models.FloatField(default=0)),
+                ('soma_longitude', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Célula do Heatmap',
+                'verbose_name_plural': 'Células do Heatmap',
+                'constraints': [models.UniqueConstraint(fields=('jurisdicao', 'escopo_id', 'resolucao', 'categoria_id', 'status', 'y', 'x'), name='celula_heatmap_unica')],
+            },
+        ),
+        migrations.RunPython(popular_celulas_heatmap, migrations.RunPython.noop),
+    ]
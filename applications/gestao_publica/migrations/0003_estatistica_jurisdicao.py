@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def popular_estatisticas(apps, schema_editor):
+    """Conta as denúncias existentes por jurisdição, status e categoria."""
+    Denuncia = apps.get_model('denuncias', 'Denuncia')
+    EstatisticaJurisdicao = apps.get_model('gestao_publica', 'EstatisticaJurisdicao')
+
+    estatisticas = []
+    for jurisdicao, escopo in (('MUNICIPAL', 'cidade_id'), ('ESTADUAL', 'estado_id')):
+        linhas = (
+            Denuncia.objects.filter(jurisdicao=jurisdicao)
+            .values(escopo, 'status', 'categoria_id')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+        estatisticas.extend(
+            EstatisticaJurisdicao(
+                jurisdicao=jurisdicao, escopo_id=linha[escopo], status=linha['status'],
+                categoria_id=linha['categoria_id'], total=linha['total'],
+            )
+            for linha in linhas
+        )
+    EstatisticaJurisdicao.objects.bulk_create(estatisticas, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('denuncias', '0010_celula_mapa'),
+        ('gestao_publica', '0002_celula_heatmap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstatisticaJurisdicao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jurisdicao', models.CharField(choices=[('MUNICIPAL', 'Municipal'), ('ESTADUAL', 'Estadual'), ('FEDERAL', 'Federal'), ('PRIVADO', 'Privado')], max_length=20)),
+                ('escopo_id', models.IntegerField()),
+                ('status', models.CharField(choices=[('ABERTA', 'Aberta'), ('EM_ANALISE', 'Em Análise'), ('RESOLVIDA', 'Resolvida')], max_length=20)),
+                ('total', models.IntegerField(default=0)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='denuncias.categoria')),
+            ],
+            options={
+                'verbose_name': 'Estatística da Jurisdição',
+                'verbose_name_plural': 'Estatísticas das Jurisdições',
+                'constraints': [models.UniqueConstraint(fields=('jurisdicao', 'escopo_id', 'status', 'categoria'), name='estatistica_jurisdicao_unica')],
+            },
+        ),
+        migrations.RunPython(popular_estatisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def popular_contagens_diarias(apps, schema_editor):
+    """Conta as denúncias existentes por jurisdição, dia, categoria e status."""
+    Denuncia = apps.get_model('denuncias', 'Denuncia')
+    ContagemDiaria = apps.get_model('gestao_publica', 'ContagemDiaria')
+
+    contagens = []
+    for jurisdicao, escopo in (('MUNICIPAL', 'cidade_id'), ('ESTADUAL', 'estado_id')):
+        linhas = (
+            Denuncia.objects.filter(jurisdicao=jurisdicao)
+            .annotate(dia=TruncDate('data_criacao'))
+            .values(escopo, 'dia', 'categoria_id', 'status')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+        contagens.extend(
+            ContagemDiaria(
+                jurisdicao=jurisdicao, escopo_id=linha[escopo], dia=linha['dia'],
+                categoria_id=linha['categoria_id'], status=linha['status'], total=linha['total'],
+            )
+            for linha in linhas
+        )
+    ContagemDiaria.objects.bulk_create(contagens, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('denuncias', '0010_celula_mapa'),
+        ('gestao_publica', '0003_estatistica_jurisdicao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContagemDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jurisdicao', models.CharField(choices=[('MUNICIPAL', 'Municipal'), ('ESTADUAL', 'Estadual'), ('FEDERAL', 'Federal'), ('PRIVADO', 'Privado')], max_length=20)),
+                ('escopo_id', models.IntegerField()),
+                ('dia', models.DateField()),
+                ('status', models.CharField(choices=[('ABERTA', 'Aberta'), ('EM_ANALISE', 'Em Análise'), ('RESOLVIDA', 'Resolvida')], max_length=20)),
+                ('total', models.IntegerField(default=0)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='denuncias.categoria')),
+            ],
+            options={
+                'verbose_name': 'Contagem Diária',
+                'verbose_name_plural': 'Contagens Diárias',
+                'constraints': [models.UniqueConstraint(fields=('jurisdicao', 'escopo_id', 'dia', 'categoria', 'status'), name='contagem_diaria_unica')],
+            },
+        ),
+        migrations.RunPython(popular_contagens_diarias, migrations.RunPython.noop),
+    ]
@@ -4,7 +4,7 @@ from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
 from applications.localidades.models import Cidade, Estado
-from applications.denuncias.models import Denuncia
+from applications.denuncias.models import Categoria, Denuncia
 
 class OfficialEntity(models.Model):
     nome = models.CharField(max_length=200)
@@ -47,4 +47,89 @@ class OfficialResponse(models.Model):
         ordering = ['-data_resposta']
 
     def __str__(self):
-        return f'Resposta para "{self.denuncia.titulo}"'
\ No newline at end of file
+        return f'Resposta para "{self.denuncia.titulo}"'
+
+class CelulaHeatmap(models.Model):
+    """
+    Peso (denúncias + apoios) por célula da grade, por jurisdição, categoria e status.
+    `escopo_id` é a cidade (jurisdição MUNICIPAL) ou o estado (ESTADUAL) cujo gestor
+    enxerga a célula. Mantida incrementalmente (ver agregados.py).
+    """
+    resolucao = models.PositiveSmallIntegerField()
+    jurisdicao = models.CharField(max_length=20, choices=Denuncia.Jurisdicao.choices)
+    escopo_id = models.IntegerField()
+    categoria_id = models.IntegerField()
+    status = models.CharField(max_length=20, choices=Denuncia.Status.choices)
+    x = models.IntegerField()
+    y = models.IntegerField()
+    total = models.IntegerField(default=0)
+    peso = models.IntegerField(default=0)
+    soma_latitude = models.FloatField(default=0)
+    soma_longitude = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = _('Célula do Heatmap')
+        verbose_name_plural = _('Células do Heatmap')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['jurisdicao', 'escopo_id', 'resolucao', 'categoria_id', 'status', 'y', 'x'],
+                name='celula_heatmap_unica'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.jurisdicao} {self.escopo_id} r{self.resolucao} ({self.x}, {self.y}): {self.peso}'
+
+
+class EstatisticaJurisdicao(models.Model):
+    """
+    Número de denúncias por jurisdição (cidade ou estado, como em CelulaHeatmap),
+    status e categoria: o dashboard do gestor é uma única leitura desta tabela.
+    Mantida incrementalmente (ver agregados.py).
+    """
+    jurisdicao = models.CharField(max_length=20, choices=Denuncia.Jurisdicao.choices)
+    escopo_id = models.IntegerField()
+    status = models.CharField(max_length=20, choices=Denuncia.Status.choices)
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE, related_name='+')
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = _('Estatística da Jurisdição')
+        verbose_name_plural = _('Estatísticas das Jurisdições')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['jurisdicao', 'escopo_id', 'status', 'categoria'],
+                name='estatistica_jurisdicao_unica'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.jurisdicao} {self.escopo_id} {self.status} {self.categoria_id}: {self.total}'
+
+
+class ContagemDiaria(models.Model):
+    """
+    Denúncias criadas por dia (fuso local), por jurisdição, categoria e status. As
+    séries do dashboard (semana, mês...) são somas destas linhas. Mantida
+    incrementalmente (ver agregados.py) e conferida pelo comando consolidar_contagens_diarias.
+    """
+    jurisdicao = models.CharField(max_length=20, choices=Denuncia.Jurisdicao.choices)
+    escopo_id = models.IntegerField()
+    dia = models.DateField()
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=20, choices=Denuncia.Status.choices)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = _('Contagem Diária')
+        verbose_name_plural = _('Contagens Diárias')
+        constraints = [
+            # Também atende o intervalo de datas (jurisdição + escopo + faixa de dia)
+            models.UniqueConstraint(
+                fields=['jurisdicao', 'escopo_id', 'dia', 'categoria', 'status'],
+                name='contagem_diaria_unica'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.jurisdicao} {self.escopo_id} {self.dia}: {self.total}'
@@ -1,2 +1,317 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+from io import BytesIO, StringIO
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APITestCase
 
+from applications.core.models import User
+from applications.denuncias.models import ApoioDenuncia, Categoria, Denuncia
+from applications.denuncias.services import transferir_apoios
+from applications.denuncias.tests import MidiaTemporariaMixin
+from applications.localidades.models import Cidade, Estado
+from .jurisdicao import _chave, jurisdicao_do_gestor
+from .models import CelulaHeatmap, EstatisticaJurisdicao, OfficialEntity, OfficialResponse
+
+def create_dummy_image():
+    image_file = BytesIO()
+    image = Image.new('RGB', (1, 1), 'black')
+    image.save(image_file, 'png')
+    image_file.seek(0)
+    return SimpleUploadedFile('test.png', image_file.read(), content_type='image/png')
+
+class GestorAPITestCase(MidiaTemporariaMixin, APITestCase):
+    def setUp(self):
+        self.estado = Estado.objects.create(nome='Test Estado', uf='TE')
+        self.cidade = Cidade.objects.create(nome='Test Cidade', estado=self.estado)
+        self.outra_cidade = Cidade.objects.create(nome='Outra Cidade', estado=self.estado)
+        self.categoria = Categoria.objects.create(nome='Test Categoria')
+        self.gestor = User.objects.create_user(
+            username='gestor', email='gestor@example.com', password='password123',
+            first_name='Gestor', tipo_usuario='GESTOR_PUBLICO'
+        )
+        self.entidade = OfficialEntity.objects.create(nome='Prefeitura', cidade=self.cidade)
+        self.entidade.gestores.add(self.gestor)
+        self.client.login(username='gestor', password='password123')
+
+    def _criar(self, latitude, longitude, cidade=None, **extra):
+        dados = {
+            'titulo': 'Denúncia', 'descricao': 'Descrição.', 'autor_convidado': 'Convidado',
+            'categoria': self.categoria, 'cidade': cidade or self.cidade, 'estado': self.estado,
+            'latitude': latitude, 'longitude': longitude,
+            'jurisdicao': 'MUNICIPAL', 'foto': create_dummy_image(),
+        }
+        dados.update(extra)
+        return Denuncia.objects.create(**dados)
+
+    def _apoiar(self, denuncia, quantidade):
+        for i in range(quantidade):
+            apoiador = User.objects.create_user(
+                username=f'apoiador{denuncia.id}_{i}', email=f'apoiador{denuncia.id}_{i}@example.com',
+                password='password123', first_name='Apoiador'
+            )
+            ApoioDenuncia.objects.create(denuncia=denuncia, apoiador=apoiador)
+
+class HeatmapTests(GestorAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('gestao_publica:dashboard-heatmap')
+
+    def _pesos(self, params=None):
+        response = self.client.get(self.url, params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(celula['weight'] for celula in response.data)
+
+    def test_celulas_somam_denuncias_e_apoios(self):
+        primeira = self._criar('-23.55000000', '-46.63300000')
+        self._criar('-23.55010000', '-46.63310000')
+        self._criar('-22.90600000', '-43.17200000')
+        self._criar('-23.55000000', '-46.63300000', cidade=self.outra_cidade)
+        self._apoiar(primeira, 2)
+
+        self.assertEqual(self._pesos(), [1, 4])
+
+        primeira.apoios.first().delete()
+        primeira.status = Denuncia.Status.RESOLVIDA
+        primeira.save()
+        self.assertEqual(self._pesos({'status': 'ABERTA'}), [1, 1])
+        self.assertEqual(self._pesos(), [1, 3])
+
+        primeira.delete()
+        self.assertEqual(self._pesos(), [1, 1])
+
+    def test_transferencia_de_apoios_move_o_peso(self):
+        origem = self._criar('-23.55000000', '-46.63300000')
+        destino = self._criar('-22.90600000', '-43.17200000')
+        self._apoiar(origem, 3)
+        self.assertEqual(self._pesos(), [1, 4])
+
+        transferir_apoios(origem, destino)
+        self.assertEqual(self._pesos(), [1, 4])
+        origem.delete()
+        self.assertEqual(self._pesos(), [4])
+
+    def test_raster_de_tamanho_fixo(self):
+        self._criar('-23.55000000', '-46.63300000')
+        self._criar('-23.56000000', '-46.65000000')
+
+        response = self.client.get(self.url, {'resolucao': 14, 'formato': 'raster'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        raster = response.data
+        self.assertEqual(len(raster['valores']), raster['altura'])
+        self.assertEqual(sum(map(sum, raster['valores'])), 2)
+
+        response = self.client.get(self.url, {'resolucao': 30})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_custo_independe_do_numero_de_denuncias(self):
+        for _ in range(5):
+            self._criar('-23.55000000', '-46.63300000')
+        CelulaHeatmap.objects.all().delete()
+        self.assertEqual(self._pesos(), [])
+
+class DashboardEstatisticasTests(GestorAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('gestao_publica:dashboard')
+        self.outra_categoria = Categoria.objects.create(nome='Outra Categoria')
+        self.denuncias = [
+            self._criar('-23.55000000', '-46.63300000'),
+            self._criar('-23.55100000', '-46.63400000'),
+            self._criar('-23.55200000', '-46.63500000', categoria=self.outra_categoria),
+            self._criar('-23.55200000', '-46.63500000', cidade=self.outra_cidade),
+            self._criar('-23.55200000', '-46.63500000', jurisdicao='ESTADUAL'),
+        ]
+
+    def test_dashboard_em_uma_consulta(self):
+        self.denuncias[0].status = Denuncia.Status.RESOLVIDA
+        self.denuncias[0].save()
+        self.denuncias[1].delete()
+
+        with self.assertNumQueries(4):  # sessão, usuário, entidade do gestor e estatísticas
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'total_denuncias': 2,
+            'status_counts': {'RESOLVIDA': 1, 'ABERTA': 1},
+            'categoria_counts': {'Test Categoria': 1, 'Outra Categoria': 1},
+        })
+
+    def test_reconstrucao_recupera_as_estatisticas(self):
+        EstatisticaJurisdicao.objects.all().delete()
+        call_command('reconstruir_agregados', apenas=['gestao_publica.EstatisticaJurisdicao'], stdout=StringIO())
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['total_denuncias'], 3)
+        self.assertEqual(response.data['categoria_counts'], {'Test Categoria': 2, 'Outra Categoria': 1})
+
+class DenunciasPorPeriodoTests(GestorAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('gestao_publica:dashboard-denuncias-por-periodo')
+        self.hoje = timezone.localdate()
+
+    def test_serie_diaria_atualizada_na_criacao(self):
+        self._criar('-23.55000000', '-46.63300000')
+        self._criar('-23.55000000', '-46.63300000', status=Denuncia.Status.RESOLVIDA)
+        self._criar('-23.55000000', '-46.63300000', cidade=self.outra_cidade)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{'data': self.hoje.strftime('%Y-%m-%d'), 'total': 2}])
+
+    def test_consolidacao_e_preenchimento_de_lacunas(self):
+        antiga = self._criar('-23.55000000', '-46.63300000')
+        self._criar('-23.55000000', '-46.63300000')
+        # Alteração fora do ORM de instâncias: só a consolidação noturna enxerga
+        Denuncia.objects.filter(pk=antiga.pk).update(data_criacao=timezone.now() - timedelta(days=14))
+
+        saida = StringIO()
+        call_command('consolidar_contagens_diarias', dias=20, stdout=saida)
+        self.assertIn('2 contagem(ns) corrigida(s)', saida.getvalue())
+
+        inicio = self.hoje - timedelta(days=14)
+        response = self.client.get(self.url, {'periodo': 'semana', 'preencher': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        totais = [item['total'] for item in response.data]
+        self.assertEqual(sum(totais), 2)
+        self.assertEqual(totais[0], 1)
+        self.assertEqual(totais[-1], 1)
+        self.assertIn(0, totais)
+        self.assertEqual(response.data[0]['data'], (inicio - timedelta(days=inicio.weekday())).strftime('%Y-%m-%d'))
+
+        response = self.client.get(self.url, {'start_date': (self.hoje - timedelta(days=1)).isoformat()})
+        self.assertEqual(response.data, [{'data': self.hoje.strftime('%Y-%m-%d'), 'total': 1}])
+
+    def test_end_date_inclui_o_dia_inteiro(self):
+        self._criar('-23.55000000', '-46.63300000')
+        hoje = self.hoje.isoformat()
+        self.assertEqual(self.client.get(self.url, {'end_date': hoje}).data, [{'data': hoje, 'total': 1}])
+        self.assertEqual(self.client.get(self.url, {'end_date': f'{hoje}T00:00:00'}).data, [{'data': hoje, 'total': 1}])
+        ontem = (self.hoje - timedelta(days=1)).isoformat()
+        self.assertEqual(self.client.get(self.url, {'end_date': ontem}).data, [])
+
+class JurisdicaoGestorTests(GestorAPITestCase):
+    def _gestor(self):
+        return User.objects.get(pk=self.gestor.pk)  # Como numa nova requisição
+
+    def test_resolvida_uma_vez_por_requisicao_e_cacheada(self):
+        gestor = self._gestor()
+        with self.assertNumQueries(2):  # Versão e entidade
+            jurisdicao = jurisdicao_do_gestor(gestor)
+            jurisdicao_do_gestor(gestor)
+        self.assertEqual(jurisdicao.entidade_id, self.entidade.id)
+        self.assertEqual(jurisdicao.escopo_id, self.cidade.id)
+        outra_requisicao = self._gestor()
+        with self.assertNumQueries(1):  # Só a versão
+            self.assertEqual(jurisdicao_do_gestor(outra_requisicao), jurisdicao)
+
+    def test_alteracoes_nos_gestores_invalidam_o_cache(self):
+        jurisdicao_do_gestor(self._gestor())
+        self.entidade.gestores.remove(self.gestor)
+        self.assertIsNone(jurisdicao_do_gestor(self._gestor()))
+
+        estadual = OfficialEntity.objects.create(nome='Governo', estado=self.estado)
+        self.gestor.entidades_gerenciadas.add(estadual)
+        self.assertEqual(jurisdicao_do_gestor(self._gestor()).escopo_id, self.estado.id)
+
+        estadual.gestores.clear()
+        self.assertIsNone(jurisdicao_do_gestor(self._gestor()))
+
+    def test_gestor_removido_em_outro_worker_perde_a_jurisdicao(self):
+        jurisdicao_do_gestor(self._gestor())
+        chave = _chave(self.gestor.pk)
+        entrada = cache.get(chave)
+
+        self.entidade.gestores.remove(self.gestor)
+        # O cache local de outro worker ainda tem a entrada de antes da remoção
+        cache.set(chave, entrada)
+        self.assertIsNone(jurisdicao_do_gestor(self._gestor()))
+
+    def test_resposta_oficial_resolve_a_jurisdicao_uma_vez(self):
+        denuncia = self._criar('-23.55000000', '-46.63300000')
+        fora = self._criar('-23.55000000', '-46.63300000', cidade=self.outra_cidade)
+        url = reverse('gestao_publica:respostas-list')
+
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.post(url, {'denuncia': denuncia.id, 'texto': 'Equipe enviada.'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(OfficialResponse.objects.get().entidade, self.entidade)
+        entidades = [q for q in consultas.captured_queries if 'gestao_publica_officialentity' in q['sql']]
+        self.assertLessEqual(len(entidades), 1)
+
+        response = self.client.post(url, {'denuncia': fora.id, 'texto': 'Fora da jurisdição.'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class AcoesEmLoteTests(GestorAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.denuncias = [self._criar('-23.55000000', '-46.63300000') for _ in range(3)]
+        self.fora = self._criar('-23.55000000', '-46.63300000', cidade=self.outra_cidade)
+        self.url_status = reverse('denuncia-change-status-lote')
+        self.url_respostas = reverse('gestao_publica:respostas-lote')
+
+    def test_status_em_lote_com_resultado_por_id(self):
+        self._apoiar(self.denuncias[0], 2)
+        self.denuncias[2].status = Denuncia.Status.RESOLVIDA
+        self.denuncias[2].save()
+        antes = Denuncia.objects.get(pk=self.denuncias[0].pk).data_atualizacao
+        ids = [self.denuncias[0].id, self.denuncias[1].id, self.denuncias[2].id, self.fora.id, 999999]
+
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.post(self.url_status, {'ids': ids, 'status': 'RESOLVIDA'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['alteradas'], 2)
+        self.assertEqual([item['resultado'] for item in response.data['resultados']], [
+            'alterada', 'alterada', 'sem_alteracao', 'fora_da_jurisdicao', 'nao_encontrada',
+        ])
+        # Um UPDATE para o lote todo, não um por denúncia
+        updates = [q for q in consultas.captured_queries if q['sql'].startswith('UPDATE "denuncias_denuncia"')]
+        self.assertEqual(len(updates), 1)
+
+        self.assertEqual(Denuncia.objects.get(pk=self.fora.pk).status, Denuncia.Status.ABERTA)
+        self.assertGreater(Denuncia.objects.get(pk=self.denuncias[0].pk).data_atualizacao, antes)
+        response = self.client.get(reverse('gestao_publica:dashboard'))
+        self.assertEqual(response.data['status_counts'], {'RESOLVIDA': 3})
+
+    def test_status_em_lote_valida_a_entrada(self):
+        response = self.client.post(self.url_status, {'ids': [self.denuncias[0].id], 'status': 'XYZ'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url_status, {'ids': 'abc', 'status': 'RESOLVIDA'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cidadao_nao_altera_status(self):
+        User.objects.create_user(username='cidadao', email='cidadao@example.com', password='password123')
+        self.client.login(username='cidadao', password='password123')
+        url = reverse('denuncia-change-status', args=[self.denuncias[0].id])
+        response = self.client.post(url, {'status': 'RESOLVIDA'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(self.url_status, {'ids': [self.denuncias[0].id], 'status': 'RESOLVIDA'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Denuncia.objects.get(pk=self.denuncias[0].pk).status, Denuncia.Status.ABERTA)
+
+    def test_respostas_em_lote(self):
+        OfficialResponse.objects.create(denuncia=self.denuncias[2], entidade=self.entidade, texto='Já respondida.')
+        ids = [self.denuncias[0].id, self.denuncias[1].id, self.denuncias[2].id, self.fora.id, 999999]
+
+        with self.assertNumQueries(8):  # sessão, usuário, versão da jurisdição, entidade, leitura do lote e um INSERT entre savepoints
+            response = self.client.post(self.url_respostas, {'denuncias': ids, 'texto': 'Equipe enviada.'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['respondidas'], 2)
+        self.assertEqual([item['resultado'] for item in response.data['resultados']], [
+            'respondida', 'respondida', 'ja_respondida', 'fora_da_jurisdicao', 'nao_encontrada',
+        ])
+        self.assertEqual(
+            set(OfficialResponse.objects.filter(texto='Equipe enviada.').values_list('denuncia_id', 'entidade_id')),
+            {(self.denuncias[0].id, self.entidade.id), (self.denuncias[1].id, self.entidade.id)}
+        )
+
+        response = self.client.post(self.url_respostas, {'denuncias': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
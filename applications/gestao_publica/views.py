@@ -1,41 +1,68 @@
 from rest_framework import viewsets, permissions, mixins, serializers, status
+from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.db.models import Q, Count, F
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Count, Sum, DateField, Exists, OuterRef
 from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncQuarter, TruncYear
-from datetime import datetime
+from django.utils.cache import patch_vary_headers
+from datetime import date, datetime, timedelta
 
+from applications.denuncias.mapa import tamanho_celula
 from applications.denuncias.models import Denuncia
 from applications.denuncias.serializers import DenunciaSerializer
+from applications.denuncias.services import ids_do_lote
+from .jurisdicao import jurisdicao_do_gestor
+from .agregados import RESOLUCAO_MAXIMA, RESOLUCAO_MINIMA, RESOLUCAO_PADRAO
 from .serializers import OfficialResponseSerializer
-from .models import OfficialResponse
+from .models import CelulaHeatmap, ContagemDiaria, EstatisticaJurisdicao, OfficialResponse
+
+def _data_do_parametro(valor):
+    if not valor:
+        return None
+    return datetime.fromisoformat(valor).date()
+
+def _inicio_periodo(dia, periodo):
+    if periodo == 'semana':
+        return dia - timedelta(days=dia.weekday())
+    if periodo == 'mes':
+        return dia.replace(day=1)
+    if periodo == 'trimestre':
+        return dia.replace(month=(dia.month - 1) // 3 * 3 + 1, day=1)
+    if periodo == 'ano':
+        return dia.replace(month=1, day=1)
+    return dia
+
+def _periodos_entre(inicio, fim, periodo):
+    """Inícios de todos os períodos entre as duas datas, para preencher lacunas com zero."""
+    if inicio is None or fim is None:
+        return []
+    meses = {'mes': 1, 'trimestre': 3, 'ano': 12}.get(periodo)
+    atual, fim = _inicio_periodo(inicio, periodo), _inicio_periodo(fim, periodo)
+    periodos = []
+    while atual <= fim:
+        periodos.append(atual)
+        if meses:
+            indice_mes = atual.year * 12 + atual.month - 1 + meses
+            atual = date(indice_mes // 12, indice_mes % 12 + 1, 1)
+        else:
+            atual += timedelta(days=7 if periodo == 'semana' else 1)
+    return periodos
 
 class MinhasDenunciasViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = DenunciaSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
-        user = self.request.user
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ['Accept'])  # Variantes da foto (foto_thumb/foto_card)
+        return response
 
-        if not hasattr(user, 'tipo_usuario') or user.tipo_usuario != 'GESTOR_PUBLICO':
-            return Denuncia.objects.none()
-
-        entidade_gerenciada = user.entidades_gerenciadas.first()
-        if not entidade_gerenciada:
+    def get_queryset(self):
+        jurisdicao = jurisdicao_do_gestor(self.request.user)
+        if jurisdicao is None:
             return Denuncia.objects.none()
-
-        if entidade_gerenciada.cidade:
-            return Denuncia.objects.filter(
-                cidade=entidade_gerenciada.cidade,
-                jurisdicao=Denuncia.Jurisdicao.MUNICIPAL
-            )
-        elif entidade_gerenciada.estado:
-            return Denuncia.objects.filter(
-                estado=entidade_gerenciada.estado,
-                jurisdicao=Denuncia.Jurisdicao.ESTADUAL
-            )
-        
-        return Denuncia.objects.none()
+        return jurisdicao.denuncias()
 
 class CanRespondToDenuncia(permissions.BasePermission):
     message = "Você não tem permissão para responder a esta denúncia ou a denúncia não foi encontrada."
@@ -51,45 +78,80 @@ class CanRespondToDenuncia(permissions.BasePermission):
             self.message = "O ID da denúncia ('denuncia') é obrigatório no corpo da requisição."
             return False
 
-        if not hasattr(user, 'tipo_usuario') or user.tipo_usuario != 'GESTOR_PUBLICO':
+        jurisdicao = jurisdicao_do_gestor(user)
+        if jurisdicao is None:
             return False
 
-        entidade_gerenciada = user.entidades_gerenciadas.first()
-        if not entidade_gerenciada:
-            return False
-
-        denuncias_permitidas = Denuncia.objects.none()
-        if entidade_gerenciada.cidade:
-            denuncias_permitidas = Denuncia.objects.filter(
-                cidade=entidade_gerenciada.cidade,
-                jurisdicao=Denuncia.Jurisdicao.MUNICIPAL
-            )
-        elif entidade_gerenciada.estado:
-            denuncias_permitidas = Denuncia.objects.filter(
-                estado=entidade_gerenciada.estado,
-                jurisdicao=Denuncia.Jurisdicao.ESTADUAL
-            )
-
-        return denuncias_permitidas.filter(pk=denuncia_id).exists()
+        return jurisdicao.denuncias().filter(pk=denuncia_id).exists()
 
 class OfficialResponseViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin):
     serializer_class = OfficialResponseSerializer
     permission_classes = [permissions.IsAuthenticated, CanRespondToDenuncia]
 
     def get_queryset(self):
-        user = self.request.user
-        if hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'GESTOR_PUBLICO':
-            entidade = user.entidades_gerenciadas.first()
-            if entidade:
-                return OfficialResponse.objects.filter(entidade=entidade)
-        return OfficialResponse.objects.none()
+        jurisdicao = jurisdicao_do_gestor(self.request.user)
+        if jurisdicao is None:
+            return OfficialResponse.objects.none()
+        return OfficialResponse.objects.filter(entidade_id=jurisdicao.entidade_id)
 
     def perform_create(self, serializer):
-        entidade = self.request.user.entidades_gerenciadas.first()
-        
-        serializer.save(entidade=entidade)
+        # CanRespondToDenuncia já resolveu a jurisdição nesta requisição
+        serializer.save(entidade_id=jurisdicao_do_gestor(self.request.user).entidade_id)
+
+    @action(detail=False, methods=['post'])
+    def lote(self, request):
+        """
+        Mesma resposta oficial para várias denúncias da jurisdição, com um bulk_create.
+        POST /api/gestao/respostas/lote/  {"denuncias": [1, 2, ...], "texto": "..."}
+        """
+        jurisdicao = jurisdicao_do_gestor(request.user)
+        if jurisdicao is None:
+            return Response(
+                {'error': 'Apenas gestores públicos com entidade associada podem responder denúncias.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        texto = (request.data.get('texto') or '').strip()
+        if not texto:
+            return Response({'error': 'O campo "texto" é obrigatório.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids = ids_do_lote(request.data.get('denuncias'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Jurisdição e resposta existente numa única consulta
+        linhas = {
+            valores['id']: valores for valores in Denuncia.objects.filter(pk__in=ids).annotate(
+                respondida=Exists(OfficialResponse.objects.filter(denuncia=OuterRef('pk')))
+            ).order_by().values('id', 'jurisdicao', 'cidade_id', 'estado_id', 'respondida')
+        }
+        resultados = []
+        novas = []
+        for denuncia_id in ids:
+            valores = linhas.get(denuncia_id)
+            if valores is None:
+                resultado = 'nao_encontrada'
+            elif not jurisdicao.abrange(valores):
+                resultado = 'fora_da_jurisdicao'
+            elif valores['respondida']:
+                resultado = 'ja_respondida'
+            else:
+                resultado = 'respondida'
+                novas.append(OfficialResponse(denuncia_id=denuncia_id, entidade_id=jurisdicao.entidade_id, texto=texto))
+            resultados.append({'id': denuncia_id, 'resultado': resultado})
+
+        try:
+            with transaction.atomic():
+                OfficialResponse.objects.bulk_create(novas)
+        except IntegrityError:
+            # Outra requisição respondeu alguma delas entre a consulta e o INSERT
+            return Response(
+                {'error': 'Algumas denúncias foram respondidas enquanto o lote era processado. Tente novamente.'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response({'respondidas': len(novas), 'resultados': resultados})
 
 class DashboardView(APIView):
+    """Contagens lidas de EstatisticaJurisdicao (uma consulta), sem varrer as denúncias."""
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
@@ -101,22 +163,23 @@ class DashboardView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        denuncias_queryset = MinhasDenunciasViewSet().get_queryset(self.request)
+        jurisdicao = jurisdicao_do_gestor(user)
+        linhas = []
+        if jurisdicao:
+            linhas = EstatisticaJurisdicao.objects.filter(
+                jurisdicao=jurisdicao.jurisdicao, escopo_id=jurisdicao.escopo_id, total__gt=0
+            ).values_list('status', 'categoria__nome', 'total')
 
-        if not denuncias_queryset.exists():
-            return Response({
-                'total_denuncias': 0,
-                'status_counts': {},
-                'categoria_counts': {},
-            })
+        total_denuncias = 0
+        status_counts = {}
+        categoria_counts = {}
+        for status_denuncia, categoria_nome, total in linhas:
+            total_denuncias += total
+            status_counts[status_denuncia] = status_counts.get(status_denuncia, 0) + total
+            categoria_counts[categoria_nome] = categoria_counts.get(categoria_nome, 0) + total
 
-        total_denuncias = denuncias_queryset.count()
-
-        status_counts_query = denuncias_queryset.values('status').annotate(count=Count('status')).order_by('-count')
-        status_counts = {item['status']: item['count'] for item in status_counts_query}
-
-        categoria_counts_query = denuncias_queryset.values('categoria__nome').annotate(count=Count('categoria__nome')).order_by('-count')
-        categoria_counts = {item['categoria__nome']: item['count'] for item in categoria_counts_query}
+        status_counts = dict(sorted(status_counts.items(), key=lambda item: -item[1]))
+        categoria_counts = dict(sorted(categoria_counts.items(), key=lambda item: -item[1]))
 
         data = {
             'total_denuncias': total_denuncias,
@@ -127,6 +190,7 @@ class DashboardView(APIView):
         return Response(data)
 
 class DenunciasPorPeriodoView(APIView):
+    """Série lida de ContagemDiaria: semana, mês etc. são somas das linhas diárias."""
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
@@ -153,37 +217,62 @@ class DenunciasPorPeriodoView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        base_queryset = MinhasDenunciasViewSet().get_queryset(self.request)
+        try:
+            start_date = _data_do_parametro(request.query_params.get('start_date'))
+            end_date = _data_do_parametro(request.query_params.get('end_date'))
+        except ValueError:
+            return Response(
+                {'error': '"start_date" e "end_date" devem estar no formato ISO (AAAA-MM-DD).'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        jurisdicao = jurisdicao_do_gestor(user)
+        if not jurisdicao:
+            return Response([])
 
-        start_date_str = request.query_params.get('start_date')
-        end_date_str = request.query_params.get('end_date')
-        if start_date_str:
-            base_queryset = base_queryset.filter(data_criacao__gte=datetime.fromisoformat(start_date_str))
-        if end_date_str:
-            base_queryset = base_queryset.filter(data_criacao__lte=datetime.fromisoformat(end_date_str))
+        base_queryset = ContagemDiaria.objects.filter(jurisdicao=jurisdicao.jurisdicao, escopo_id=jurisdicao.escopo_id)
+        if start_date:
+            base_queryset = base_queryset.filter(dia__gte=start_date)
+        if end_date:
+            # O dia de end_date entra inteiro (antes, data_criacao <= meia-noite o excluía; ver rotas.md)
+            base_queryset = base_queryset.filter(dia__lte=end_date)
 
-        trunc_function = periodo_mapping[periodo]('data_criacao')
+        trunc_function = periodo_mapping[periodo]('dia', output_field=DateField())
 
         queryset = (
             base_queryset
             .annotate(periodo_agrupado=trunc_function)
             .values('periodo_agrupado')
-            .annotate(total=Count('id'))
+            .annotate(total=Sum('total'))
+            .filter(total__gt=0)
             .order_by('periodo_agrupado')
         )
+        totais = {item['periodo_agrupado']: item['total'] for item in queryset}
+
+        if request.query_params.get('preencher', '').lower() in ('1', 'true'):
+            periodos = _periodos_entre(start_date or min(totais, default=None), end_date or max(totais, default=None), periodo)
+        else:
+            periodos = list(totais)
 
         data = [
             {
-                "data": item['periodo_agrupado'].strftime('%Y-%m-%d'), 
-                "total": item['total']
-            } 
-            for item in queryset
+                "data": inicio_periodo.strftime('%Y-%m-%d'),
+                "total": totais.get(inicio_periodo, 0)
+            }
+            for inicio_periodo in periodos
         ]
         return Response(data)
 
 class HeatmapView(APIView):
+    """
+    Heatmap lido da grade pré-agregada (CelulaHeatmap): o custo depende do número de
+    células da jurisdição na resolução pedida, não do número de denúncias.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
+    FORMATOS = ('celulas', 'raster')
+    MAX_CELULAS_RASTER = 256 * 256
+
     def get(self, request, *args, **kwargs):
         user = self.request.user
 
@@ -193,13 +282,107 @@ class HeatmapView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        base_queryset = MinhasDenunciasViewSet().get_queryset(self.request)
+        try:
+            resolucao = int(request.query_params.get('resolucao', RESOLUCAO_PADRAO))
+            categoria_id = request.query_params.get('categoria')
+            categoria_id = int(categoria_id) if categoria_id else None
+        except ValueError:
+            return Response(
+                {'error': 'Os parâmetros "resolucao" e "categoria" devem ser números inteiros.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not RESOLUCAO_MINIMA <= resolucao <= RESOLUCAO_MAXIMA:
+            return Response(
+                {'error': f'"resolucao" deve estar entre {RESOLUCAO_MINIMA} e {RESOLUCAO_MAXIMA}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        heatmap_data = (
-            base_queryset
-            .annotate(apoios_count=Count('apoios'))
-            .annotate(weight=F('apoios_count') + 1)
-            .values('latitude', 'longitude', 'weight')
-        )
+        formato = request.query_params.get('formato', 'celulas').lower()
+        if formato not in self.FORMATOS:
+            return Response(
+                {'error': f'Valor inválido para "formato". Opções: {list(self.FORMATOS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        status_lista = [valor for valor in request.query_params.get('status', '').split(',') if valor]
+        if any(valor not in Denuncia.Status.values for valor in status_lista):
+            return Response(
+                {'error': f'Valor inválido para "status". Opções: {list(Denuncia.Status.values)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        celulas = self._celulas_da_jurisdicao(user)
+        if categoria_id is not None:
+            celulas = celulas.filter(categoria_id=categoria_id)
+        if status_lista:
+            celulas = celulas.filter(status__in=status_lista)
 
-        return Response(list(heatmap_data))
\ No newline at end of file
+        if formato == 'raster':
+            return Response(self._raster(celulas, resolucao))
+
+        return Response([
+            {
+                'latitude': round(celula['soma_lat'] / celula['total_celula'], 6),
+                'longitude': round(celula['soma_lon'] / celula['total_celula'], 6),
+                'weight': celula['peso_celula'],
+            }
+            for celula in self._agrupar(celulas, resolucao)
+        ])
+
+    @staticmethod
+    def _celulas_da_jurisdicao(user):
+        jurisdicao = jurisdicao_do_gestor(user)
+        if not jurisdicao:
+            return CelulaHeatmap.objects.none()
+        return CelulaHeatmap.objects.filter(jurisdicao=jurisdicao.jurisdicao, escopo_id=jurisdicao.escopo_id)
+
+    @staticmethod
+    def _agrupar(celulas, resolucao):
+        agrupadas = celulas.filter(resolucao=resolucao, total__gt=0).values('x', 'y').annotate(
+            total_celula=Sum('total'),
+            peso_celula=Sum('peso'),
+            soma_lat=Sum('soma_latitude'),
+            soma_lon=Sum('soma_longitude'),
+        ).order_by()
+        return [celula for celula in agrupadas if celula['total_celula'] > 0]
+
+    def _raster(self, celulas, resolucao):
+        """
+        Matriz de pesos cobrindo a extensão ocupada da jurisdição, linhas de norte a
+        sul. Se a matriz passar de MAX_CELULAS_RASTER, a resolução é reduzida.
+        """
+        agrupadas = self._agrupar(celulas, resolucao)
+        if not agrupadas:
+            return {'resolucao': resolucao, 'tamanho_celula': tamanho_celula(resolucao),
+                    'origem': None, 'largura': 0, 'altura': 0, 'valores': []}
+
+        x0 = min(celula['x'] for celula in agrupadas)
+        x1 = max(celula['x'] for celula in agrupadas)
+        y0 = min(celula['y'] for celula in agrupadas)
+        y1 = max(celula['y'] for celula in agrupadas)
+
+        reducao = 0
+        while (
+            ((x1 >> reducao) - (x0 >> reducao) + 1) * ((y1 >> reducao) - (y0 >> reducao) + 1) > self.MAX_CELULAS_RASTER
+            and resolucao - reducao > RESOLUCAO_MINIMA
+        ):
+            reducao += 1
+        if reducao:
+            resolucao -= reducao
+            x0, x1, y0, y1 = x0 >> reducao, x1 >> reducao, y0 >> reducao, y1 >> reducao
+            agrupadas = self._agrupar(celulas, resolucao)
+
+        largura, altura = x1 - x0 + 1, y1 - y0 + 1
+        valores = [[0] * largura for _ in range(altura)]
+        for celula in agrupadas:
+            valores[y1 - celula['y']][celula['x'] - x0] = celula['peso_celula']
+
+        tamanho = tamanho_celula(resolucao)
+        return {
+            'resolucao': resolucao,
+            'tamanho_celula': tamanho,
+            'origem': {'latitude': (y1 + 1) * tamanho - 90.0, 'longitude': x0 * tamanho - 180.0},
+            'largura': largura,
+            'altura': altura,
+            'valores': valores,
+        }
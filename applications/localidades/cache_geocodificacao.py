@@ -0,0 +1,193 @@
+"""
+Cache das consultas ao Nominatim por coordenada quantizada.
+
+As coordenadas são arredondadas para células de GRAUS (~75 m): dez pessoas
+denunciando o mesmo buraco caem na mesma chave e geram uma única chamada externa.
+Um LRU em memória (por worker) fica na frente da tabela GeocodificacaoCache,
+compartilhada entre os workers.
+
+Cada entrada vale por NOMINATIM_CACHE_TTL segundos (NOMINATIM_CACHE_TTL_NEGATIVO
+quando o Nominatim não encontrou endereço). Depois disso, por mais
+NOMINATIM_CACHE_OBSOLETO segundos, ela ainda é servida enquanto uma revalidação
+roda em segundo plano (stale-while-revalidate).
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+from math import floor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from applications.core.medicao import contar_cache
+from applications.core.metricas import GEOCODIFICACAO_CACHE, incrementar
+from .models import GeocodificacaoCache
+
+GRAUS = 0.0007  # ~78 m de latitude
+
+Entrada = namedtuple('Entrada', ['dados', 'expira_em', 'obsoleta_em'])
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+_revalidando = set()
+
+_contadores = dict.fromkeys(
+    ('acertos_memoria', 'acertos_banco', 'obsoletos', 'faltas', 'negativos', 'revalidacoes', 'erros_revalidacao'), 0
+)
+_contadores_lock = threading.Lock()
+
+
+def _contar(nome):
+    with _contadores_lock:
+        _contadores[nome] += 1
+    incrementar(GEOCODIFICACAO_CACHE, resultado=nome)
+    if nome in ('acertos_memoria', 'acertos_banco', 'obsoletos', 'faltas'):
+        contar_cache(nome != 'faltas')
+
+
+def estatisticas():
+    with _contadores_lock:
+        dados = dict(_contadores)
+    consultas = dados['acertos_memoria'] + dados['acertos_banco'] + dados['obsoletos'] + dados['faltas']
+    dados['taxa_acerto'] = round(1 - dados['faltas'] / consultas, 4) if consultas else None
+    dados['tamanho_memoria'] = len(_lru)
+    dados['capacidade_memoria'] = settings.NOMINATIM_CACHE_TAMANHO_MEMORIA
+    return dados
+
+
+def limpar_memoria():
+    with _lru_lock:
+        _lru.clear()
+    with _contadores_lock:
+        for nome in _contadores:
+            _contadores[nome] = 0
+
+
+def quantizar(latitude, longitude):
+    return int(floor(float(latitude) / GRAUS)), int(floor(float(longitude) / GRAUS))
+
+
+def _da_memoria(chave):
+    with _lru_lock:
+        entrada = _lru.get(chave)
+        if entrada is not None:
+            _lru.move_to_end(chave)
+        return entrada
+
+
+def _para_memoria(chave, entrada):
+    with _lru_lock:
+        _lru[chave] = entrada
+        _lru.move_to_end(chave)
+        while len(_lru) > settings.NOMINATIM_CACHE_TAMANHO_MEMORIA:
+            _lru.popitem(last=False)
+
+
+def _do_banco(chave):
+    registro = GeocodificacaoCache.objects.filter(lat_idx=chave[0], lon_idx=chave[1]).only(
+        'resposta', 'expira_em'
+    ).first()
+    if registro is None:
+        return None
+    return Entrada(
+        registro.resposta,
+        registro.expira_em,
+        registro.expira_em + timedelta(seconds=settings.NOMINATIM_CACHE_OBSOLETO),
+    )
+
+
+def _guardar(chave, dados):
+    encontrado = bool(dados.get('address'))
+    if not encontrado:
+        _contar('negativos')
+    ttl = settings.NOMINATIM_CACHE_TTL if encontrado else settings.NOMINATIM_CACHE_TTL_NEGATIVO
+    agora = timezone.now()
+    entrada = Entrada(
+        dados,
+        agora + timedelta(seconds=ttl),
+        agora + timedelta(seconds=ttl + settings.NOMINATIM_CACHE_OBSOLETO),
+    )
+    GeocodificacaoCache.objects.update_or_create(
+        lat_idx=chave[0], lon_idx=chave[1],
+        defaults={'resposta': dados, 'encontrado': encontrado, 'atualizado_em': agora, 'expira_em': entrada.expira_em},
+    )
+    _para_memoria(chave, entrada)
+    return entrada
+
+
+def _revalidar(chave, buscar_remoto):
+    try:
+        _guardar(chave, buscar_remoto())
+        _contar('revalidacoes')
+    except Exception:
+        _contar('erros_revalidacao')  # Segue servindo a entrada obsoleta
+    finally:
+        with _lru_lock:
+            _revalidando.discard(chave)
+
+
+def _revalidar_em_segundo_plano(chave, buscar_remoto):
+    with _lru_lock:
+        if chave in _revalidando:
+            return
+        _revalidando.add(chave)
+
+    if not settings.NOMINATIM_CACHE_REVALIDAR_EM_SEGUNDO_PLANO:
+        _revalidar(chave, buscar_remoto)
+        return
+
+    def executar():
+        close_old_connections()
+        try:
+            _revalidar(chave, buscar_remoto)
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=executar, name='revalidacao-nominatim', daemon=True).start()
+
+
+def guardada(latitude, longitude):
+    """Resposta já guardada para a célula (mesmo vencida, até ficar obsoleta), sem chamada externa; ou None."""
+    chave = quantizar(latitude, longitude)
+    entrada = _da_memoria(chave) or _do_banco(chave)
+    if entrada is None or timezone.now() >= entrada.obsoleta_em:
+        return None
+    return entrada.dados
+
+
+def consultar(latitude, longitude, buscar_remoto):
+    """
+    Resposta do Nominatim para a célula de (latitude, longitude). `buscar_remoto()`
+    faz a chamada externa e só é usada em faltas e revalidações; seus erros são
+    propagados, a não ser que exista uma entrada vencida para servir no lugar.
+    """
+    chave = quantizar(latitude, longitude)
+    agora = timezone.now()
+
+    entrada = _da_memoria(chave)
+    contador = 'acertos_memoria'
+    if entrada is None or agora >= entrada.expira_em:
+        # Outro worker pode já ter renovado a entrada
+        do_banco = _do_banco(chave)
+        if do_banco is not None:
+            entrada = do_banco
+            contador = 'acertos_banco'
+            _para_memoria(chave, entrada)
+
+    if entrada is not None and agora < entrada.expira_em:
+        _contar(contador)
+        return entrada.dados
+
+    if entrada is not None and agora < entrada.obsoleta_em:
+        _contar('obsoletos')
+        _revalidar_em_segundo_plano(chave, buscar_remoto)
+        return entrada.dados
+
+    _contar('faltas')
+    try:
+        return _guardar(chave, buscar_remoto()).dados
+    except Exception:
+        if entrada is not None:
+            return entrada.dados
+        raise
@@ -0,0 +1,168 @@
+"""
+Geocodificação reversa offline: (latitude, longitude) -> Cidade/Estado, sem rede.
+
+O índice é um arquivo .npz gerado pelo comando construir_geocodificador a partir
+de uma tabela de municípios (centroides), já com os IDs de Cidade e Estado do
+banco. Os municípios ficam ordenados pela chave de uma grade de CELULA_GRAUS; uma
+consulta lê apenas as células vizinhas e escolhe o centroide mais próximo com um
+haversine vetorizado, em dezenas de microssegundos.
+
+Centroides não são fronteiras: perto da divisa entre municípios o mais próximo
+pode ser o vizinho. Por isso só há resposta quando ela é clara: o ponto está a até
+GEOCODIFICADOR_DISTANCIA_SEGURA da sede mais próxima, ou a segunda sede está pelo
+menos GEOCODIFICADOR_MARGEM vezes mais longe que a primeira (e nunca além de
+GEOCODIFICADOR_DISTANCIA_MAXIMA). Nos demais casos o chamador recorre ao Nominatim.
+"""
+import os
+import threading
+from math import ceil, cos, floor, inf, radians
+
+import numpy as np
+from django.conf import settings
+
+from applications.denuncias.geo import METROS_POR_GRAU_LAT
+from applications.denuncias.services import haversine_distance_vetorizada
+
+CELULA_GRAUS = 0.25  # ~28 km
+_COLUNAS = int(round(360 / CELULA_GRAUS)) + 1
+
+CAMPOS = ('latitudes', 'longitudes', 'cidade_ids', 'estado_ids', 'cidades', 'estados', 'ufs')
+
+
+def _chave(lat_idx, lon_idx):
+    return lat_idx * _COLUNAS + lon_idx
+
+
+def _indices(latitude, longitude):
+    return int(floor((latitude + 90.0) / CELULA_GRAUS)), int(floor((longitude + 180.0) / CELULA_GRAUS))
+
+
+def salvar_indice(caminho, latitudes, longitudes, cidade_ids, estado_ids, cidades, estados, ufs):
+    """Grava o índice ordenado pela chave da grade."""
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    lat_idx = np.floor((latitudes + 90.0) / CELULA_GRAUS).astype(np.int64)
+    lon_idx = np.floor((longitudes + 180.0) / CELULA_GRAUS).astype(np.int64)
+    ordem = np.argsort(_chave(lat_idx, lon_idx), kind='stable')
+
+    pasta = os.path.dirname(os.fspath(caminho))
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    with open(caminho, 'wb') as arquivo:
+        np.savez_compressed(
+            arquivo,
+            latitudes=latitudes[ordem],
+            longitudes=longitudes[ordem],
+            cidade_ids=np.asarray(cidade_ids, dtype=np.int64)[ordem],
+            estado_ids=np.asarray(estado_ids, dtype=np.int64)[ordem],
+            cidades=np.asarray(cidades, dtype=str)[ordem],
+            estados=np.asarray(estados, dtype=str)[ordem],
+            ufs=np.asarray(ufs, dtype=str)[ordem],
+        )
+
+
+class Geocodificador:
+
+    def __init__(self, dados):
+        for campo in CAMPOS:
+            setattr(self, campo, dados[campo])
+        lat_idx = np.floor((self.latitudes + 90.0) / CELULA_GRAUS).astype(np.int64)
+        lon_idx = np.floor((self.longitudes + 180.0) / CELULA_GRAUS).astype(np.int64)
+        chaves, inicios, contagens = np.unique(_chave(lat_idx, lon_idx), return_index=True, return_counts=True)
+        self._celulas = {
+            int(chave): (int(inicio), int(inicio + contagem))
+            for chave, inicio, contagem in zip(chaves, inicios, contagens)
+        }
+
+    @classmethod
+    def carregar(cls, caminho):
+        with np.load(caminho, allow_pickle=False) as dados:
+            return cls({campo: dados[campo] for campo in CAMPOS})
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def _dois_mais_proximos(self, latitude, longitude, aneis_lat, aneis_lon):
+        """(posição do mais próximo, distância dele, distância do segundo) na janela de células."""
+        lat_idx, lon_idx = _indices(latitude, longitude)
+        fatias = [
+            self._celulas[chave]
+            for linha in range(lat_idx - aneis_lat, lat_idx + aneis_lat + 1)
+            for coluna in range(lon_idx - aneis_lon, lon_idx + aneis_lon + 1)
+            if (chave := _chave(linha, coluna)) in self._celulas
+        ]
+        if not fatias:
+            return None, None, inf
+        posicoes = np.concatenate([np.arange(inicio, fim) for inicio, fim in fatias])
+        distancias = haversine_distance_vetorizada(
+            latitude, longitude, self.latitudes[posicoes], self.longitudes[posicoes]
+        )
+        if len(distancias) == 1:
+            return int(posicoes[0]), float(distancias[0]), inf
+        primeiro, segundo = sorted(np.argpartition(distancias, 1)[:2], key=lambda indice: distancias[indice])
+        return int(posicoes[primeiro]), float(distancias[primeiro]), float(distancias[segundo])
+
+    def localizar(self, latitude, longitude, distancia_maxima=None):
+        """
+        Município cujo centroide é o mais próximo, ou None se nenhum estiver a até
+        distancia_maxima metros ou se a sede vizinha estiver perto demais para decidir.
+        """
+        if distancia_maxima is None:
+            distancia_maxima = settings.GEOCODIFICADOR_DISTANCIA_MAXIMA
+        margem = settings.GEOCODIFICADOR_MARGEM
+
+        # As 3x3 células vizinhas cobrem com certeza uma célula de distância em
+        # qualquer direção; se a decisão depende de algo além disso, amplia a janela.
+        fator_lon = max(cos(radians(min(abs(latitude), 89.0))), 0.01)
+        alcance = CELULA_GRAUS * METROS_POR_GRAU_LAT * fator_lon
+        posicao, distancia, segunda = self._dois_mais_proximos(latitude, longitude, 1, 1)
+        if posicao is None or distancia > alcance or min(segunda, alcance) < distancia * margem <= segunda:
+            aneis_lat = ceil(distancia_maxima * margem / (CELULA_GRAUS * METROS_POR_GRAU_LAT))
+            aneis_lon = ceil(aneis_lat / fator_lon)
+            alcance = distancia_maxima * margem
+            posicao, distancia, segunda = self._dois_mais_proximos(latitude, longitude, aneis_lat, aneis_lon)
+
+        if posicao is None or distancia > distancia_maxima:
+            return None
+        # Fora da janela pode haver uma sede mais perto que `segunda`, mas não mais perto que o alcance
+        segunda = min(segunda, alcance)
+        if distancia > settings.GEOCODIFICADOR_DISTANCIA_SEGURA and segunda < distancia * margem:
+            return None
+        return {
+            'cidade_id': int(self.cidade_ids[posicao]),
+            'cidade': str(self.cidades[posicao]),
+            'estado_id': int(self.estado_ids[posicao]),
+            'estado': str(self.estados[posicao]),
+            'uf': str(self.ufs[posicao]),
+            'distancia': round(distancia, 1),
+        }
+
+
+_geocodificador = None
+_carregado = False
+_lock = threading.Lock()
+
+
+def geocodificador():
+    """Índice do processo, carregado na primeira chamada; None se o arquivo não existir."""
+    global _geocodificador, _carregado
+    if not _carregado:
+        with _lock:
+            if not _carregado:
+                caminho = settings.GEOCODIFICADOR_ARQUIVO
+                _geocodificador = Geocodificador.carregar(caminho) if os.path.exists(caminho) else None
+                _carregado = True
+    return _geocodificador
+
+
+def recarregar():
+    global _carregado
+    with _lock:
+        _carregado = False
+
+
+def localizar(latitude, longitude):
+    indice = geocodificador()
+    if indice is None:
+        return None
+    return indice.localizar(latitude, longitude)
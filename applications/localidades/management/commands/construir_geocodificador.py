@@ -0,0 +1,81 @@
+import csv
+import unicodedata
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from applications.localidades.geocodificador import recarregar, salvar_indice
+from applications.localidades.models import Estado, Cidade
+
+# Códigos de UF do IBGE, usados por tabelas de municípios que não trazem a sigla
+CODIGOS_UF = {
+    '11': 'RO', '12': 'AC', '13': 'AM', '14': 'RR', '15': 'PA', '16': 'AP', '17': 'TO',
+    '21': 'MA', '22': 'PI', '23': 'CE', '24': 'RN', '25': 'PB', '26': 'PE', '27': 'AL',
+    '28': 'SE', '29': 'BA', '31': 'MG', '32': 'ES', '33': 'RJ', '35': 'SP', '41': 'PR',
+    '42': 'SC', '43': 'RS', '50': 'MS', '51': 'MT', '52': 'GO', '53': 'DF',
+}
+
+
+def normalizar(nome):
+    sem_acentos = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(sem_acentos.lower().replace('-', ' ').replace("'", ' ').split())
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera o índice de geocodificação reversa offline a partir de um CSV de municípios '
+        'com as colunas nome, latitude, longitude e uf (ou codigo_uf do IBGE).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='CSV com os centroides dos municípios.')
+        parser.add_argument(
+            '--saida',
+            default=None,
+            help='Arquivo .npz gerado (padrão: settings.GEOCODIFICADOR_ARQUIVO).',
+        )
+
+    def handle(self, *args, **options):
+        saida = options['saida'] or settings.GEOCODIFICADOR_ARQUIVO
+
+        estados = {estado.uf: estado for estado in Estado.objects.all()}
+        cidades = {
+            (estado_id, normalizar(nome)): cidade_id
+            for cidade_id, nome, estado_id in Cidade.objects.values_list('id', 'nome', 'estado_id')
+        }
+        if not cidades:
+            raise CommandError('Nenhuma cidade no banco. Execute "populate_cities" primeiro.')
+
+        colunas = {nome: [] for nome in ('latitudes', 'longitudes', 'cidade_ids', 'estado_ids', 'cidades', 'estados', 'ufs')}
+        ignoradas = []
+        try:
+            with open(options['arquivo'], newline='', encoding='utf-8-sig') as arquivo:
+                for linha in csv.DictReader(arquivo):
+                    uf = (linha.get('uf') or CODIGOS_UF.get(str(linha.get('codigo_uf', '')).strip(), '')).upper()
+                    estado = estados.get(uf)
+                    cidade_id = cidades.get((estado.id, normalizar(linha['nome']))) if estado else None
+                    if cidade_id is None:
+                        ignoradas.append(f'{linha["nome"]}/{uf}')
+                        continue
+                    colunas['latitudes'].append(float(linha['latitude']))
+                    colunas['longitudes'].append(float(linha['longitude']))
+                    colunas['cidade_ids'].append(cidade_id)
+                    colunas['estado_ids'].append(estado.id)
+                    colunas['cidades'].append(linha['nome'])
+                    colunas['estados'].append(estado.nome)
+                    colunas['ufs'].append(uf)
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(f'Não foi possível ler "{options["arquivo"]}": {e}')
+
+        if not colunas['cidade_ids']:
+            raise CommandError('Nenhum município do arquivo corresponde às cidades do banco.')
+
+        salvar_indice(saida, **colunas)
+        recarregar()
+
+        if ignoradas:
+            self.stdout.write(self.style.WARNING(
+                f'{len(ignoradas)} município(s) sem cidade correspondente no banco: {", ".join(ignoradas[:10])}'
+                + ('...' if len(ignoradas) > 10 else '')
+            ))
+        self.stdout.write(self.style.SUCCESS(f'Índice com {len(colunas["cidade_ids"])} município(s) salvo em {saida}.'))
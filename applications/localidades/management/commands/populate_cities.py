@@ -1,34 +1,121 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from applications.core.cliente_http import cliente
+from applications.core.models import VersaoDados
 from applications.localidades.models import Estado, Cidade
 
+URL_MUNICIPIOS = 'https://servicodados.ibge.gov.br/api/v1/localidades/estados/{uf}/municipios'
+
+
+def uf_do_municipio(municipio):
+    """Sigla da UF num município do formato da API de localidades do IBGE."""
+    for caminho in (('microrregiao', 'mesorregiao', 'UF'), ('regiao-imediata', 'regiao-intermediaria', 'UF')):
+        atual = municipio
+        for chave in caminho:
+            atual = (atual or {}).get(chave)
+        if atual and atual.get('sigla'):
+            return atual['sigla']
+    return None
+
+
+def ler_snapshot(caminho):
+    """
+    Lê um snapshot do IBGE: um objeto {"UF": [municípios]} (como o gerado por
+    --salvar) ou a lista completa de /api/v1/localidades/municipios.
+    """
+    with open(caminho, encoding='utf-8') as arquivo:
+        dados = json.load(arquivo)
+    if isinstance(dados, dict):
+        return {uf.upper(): municipios for uf, municipios in dados.items()}
+
+    por_uf = {}
+    for municipio in dados:
+        uf = uf_do_municipio(municipio)
+        if uf:
+            por_uf.setdefault(uf, []).append(municipio)
+    return por_uf
+
+
 class Command(BaseCommand):
-    help = 'Popula o banco de dados com as cidades do Brasil a partir da API do IBGE.'
+    help = 'Popula o banco de dados com as cidades do Brasil a partir da API do IBGE (ou de um snapshot local).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from-file',
+            dest='arquivo',
+            help='Snapshot JSON do IBGE; dispensa acesso à rede.',
+        )
+        parser.add_argument(
+            '--salvar',
+            help='Grava os municípios buscados num snapshot JSON, para uso posterior com --from-file.',
+        )
+        parser.add_argument('--threads', type=int, default=8, help='Requisições simultâneas ao IBGE.')
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Iniciando a população de cidades...'))
+        inicio = time.perf_counter()
 
-        estados = Estado.objects.all()
-        if not estados.exists():
+        estados = list(Estado.objects.all())
+        if not estados:
             self.stdout.write(self.style.ERROR('Nenhum estado encontrado no banco de dados. Execute a migração para popular os estados primeiro.'))
             return
 
-        for estado in estados:
-            self.stdout.write(f'Buscando cidades para o estado de {estado.nome}...')
+        # Fase 1: busca (arquivo local ou IBGE em paralelo)
+        inicio_fase = time.perf_counter()
+        if options['arquivo']:
             try:
-                response = requests.get(f'https://servicodados.ibge.gov.br/api/v1/localidades/estados/{estado.uf}/municipios')
-                response.raise_for_status()
-                cidades_data = response.json()
-
-                for cidade_data in cidades_data:
-                    nome_cidade = cidade_data['nome']
-                    if not Cidade.objects.filter(nome=nome_cidade, estado=estado).exists():
-                        Cidade.objects.create(nome=nome_cidade, estado=estado)
-                        self.stdout.write(self.style.SUCCESS(f'  - Cidade "{nome_cidade}" adicionada.'))
-                    else:
-                        self.stdout.write(self.style.WARNING(f'  - Cidade "{nome_cidade}" já existe.'))
-
-            except requests.exceptions.RequestException as e:
-                self.stdout.write(self.style.ERROR(f'Erro ao buscar cidades para {estado.nome}: {e}'))
-
-        self.stdout.write(self.style.SUCCESS('População de cidades concluída!'))
+                municipios_por_uf = ler_snapshot(options['arquivo'])
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Não foi possível ler "{options["arquivo"]}": {e}')
+        else:
+            municipios_por_uf = self._buscar_no_ibge(estados, options['threads'])
+        self.stdout.write(f'Busca: {len(municipios_por_uf)} estado(s) em {time.perf_counter() - inicio_fase:.2f}s.')
+
+        if options['salvar']:
+            with open(options['salvar'], 'w', encoding='utf-8') as arquivo:
+                json.dump(municipios_por_uf, arquivo, ensure_ascii=False)
+            self.stdout.write(f'Snapshot salvo em {options["salvar"]}.')
+
+        # Fase 2: gravação, uma transação por estado
+        inicio_fase = time.perf_counter()
+        total_novas = 0
+        for estado in estados:
+            municipios = municipios_por_uf.get(estado.uf)
+            if municipios is None:
+                continue
+            nomes = {municipio['nome'] if isinstance(municipio, dict) else municipio for municipio in municipios}
+            with transaction.atomic():
+                existentes = set(Cidade.objects.filter(estado=estado).values_list('nome', flat=True))
+                novas = [Cidade(nome=nome, estado=estado) for nome in sorted(nomes - existentes)]
+                Cidade.objects.bulk_create(novas, batch_size=500, ignore_conflicts=True)
+            total_novas += len(novas)
+            self.stdout.write(f'  - {estado.uf}: {len(novas)} cidade(s) adicionada(s), {len(nomes) - len(novas)} já existente(s).')
+        self.stdout.write(f'Gravação: {total_novas} cidade(s) nova(s) em {time.perf_counter() - inicio_fase:.2f}s.')
+
+        # Os caches de /api/localidades/cidades/ passam a usar a nova versão
+        VersaoDados.incrementar('cidades')
+        self.stdout.write(self.style.SUCCESS(
+            f'População de cidades concluída em {time.perf_counter() - inicio:.2f}s!'
+        ))
+
+    def _buscar_no_ibge(self, estados, threads):
+        def buscar(uf):
+            response = cliente('ibge').get(URL_MUNICIPIOS.format(uf=uf))
+            response.raise_for_status()
+            return [municipio['nome'] for municipio in response.json()]
+
+        municipios_por_uf = {}
+        with ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+            futuros = {estado.uf: executor.submit(buscar, estado.uf) for estado in estados}
+            for estado in estados:
+                try:
+                    municipios_por_uf[estado.uf] = futuros[estado.uf].result()
+                except requests.exceptions.RequestException as e:
+                    self.stdout.write(self.style.ERROR(f'Erro ao buscar cidades para {estado.nome}: {e}'))
+        return municipios_por_uf
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('localidades', '0002_popular_estados'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='estado',
+            options={'ordering': ['nome'], 'verbose_name': 'Estado', 'verbose_name_plural': 'Estados'},
+        ),
+        migrations.CreateModel(
+            name='GeocodificacaoCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lat_idx', models.IntegerField()),
+                ('lon_idx', models.IntegerField()),
+                ('resposta', models.JSONField()),
+                ('encontrado', models.BooleanField()),
+                ('atualizado_em', models.DateTimeField()),
+                ('expira_em', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Cache de Geocodificação',
+                'verbose_name_plural': 'Cache de Geocodificação',
+                'constraints': [models.UniqueConstraint(fields=('lat_idx', 'lon_idx'), name='geocodificacao_cache_unica')],
+            },
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+
+from applications.core.models import VersaoDados
 
 class Estado(models.Model):
     nome = models.CharField(max_length=50, unique=True)
@@ -9,6 +11,17 @@ class Estado(models.Model):
         verbose_name_plural = 'Estados'
         ordering = ['nome']  # Evita warnings de paginação
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            VersaoDados.incrementar('estados', 'cidades')  # O filtro ?estado= aceita a UF
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            resultado = super().delete(*args, **kwargs)
+            VersaoDados.incrementar('estados', 'cidades')
+        return resultado
+
     def __str__(self):
         return self.nome
 
@@ -21,5 +34,35 @@ class Cidade(models.Model):
         verbose_name_plural = 'Cidades'
         unique_together = [['nome', 'estado']]
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            VersaoDados.incrementar('cidades')
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            resultado = super().delete(*args, **kwargs)
+            VersaoDados.incrementar('cidades')
+        return resultado
+
+    def __str__(self):
+        return f'{self.nome}, {self.estado.uf}'
+
+class GeocodificacaoCache(models.Model):
+    """Resposta do Nominatim por célula de ~75 m (ver cache_geocodificacao.py)."""
+    lat_idx = models.IntegerField()
+    lon_idx = models.IntegerField()
+    resposta = models.JSONField()
+    encontrado = models.BooleanField()  # False: cache negativo, sem endereço
+    atualizado_em = models.DateTimeField()
+    expira_em = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = 'Cache de Geocodificação'
+        verbose_name_plural = 'Cache de Geocodificação'
+        constraints = [
+            models.UniqueConstraint(fields=['lat_idx', 'lon_idx'], name='geocodificacao_cache_unica'),
+        ]
+
     def __str__(self):
-        return f'{self.nome}, {self.estado.uf}'
\ No newline at end of file
+        return f'({self.lat_idx}, {self.lon_idx}) até {self.expira_em:%Y-%m-%d}'
@@ -1,2 +1,187 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
 
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from applications.core.referencia import limpar_cache
+from . import cache_geocodificacao
+from .geocodificador import localizar, recarregar
+from .models import Estado, Cidade, GeocodificacaoCache
+
+class DadosReferenciaTests(APITestCase):
+    def setUp(self):
+        limpar_cache()
+        self.estado = Estado.objects.create(nome='Test Estado', uf='TE')
+        self.outro_estado = Estado.objects.create(nome='Outro Estado', uf='OE')
+        for i in range(25):
+            Cidade.objects.create(nome=f'Cidade {i:02d}', estado=self.estado)
+        Cidade.objects.create(nome='Cidade Vizinha', estado=self.outro_estado)
+        self.url = reverse('cidade-list')
+
+    def test_filtro_por_estado_e_listagem_completa(self):
+        response = self.client.get(self.url, {'estado': self.estado.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 20)
+
+        response = self.client.get(self.url, {'estado': 'oe', 'todos': 'true'})
+        self.assertEqual([cidade['nome'] for cidade in response.data], ['Cidade Vizinha'])
+
+        response = self.client.get(self.url, {'estado': 'Estado'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cache_e_etag(self):
+        primeira = self.client.get(self.url, {'todos': 'true'})
+        etag = primeira['ETag']
+        self.assertEqual(len(primeira.data), 26)
+
+        with self.assertNumQueries(1):  # Apenas a leitura da versão
+            repetida = self.client.get(self.url, {'todos': 'true'})
+        self.assertEqual(repetida.data, primeira.data)
+
+        response = self.client.get(self.url, {'todos': 'true'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_alteracao_invalida_o_cache(self):
+        etag = self.client.get(self.url, {'todos': 'true'})['ETag']
+        Cidade.objects.create(nome='Cidade Nova', estado=self.estado)
+
+        response = self.client.get(self.url, {'todos': 'true'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data), 27)
+
+class GeocodificadorOfflineTests(APITestCase):
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        self.estado = Estado.objects.get(uf='SP')  # Criado pela migração 0002_popular_estados
+        self.sao_paulo = Cidade.objects.create(nome='São Paulo', estado=self.estado)
+        self.guarulhos = Cidade.objects.create(nome='Guarulhos', estado=self.estado)
+
+        csv_municipios = os.path.join(self.pasta, 'municipios.csv')
+        with open(csv_municipios, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(
+                'codigo_ibge,nome,latitude,longitude,codigo_uf\n'
+                '3550308,Sao Paulo,-23.5329,-46.6395,35\n'
+                '3518800,Guarulhos,-23.4538,-46.5333,35\n'
+                '3304557,Rio de Janeiro,-22.9129,-43.2003,33\n'
+            )
+        self.indice = os.path.join(self.pasta, 'geocodificador.npz')
+        self.saida = StringIO()
+        with self.settings(GEOCODIFICADOR_ARQUIVO=self.indice):
+            call_command('construir_geocodificador', csv_municipios, stdout=self.saida)
+        self.addCleanup(recarregar)
+
+    def test_resolve_sem_rede(self):
+        self.assertIn('1 município(s) sem cidade correspondente', self.saida.getvalue())
+        with self.settings(GEOCODIFICADOR_ARQUIVO=self.indice):
+            response = self.client.get(reverse('analisar-localizacao'), {'latitude': '-23.46', 'longitude': '-46.54'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['fonte'], 'local')
+            self.assertEqual(response.data['cidade_id'], self.guarulhos.id)
+            self.assertEqual(response.data['estado_id'], self.estado.id)
+
+            self.assertEqual(localizar(-23.55, -46.63)['cidade_id'], self.sao_paulo.id)
+            self.assertIsNone(localizar(-3.1, -60.0))  # Longe de qualquer sede do índice
+
+    def test_divisa_entre_sedes_recorre_ao_nominatim(self):
+        cache_geocodificacao.limpar_memoria()
+        self.addCleanup(cache_geocodificacao.limpar_memoria)
+        # Resposta do Nominatim já em cache: o teste não usa a rede
+        rodovia = {'category': 'highway', 'address': {'city': 'Guarulhos', 'state': 'São Paulo'}}
+        for latitude, longitude in [(-23.4934, -46.5864), (-23.46, -46.54)]:
+            cache_geocodificacao.consultar(latitude, longitude, lambda: rodovia)
+
+        with self.settings(GEOCODIFICADOR_ARQUIVO=self.indice):
+            # A meio caminho das duas sedes: o centroide mais próximo não decide
+            self.assertIsNone(localizar(-23.4934, -46.5864))
+            response = self.client.get(reverse('analisar-localizacao'), {'latitude': '-23.4934', 'longitude': '-46.5864'})
+            self.assertEqual(
+                (response.data['fonte'], response.data['cidade_id'], response.data['jurisdicao_sugerida']),
+                ('nominatim', self.guarulhos.id, 'FEDERAL')
+            )
+
+            # Resposta local, com a categoria da via vinda do cache
+            response = self.client.get(reverse('analisar-localizacao'), {'latitude': '-23.46', 'longitude': '-46.54'})
+            self.assertEqual((response.data['fonte'], response.data['jurisdicao_sugerida']), ('local', 'FEDERAL'))
+
+    def test_parametros_invalidos(self):
+        response = self.client.get(reverse('analisar-localizacao'), {'latitude': 'abc', 'longitude': '-46.54'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+@override_settings(NOMINATIM_CACHE_REVALIDAR_EM_SEGUNDO_PLANO=False)
+class CacheGeocodificacaoTests(APITestCase):
+    def setUp(self):
+        cache_geocodificacao.limpar_memoria()
+        self.addCleanup(cache_geocodificacao.limpar_memoria)
+        self.chamadas = 0
+
+    def _remoto(self, resposta):
+        def buscar():
+            self.chamadas += 1
+            return resposta
+        return buscar
+
+    def test_coordenadas_proximas_compartilham_a_resposta(self):
+        resposta = {'address': {'city': 'São Paulo', 'state': 'São Paulo'}}
+        for latitude, longitude in [(-23.5495, -46.6327), (-23.5497, -46.6329), (-23.5499, -46.6331)]:
+            self.assertEqual(cache_geocodificacao.consultar(latitude, longitude, self._remoto(resposta)), resposta)
+        self.assertEqual(self.chamadas, 1)
+
+        # Outro worker: memória vazia, mesma tabela
+        cache_geocodificacao.limpar_memoria()
+        cache_geocodificacao.consultar(-23.5495, -46.6327, self._remoto(resposta))
+        self.assertEqual(self.chamadas, 1)
+        self.assertEqual(cache_geocodificacao.estatisticas()['acertos_banco'], 1)
+
+    def test_cache_negativo_e_revalidacao_de_entrada_obsoleta(self):
+        sem_endereco = {'error': 'Unable to geocode'}
+        cache_geocodificacao.consultar(-10.0, -50.0, self._remoto(sem_endereco))
+        registro = GeocodificacaoCache.objects.get()
+        self.assertFalse(registro.encontrado)
+        self.assertLess(registro.expira_em, timezone.now() + timedelta(days=2))
+
+        GeocodificacaoCache.objects.update(expira_em=timezone.now() - timedelta(seconds=1))
+        cache_geocodificacao.limpar_memoria()
+        novo = {'address': {'state': 'Tocantins'}}
+        # A entrada vencida é servida e renovada logo em seguida
+        self.assertEqual(cache_geocodificacao.consultar(-10.0, -50.0, self._remoto(novo)), sem_endereco)
+        self.assertEqual(cache_geocodificacao.consultar(-10.0, -50.0, self._remoto(novo)), novo)
+        self.assertEqual(self.chamadas, 2)
+
+        contadores = cache_geocodificacao.estatisticas()
+        self.assertEqual((contadores['obsoletos'], contadores['revalidacoes']), (1, 1))
+
+class PopulateCitiesTests(APITestCase):
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        self.snapshot = os.path.join(self.pasta, 'municipios.json')
+        uf = lambda sigla: {'mesorregiao': {'UF': {'sigla': sigla}}}  # noqa: E731
+        with open(self.snapshot, 'w', encoding='utf-8') as arquivo:
+            json.dump([
+                {'id': 5208707, 'nome': 'Goiânia', 'microrregiao': uf('GO')},
+                {'id': 5201405, 'nome': 'Aparecida de Goiânia', 'microrregiao': uf('GO')},
+                {'id': 3550308, 'nome': 'São Paulo', 'microrregiao': uf('SP')},
+            ], arquivo)
+
+    def test_carga_offline_idempotente(self):
+        Cidade.objects.create(nome='Goiânia', estado=Estado.objects.get(uf='GO'))
+        saida = StringIO()
+        call_command('populate_cities', from_file=self.snapshot, salvar=os.path.join(self.pasta, 'copia.json'), stdout=saida)
+        self.assertIn('GO: 1 cidade(s) adicionada(s), 1 já existente(s)', saida.getvalue())
+        self.assertEqual(Cidade.objects.count(), 3)
+
+        # O snapshot gravado por --salvar pode ser lido de volta
+        call_command('populate_cities', from_file=os.path.join(self.pasta, 'copia.json'), stdout=StringIO())
+        self.assertEqual(Cidade.objects.count(), 3)
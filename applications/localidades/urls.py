@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import EstadoViewSet, CidadeViewSet, AnalisarLocalizacaoView
+from .views import EstadoViewSet, CidadeViewSet, AnalisarLocalizacaoView, EstatisticasCacheGeocodificacaoView
 
 router = DefaultRouter()
 router.register(r'estados', EstadoViewSet, basename='estado')
@@ -9,4 +9,5 @@ router.register(r'cidades', CidadeViewSet, basename='cidade')
 urlpatterns = [
     path('', include(router.urls)),
     path('analisar/', AnalisarLocalizacaoView.as_view(), name='analisar-localizacao'),
+    path('analisar/cache/', EstatisticasCacheGeocodificacaoView.as_view(), name='analisar-localizacao-cache'),
 ]
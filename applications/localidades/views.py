@@ -1,5 +1,10 @@
 from rest_framework.viewsets import ReadOnlyModelViewSet
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.exceptions import ValidationError
+from applications.core.cliente_http import cliente
+from applications.core.referencia import DadosReferenciaMixin
+from .cache_geocodificacao import consultar as consultar_cache, estatisticas as estatisticas_cache, guardada
+from .geocodificador import localizar
 from .models import Estado, Cidade
 from .serializers import EstadoSerializer, CidadeSerializer
 
@@ -9,15 +14,35 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-class EstadoViewSet(ReadOnlyModelViewSet):
+class EstadoViewSet(DadosReferenciaMixin, ReadOnlyModelViewSet):
     queryset = Estado.objects.all()
     serializer_class = EstadoSerializer
     permission_classes = [AllowAny]
+    conjunto_referencia = 'estados'
 
-class CidadeViewSet(ReadOnlyModelViewSet):
-    queryset = Cidade.objects.all()
+class CidadeViewSet(DadosReferenciaMixin, ReadOnlyModelViewSet):
     serializer_class = CidadeSerializer
     permission_classes = [AllowAny]
+    conjunto_referencia = 'cidades'
+
+    def get_queryset(self):
+        queryset = Cidade.objects.order_by('nome', 'id')
+        estado = self.request.query_params.get('estado')
+        if estado:
+            # Aceita o ID ou a UF do estado
+            if estado.isdigit():
+                queryset = queryset.filter(estado_id=int(estado))
+            elif len(estado) == 2:
+                queryset = queryset.filter(estado__uf=estado.upper())
+            else:
+                raise ValidationError({'error': 'O parâmetro "estado" deve ser o ID ou a UF do estado.'})
+        return queryset
+
+def jurisdicao_sugerida(dados_osm):
+    """Jurisdição sugerida pela categoria do OSM: rodovias são federais."""
+    if dados_osm.get('category') == 'highway':
+        return 'FEDERAL'
+    return 'MUNICIPAL'
 
 class AnalisarLocalizacaoView(APIView):
     permission_classes = [AllowAny]
@@ -32,6 +57,30 @@ class AnalisarLocalizacaoView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        try:
+            latitude_valor, longitude_valor = float(latitude), float(longitude)
+        except ValueError:
+            return Response(
+                {'error': 'Os parâmetros "latitude" e "longitude" devem ser números.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Índice local primeiro; o Nominatim só é consultado quando ele não decide
+        # com segurança (longe de qualquer sede ou perto da divisa entre duas)
+        local = localizar(latitude_valor, longitude_valor)
+        if local:
+            # A categoria da via só vem do Nominatim: usa a resposta já guardada, se houver
+            return Response({
+                'cidade': local['cidade'],
+                'cidade_id': local['cidade_id'],
+                'cidade_identificada': True,
+                'estado': local['estado'],
+                'estado_id': local['estado_id'],
+                'jurisdicao_sugerida': jurisdicao_sugerida(guardada(latitude_valor, longitude_valor) or {}),
+                'dados_completos_osm': {'city': local['cidade'], 'state': local['estado']},
+                'fonte': 'local',
+            })
+
         headers = {
             'User-Agent': settings.NOMINATIM_USER_AGENT
         }
@@ -43,16 +92,20 @@ class AnalisarLocalizacaoView(APIView):
             'addressdetails': 1
         }
 
-        try:
-            response = requests.get(settings.NOMINATIM_API_ENDPOINT, params=params, headers=headers, timeout=10)
+        def buscar_remoto():
+            response = cliente('nominatim').get(settings.NOMINATIM_API_ENDPOINT, params=params, headers=headers)
             response.raise_for_status()
+            return response.json()
+
+        try:
+            # Coordenadas a ~75 m umas das outras compartilham a mesma resposta
+            data = consultar_cache(latitude_valor, longitude_valor, buscar_remoto)
         except requests.exceptions.RequestException as e:
             return Response(
                 {'error': f'Erro ao contatar o serviço de geolocalização: {e}'},
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
 
-        data = response.json()
         address = data.get('address')
 
         if not address:
@@ -64,12 +117,6 @@ class AnalisarLocalizacaoView(APIView):
         cidade_nome = address.get('city') or address.get('municipality') or address.get('town') or address.get('village') or address.get('county')
         estado_nome = address.get('state')
         
-        categoria_osm = data.get('category')
-        if categoria_osm == 'highway':
-            jurisdicao_sugerida = 'FEDERAL'
-        else:
-            jurisdicao_sugerida = 'MUNICIPAL'
-
         estado_obj = None
         estado_id = None
         if estado_nome:
@@ -96,6 +143,14 @@ class AnalisarLocalizacaoView(APIView):
             'cidade_identificada': cidade_identificada,
             'estado': estado_nome,
             'estado_id': estado_id,
-            'jurisdicao_sugerida': jurisdicao_sugerida,
-            'dados_completos_osm': address
+            'jurisdicao_sugerida': jurisdicao_sugerida(data),
+            'dados_completos_osm': address,
+            'fonte': 'nominatim',
         })
+
+class EstatisticasCacheGeocodificacaoView(APIView):
+    """Contadores do cache do Nominatim neste worker, para dimensionar TTLs e o LRU."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(estatisticas_cache())
@@ -50,6 +50,7 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'applications.core.medicao.MedicaoMiddleware',  # Primeiro, para medir a requisição inteira
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -139,7 +140,7 @@ cloudinary.config(
 # Log para confirmar que Cloudinary foi configurado
 import logging
 logger = logging.getLogger(__name__)
-logger.info(f"Cloudinary configurado: cloud_name={parsed_url.hostname}")
+logger.info('Cloudinary configurado: cloud_name=%s', parsed_url.hostname)
 
 # Configuração de Storage (Django 4.2+)
 STORAGES = {
@@ -188,10 +189,107 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
 ]
 
+# Índice de proximidade em memória (por worker): intervalo entre sincronizações
+# incrementais e entre reconstruções completas, em segundos
+PROXIMIDADE_SINCRONIZACAO_SEGUNDOS = config('PROXIMIDADE_SINCRONIZACAO_SEGUNDOS', default=5, cast=int)
+PROXIMIDADE_RECONSTRUCAO_SEGUNDOS = config('PROXIMIDADE_RECONSTRUCAO_SEGUNDOS', default=600, cast=int)
+
+# Geocodificação reversa offline (ver localidades/geocodificador.py): índice gerado
+# pelo comando construir_geocodificador. A sede mais próxima só é aceita a até
+# DISTANCIA_SEGURA metros, ou quando a segunda está MARGEM vezes mais longe (e
+# nunca além de DISTANCIA_MAXIMA); sem o arquivo, ou na dúvida, vale o Nominatim
+GEOCODIFICADOR_ARQUIVO = config('GEOCODIFICADOR_ARQUIVO', default=str(BASE_DIR / 'dados' / 'geocodificador.npz'))
+GEOCODIFICADOR_DISTANCIA_MAXIMA = config('GEOCODIFICADOR_DISTANCIA_MAXIMA', default=20000, cast=int)
+GEOCODIFICADOR_DISTANCIA_SEGURA = config('GEOCODIFICADOR_DISTANCIA_SEGURA', default=2000, cast=int)
+GEOCODIFICADOR_MARGEM = config('GEOCODIFICADOR_MARGEM', default=2.0, cast=float)
+
 NOMINATIM_API_ENDPOINT = config('NOMINATIM_API_ENDPOINT', default='https://nominatim.openstreetmap.org/reverse')
 
 NOMINATIM_USER_AGENT = config('NOMINATIM_USER_AGENT', default='VozDoPovo Backend')
 
+# Segundos que a jurisdição de um gestor fica em cache (ver gestao_publica/jurisdicao.py)
+JURISDICAO_CACHE_TTL = config('JURISDICAO_CACHE_TTL', default=60, cast=int)
+
+# Normalização das fotos das denúncias (ver denuncias/imagens.py)
+FOTO_DIMENSAO_MAXIMA = config('FOTO_DIMENSAO_MAXIMA', default=1600, cast=int)
+FOTO_QUALIDADE = config('FOTO_QUALIDADE', default=82, cast=int)
+FOTO_MAX_PIXELS = config('FOTO_MAX_PIXELS', default=4_000_000, cast=int)  # Formatos sem decodificação reduzida (não JPEG)
+FOTOS_EM_SEGUNDO_PLANO = config('FOTOS_EM_SEGUNDO_PLANO', default=False, cast=bool)
+FOTOS_TRABALHADORES = config('FOTOS_TRABALHADORES', default=2, cast=int)
+FOTO_VARIANTES_ESPERA_FALHA = config('FOTO_VARIANTES_ESPERA_FALHA', default=3600, cast=int)  # Segundos até tentar de novo
+
+# Deduplicação por foto (ver denuncias/hash_foto.py): até quantos bits de diferença
+# no dHash contam como a mesma foto (no máximo 3) e a que distância do ponto
+# informado uma denúncia com a mesma foto ainda recebe o apoio
+FOTO_HASH_DISTANCIA_MAXIMA = config('FOTO_HASH_DISTANCIA_MAXIMA', default=3, cast=int)
+# A partir de quantos bits duas fotos são de coisas diferentes e a proximidade não as junta (0 desativa)
+FOTO_HASH_DISTANCIA_OUTRA_FOTO = config('FOTO_HASH_DISTANCIA_OUTRA_FOTO', default=28, cast=int)
+FOTO_DUPLICADA_RAIO_METROS = config('FOTO_DUPLICADA_RAIO_METROS', default=1000, cast=int)
+
+# Clientes HTTP para serviços externos (ver core/cliente_http.py). O limite de taxa é
+# compartilhado entre os workers da máquina; a política do Nominatim é 1 req/s.
+CLIENTES_HTTP = {
+    'nominatim': {
+        'taxa': 1.0, 'capacidade': 1, 'espera_maxima': 1.5,
+        'timeout': (3.05, 5), 'tentativas': 1,
+        'falhas_para_abrir': 3, 'pausa_disjuntor': 30.0,
+    },
+    'ibge': {
+        'taxa': 10.0, 'capacidade': 10, 'espera_maxima': 30.0,
+        'timeout': (3.05, 30), 'tentativas': 3,
+    },
+}
+CLIENTES_HTTP_DIRETORIO = config('CLIENTES_HTTP_DIRETORIO', default=None)
+
+# Cache das respostas do Nominatim (ver localidades/cache_geocodificacao.py), em segundos
+NOMINATIM_CACHE_TTL = config('NOMINATIM_CACHE_TTL', default=30 * 24 * 3600, cast=int)
+NOMINATIM_CACHE_TTL_NEGATIVO = config('NOMINATIM_CACHE_TTL_NEGATIVO', default=24 * 3600, cast=int)
+NOMINATIM_CACHE_OBSOLETO = config('NOMINATIM_CACHE_OBSOLETO', default=7 * 24 * 3600, cast=int)
+NOMINATIM_CACHE_TAMANHO_MEMORIA = config('NOMINATIM_CACHE_TAMANHO_MEMORIA', default=4096, cast=int)
+NOMINATIM_CACHE_REVALIDAR_EM_SEGUNDO_PLANO = config('NOMINATIM_CACHE_REVALIDAR_EM_SEGUNDO_PLANO', default=True, cast=bool)
+
+# Logs (ver core/registro.py): JSON em stderr, escrito por uma thread a partir de
+# uma fila em memória. LOG_AMOSTRAGEM guarda só uma fração dos registros abaixo de
+# WARNING de cada logger, ex.: "applications.denuncias.services=0.1,django.request=0.5"
+LOG_NIVEL = config('LOG_NIVEL', default='INFO')
+LOG_AMOSTRAGEM = {
+    nome.strip(): float(taxa)
+    for nome, taxa in (item.split('=', 1) for item in config('LOG_AMOSTRAGEM', default='', cast=Csv()))
+}
+LOG_TAMANHO_FILA = config('LOG_TAMANHO_FILA', default=10000, cast=int)
+
+# Fração das requisições com detalhamento (banco, cache, HTTP, storage) no
+# Server-Timing e no log de acesso; as demais levam só a duração total (ver core/medicao.py)
+MEDICAO_AMOSTRAGEM = config('MEDICAO_AMOSTRAGEM', default=1.0, cast=float)
+
+# Métricas do /api/metrics/ (ver core/metricas.py): um arquivo por worker neste
+# diretório, que deve ser o mesmo para todos os workers da máquina. Com
+# METRICAS_TOKEN, a coleta exige "Authorization: Bearer <token>".
+METRICAS_DIRETORIO = config('METRICAS_DIRETORIO', default=None)
+METRICAS_TOKEN = config('METRICAS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'applications.core.registro.FormatadorJSON'},
+    },
+    'filters': {
+        'amostragem': {'()': 'applications.core.registro.FiltroAmostragem', 'taxas': LOG_AMOSTRAGEM},
+    },
+    'handlers': {
+        'fila': {
+            '()': 'applications.core.registro.ManipuladorFila',
+            'tamanho_fila': LOG_TAMANHO_FILA,
+            'formatter': 'json',
+            'filters': ['amostragem'],
+        },
+    },
+    'loggers': {
+        'applications': {'handlers': ['fila'], 'level': LOG_NIVEL, 'propagate': False},
+    },
+}
+
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = config('EMAIL_HOST', default='smtp-relay.brevo.com')
 EMAIL_PORT = int(config('EMAIL_PORT', default='587') or '587')
@@ -7,6 +7,7 @@ urlpatterns = [
     path('api/health/', core_views.health_check, name='health_check'),
     path('api/performance/', core_views.performance_test, name='performance_test'),
     path('api/echo/', core_views.echo_test, name='echo_test'),
+    path('api/metrics/', core_views.metrics, name='metrics'),
     path('api/auth/', include('applications.autenticacao.urls')),
     path('api/denuncias/', include('applications.denuncias.urls')),
     path('api/localidades/', include('applications.localidades.urls')),